@@ -1,10 +1,7 @@
-import plistlib
-import zipfile
 import os
-archive = zipfile.ZipFile(f'.{os.sep}frameworks{os.sep}Applitools_iOS.xcframework.zip', 'r')
-inner_loc = f"Applitools_iOS.xcframework/ios-arm64/Applitools_iOS.framework/Info.plist"
-imgdata = archive.read(inner_loc)
+import zipfile
 
-pl = plistlib.loads(imgdata)
+from instrument import ZipIndex
 
-print(f"{pl['CFBundleShortVersionString']}.{pl['CFBundleVersion']}")
+with zipfile.ZipFile(f'.{os.sep}frameworks{os.sep}Applitools_iOS.xcframework.zip', 'r') as archive:
+    print(ZipIndex(archive).sdk_version("Applitools_iOS.xcframework"))
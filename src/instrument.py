@@ -1,23 +1,102 @@
 from __future__ import print_function, unicode_literals
 
 import argparse
+import atexit
+import copy
+import hashlib
+import json
 import os
-import plistlib
+import posixpath
 import shutil
-import subprocess
+import struct
 import sys
-import tempfile
-import traceback
-import zipfile
+import threading
+import time
+import zlib
+from collections import deque
+from contextlib import contextmanager, nullcontext
 from enum import Enum
-from io import BytesIO
-from pathlib import Path
-from urllib.request import urlopen
+from pathlib import Path, PurePosixPath
+from urllib.parse import parse_qs, urlsplit
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+# Modules needed by instrumentation only (asyncio, concurrent.futures, ctypes,
+# http.client, ipaddress, mmap, plistlib, subprocess, tempfile, traceback,
+# urllib.request, zipfile) are imported by the functions using them, so
+# `--version` and argument errors don't pay for them
 
 __version__ = "1.0.0"
 
 FILES_COPY_SKIP_LIST = [".DS_Store"]
+# Written into installed SDK to update it incrementally next time
+SDK_MANIFEST_NAME = "applitoolsify_manifest.json"
 VERBOSE = False
+# Set by `--verify-crc`, members copied without recompression are decompressed to check CRC
+VERIFY_CRC = False
+# Set by `--profile`, collects spans of instrumentation phases
+PROFILER = None  # type: Profiler | None
+# Profilers of `instrument` API calls in progress by thread ident
+_API_CALLS = {}  # type: dict[int, Profiler]
+# Scratch dirs in use with the parent dir they are in and bytes reserved
+# there, removed at exit when a run is interrupted
+_SCRATCH_DIRS = {}  # type: dict[str, tuple[str, int]]
+_SCRATCH_LOCK = threading.Lock()
+TRACE_FILE_NAME = "applitoolsify_trace.json"
+SERVICE_PORT = 8765
+# Written into the cache dir by `--serve`, required by jobs with `path`
+SERVICE_TOKEN_FILE_NAME = "service.token"
+# Already compressed formats, stored in archives without compression
+STORED_EXTENSIONS = [
+    ".aac", ".car", ".gif", ".gz", ".heic", ".ipa", ".jar", ".jpeg", ".jpg",
+    ".m4a", ".m4v", ".mov", ".mp3", ".mp4", ".png", ".webp", ".zip",
+]
+SERVICE_MAX_QUEUE = 64
+CACHE_DIR_ENV = "APPLITOOLSIFY_CACHE_DIR"
+CACHE_MAX_SIZE = 1024 * 1024 * 1024  # 1 GiB
+CACHE_MAX_ENTRIES = 5
+RESULT_CACHE_MAX_SIZE = 4 * 1024 * 1024 * 1024  # 4 GiB
+RESULT_CACHE_MAX_ENTRIES = 20
+CHUNK_SIZE = 1024 * 1024
+COMPRESS_SPOOL_SIZE = 4 * 1024 * 1024  # larger compressed members are spooled to disk
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_RETRIES = 3
+# Archives of at least two segments are downloaded over parallel connections
+DOWNLOAD_CONNECTIONS = 4
+DOWNLOAD_SEGMENT_SIZE = 8 * 1024 * 1024
+DOWNLOAD_TIMEOUT = 60
+# Stored `apk` members are aligned like `zipalign -p` does, native libraries
+# to the page size so they can be mapped into memory straight from the `apk`
+APK_ALIGNMENT = 4
+APK_PAGE_ALIGNMENT = 4096
+# Artifactory publishes digest of every artifact in this header
+CHECKSUM_HEADER = "X-Checksum-Sha256"
+ZIP64_EXTRA_ID = 0x0001
+# Timestamp of members written by applitoolsify, same input gives same archive
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ALIGNMENT_EXTRA_ID = 0xD935
+# Permissions of extracted SDK files, members copied from the SDK archive get them too
+SDK_FILE_MODE = 0o775
+# Mach-O magic numbers, see <mach-o/fat.h> and <mach-o/loader.h>
+FAT_MAGIC = 0xCAFEBABE
+FAT_MAGIC_64 = 0xCAFEBABF
+MH_MAGIC = 0xFEEDFACE
+MH_MAGIC_64 = 0xFEEDFACF
+# Capability bits of `cpusubtype`, e.g. pointer authentication ABI version of arm64e
+CPU_SUBTYPE_MASK = 0xFF000000
+# Java class files share `FAT_MAGIC`, their version stored in place of arch count is at least 45
+MACHO_MAX_FAT_ARCHS = 44
+# Holds fat header with `MACHO_MAX_FAT_ARCHS` entries
+MACHO_HEADER_SIZE = 4096
+# Entries used recently are never evicted. Protects jobs on platforms without shared locks.
+CACHE_EVICT_GRACE_SECONDS = 10 * 60
+# RAM-backed dirs preferred for extracted files when they fit
+SCRATCH_RAM_DIRS = ["/dev/shm"]
+# Free space left for the rest of the system when picking a scratch dir
+SCRATCH_RESERVE = 64 * 1024 * 1024
 # Required when working with pyinstaller
 if hasattr(sys, '_MEIPASS'):
     RELATIVE = sys._MEIPASS
@@ -28,11 +107,11 @@ def validate_path_to_app(value):
     # type: (str)->bool
     path = Path(value)
     if not path.exists():
-        print("! Path `{}` does not exist".format(value))
+        print_info("! Path `{}` does not exist".format(value))
         return False
-    if path.suffix not in [".app", ".ipa"]:
-        print(
-            "! Supported only `*.app` or `*.ipa` apps. You provided: `{}`".format(
+    if path.suffix not in [".app", ".ipa", ".apk"]:
+        print_info(
+            "! Supported only `*.app`, `*.ipa` or `*.apk` apps. You provided: `{}`".format(
                 value
             )
         )
@@ -40,13 +119,134 @@ def validate_path_to_app(value):
     return True
 
 
+def print_info(*args, **kwargs):
+    """Print progress, silent in threads running `instrument` API calls."""
+    if not _API_CALLS or threading.get_ident() not in _API_CALLS:
+        print(*args, **kwargs)
+
+
 def print_verbose(*args, **kwargs):
     if VERBOSE:
-        print(*args, **kwargs)
+        print_info(*args, **kwargs)
+
+
+class Profiler(object):
+    """Record timed spans of instrumentation phases.
+
+    Spans are exported as Chrome trace events, viewable in `chrome://tracing`
+    or Perfetto, and summarized per phase in a table.
+    """
+
+    def __init__(self):
+        self.events = []  # type: list[dict]
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._threads = set()  # type: set[int]
+
+    @contextmanager
+    def span(self, name, category="phase", **args):
+        # type: (str, str, ...) -> Iterator[dict]
+        """Time the block, counters added to the yielded dict are stored with it."""
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            self._add(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": (start - self._start) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "args": args,
+                }
+            )
+
+    def _add(self, event):
+        # type: (dict) -> None
+        thread = threading.current_thread()
+        event.update(pid=os.getpid(), tid=thread.ident)
+        with self._lock:
+            if thread.ident not in self._threads:
+                self._threads.add(thread.ident)
+                self.events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": event["pid"],
+                        "tid": thread.ident,
+                        "args": {"name": thread.name},
+                    }
+                )
+            self.events.append(event)
+
+    def spans(self):
+        # type: () -> list[dict]
+        with self._lock:
+            return [event for event in self.events if event["ph"] == "X"]
+
+    def write_trace(self, path):
+        # type: (str | Path) -> None
+        with self._lock:
+            trace = {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+        with open(path, "w") as f:
+            json.dump(trace, f)
+
+    def totals(self):
+        # type: () -> dict[str, dict]
+        """Total time and counters of phases in order of first start.
+
+        Spans of other categories than "phase" are named `category:name`.
+        """
+        totals = {}  # type: dict[str, dict]
+        for event in sorted(self.spans(), key=lambda e: e["ts"]):
+            name = event["name"]
+            if event["cat"] != "phase":
+                name = "{}:{}".format(event["cat"], name)
+            total = totals.setdefault(
+                name, {"count": 0, "seconds": 0.0, "bytes": 0, "files": 0}
+            )
+            total["count"] += 1
+            total["seconds"] += event["dur"] / 1e6
+            total["bytes"] += event["args"].get("bytes", 0)
+            total["files"] += event["args"].get("files", 0)
+        return totals
+
+    def summary(self):
+        # type: () -> str
+        """Table of phases in order of first start with their total time and counters."""
+        lines = [
+            "{:<24} {:>6} {:>10} {:>10} {:>8}".format(
+                "phase", "count", "seconds", "size", "files"
+            )
+        ]
+        for name, total in self.totals().items():
+            lines.append(
+                "{:<24} {:>6} {:>10.3f} {:>10} {:>8}".format(
+                    name,
+                    total["count"],
+                    total["seconds"],
+                    format_size(total["bytes"]) if total["bytes"] else "-",
+                    total["files"] or "-",
+                )
+            )
+        return "\n".join(lines)
+
+
+def profile_span(name, category="phase", **args):
+    # type: (str, str, ...) -> ContextManager[dict]
+    """Span of `PROFILER` or of the current API call, a no-op when profiling is off."""
+    profiler = _API_CALLS.get(threading.get_ident()) if _API_CALLS else None
+    profiler = profiler or PROFILER
+    if profiler is None:
+        return nullcontext(args)
+    return profiler.span(name, category, **args)
 
 
 class SdkParams(Enum):
     ios_nmg = "ios_nmg"
+    android_nmg = "android_nmg"
 
 
 class SdkData(object):
@@ -58,10 +258,29 @@ class SdkData(object):
         self.download_url = download_url
         self.sdk_location = None  # type: Path | None
         self.local_url = local_url
+        self.version = None  # type: str | None
+        self.sha256 = None  # type: str | None
+        # pinned digest of the archive, download fails on mismatch
+        self.expected_sha256 = None  # type: str | None
+        self.files = None  # type: dict[str, dict] | None
+        # downloaded archive, its members are copied into `ipa` without recompression
+        self.archive = None  # type: Path | None
 
     def __str__(self):
         return "SdkData<{}>".format(self.name)
 
+    def manifest(self):
+        # type: () -> dict
+        """Content manifest written into instrumented apps, see `build_manifest`."""
+        if self.files is None:
+            self.files = build_manifest(self.sdk_location)
+        return {
+            "name": self.name,
+            "version": self.version,
+            "sha256": self.sha256,
+            "files": self.files,
+        }
+
     def add_sdk_location(self, path):
         # type: (Path) -> SdkData
         self.sdk_location = path
@@ -76,379 +295,3942 @@ SUPPORTED_FRAMEWORKS = {
             "local_url": f"file://{RELATIVE}/frameworks/Applitools_iOS.xcframework.zip",
         }
     ),
+    # not released yet, the archive is given with `--sdk-url`
+    SdkParams.android_nmg: SdkData(
+        **{
+            "name": "Applitools_Android",
+            "download_url": None,
+            "local_url": None,
+        }
+    ),
+}
+# SDK required by apps of every extension
+APP_SDKS = {
+    ".app": SdkParams.ios_nmg,
+    ".ipa": SdkParams.ios_nmg,
+    ".apk": SdkParams.android_nmg,
 }
 
 
-class SdkDownloadManager(object):
-    """Download and extract selected SDK."""
+def sdk_data_for(sdk_name, expected_sha256=None, sdk_url=None):
+    # type: (str, str | None, str | None) -> SdkData
+    """Copy of supported SDK, downloaded from `sdk_url` instead of the release if given."""
+    sdk_data = copy.copy(SUPPORTED_FRAMEWORKS[SdkParams(sdk_name)])
+    sdk_data.expected_sha256 = expected_sha256
+    if sdk_url:
+        sdk_data.download_url = sdk_data.local_url = sdk_url
+    return sdk_data
 
-    def __init__(self, sdk_data, local):
-        # type: (SdkData, bool) -> None
-        self.sdk_data = sdk_data
-        self.local = local
-        self.sdks_dir = Path(os.getcwd())  # curr dir
-        self.sdk_data.add_sdk_location(self.sdks_dir.joinpath(self.sdk_data.name))
 
-    @classmethod
-    def from_sdk_name(cls, sdk_name, local):
-        # type: (str, bool) -> SdkDownloadManager
-        sdk = SdkParams(sdk_name)
-        sdk_data = SUPPORTED_FRAMEWORKS[sdk]
-        return cls(sdk_data, local)
+def default_cache_dir():
+    # type: () -> Path
+    """Location of the persistent SDK cache, overridable with `APPLITOOLSIFY_CACHE_DIR`."""
+    if os.environ.get(CACHE_DIR_ENV):
+        return Path(os.environ[CACHE_DIR_ENV])
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or Path.home().joinpath("AppData", "Local")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or Path.home().joinpath(".cache")
+    return Path(base).joinpath("applitoolsify")
+
+
+def build_manifest(path):
+    # type: (Path) -> dict[str, dict]
+    """Map posix path of every file under `path` to its `size` and `sha256`."""
+    files = {}
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            if name in FILES_COPY_SKIP_LIST or name == SDK_MANIFEST_NAME:
+                continue
+            file_path = os.path.join(root, name)
+            sha256 = hashlib.sha256()
+            with open(file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    sha256.update(chunk)
+            files[Path(file_path).relative_to(path).as_posix()] = {
+                "size": os.path.getsize(file_path),
+                "sha256": sha256.hexdigest(),
+            }
+    return files
+
+
+def dir_size(path):
+    # type: (Path) -> int
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+class FileLock(object):
+    """Advisory inter-process lock on a lock file.
+
+    Uses `fcntl.flock` on POSIX and `msvcrt.locking` on Windows. Windows has
+    no shared locks, so there a shared lock is a no-op.
+    """
+
+    def __init__(self, path, shared=False):
+        # type: (Path, bool) -> None
+        self.path = Path(path)
+        self.shared = shared
+        self._fd = None  # type: int | None
 
     def __enter__(self):
-        # type: () -> SdkData
-        return self.download_and_extract()
+        self.acquire()
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.remove_sdk_data()
+        self.release()
 
-    def remove_sdk_data(self):
-        shutil.rmtree(self.sdk_data.sdk_location)
+    def acquire(self, blocking=True):
+        # type: (bool) -> bool
+        if self._fd is not None:
+            raise RuntimeError("`{}` is already locked".format(self.path))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            locked = self._lock(fd, blocking)
+        except BaseException:
+            os.close(fd)
+            raise
+        if not locked:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
 
-    def download_and_extract(self):
-        # type: () -> SdkData
-        if self.sdk_data.sdk_location.exists():
-            print_verbose(
-                "We've detected saved version of `{}` in `{}`".format(
-                    self.sdk_data.name, self.sdk_data.sdk_location
-                )
-            )
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            if sys.platform == "win32":
+                if not self.shared:
+                    msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def _lock(self, fd, blocking):
+        # type: (int, bool) -> bool
+        if sys.platform == "win32":
+            if self.shared:
+                return True
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                    return True
+                except OSError:
+                    if not blocking:
+                        return False
+                    time.sleep(0.1)
+        flags = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(fd, flags)
+        except BlockingIOError:
+            return False
+        return True
+
+
+class IntegrityError(RuntimeError):
+    """Raised when digest of downloaded data doesn't match the expected one."""
 
-        print_verbose(
-            "Downloading `{}` to `{}`".format(
-                self.sdk_data.name, self.sdk_data.sdk_location
-            )
-        )
-       
-        uri = self.sdk_data.local_url
-        if not self.local:
-            uri = self.sdk_data.download_url
 
-        with urlopen(uri) as zipresp:
-            with zipfile.ZipFile(BytesIO(zipresp.read())) as zfile:
-                extracted_path = Archiver.extract_specific_folder(
-                    self.sdks_dir, zfile, extract_dir_name=self.sdk_data.name
+def check_sha256(uri, sha256, expected=None, published=None):
+    # type: (str, str, str | None, str | None) -> None
+    """Raise `IntegrityError` if `sha256` differs from pinned or published digest."""
+    for source, digest in [("pinned", expected), ("published", published)]:
+        if digest and digest.strip().lower() != sha256:
+            raise IntegrityError(
+                "SHA-256 of `{}` is {}, but {} digest is {}".format(
+                    uri, sha256, source, digest
                 )
-        if extracted_path != self.sdk_data.sdk_location:
-            raise RuntimeError(
-                "Mismatch of extract desired location and actual sdk location location."
             )
-        return self.sdk_data
 
 
-class _InstrumentifyStrategy(object):
-    """Base Patch Strategy class. Helps to instrumentify app with specific SDK."""
+class StreamingDownloader(object):
+    """Stream a resource into a file object chunk by chunk, hashing it on the way.
+
+    Memory use is bounded by `chunk_size` no matter how big the resource is.
+    Interrupted transfer is resumed with `Range` request when the server
+    advertises `Accept-Ranges: bytes`, otherwise it is restarted. The digest
+    is checked against `expected_sha256` and the one published by the server.
+    """
 
     def __init__(
-        self, path_to_app, sdk_data, local, signing_certificate_name, provisioning_profile
+        self,
+        uri,
+        chunk_size=DOWNLOAD_CHUNK_SIZE,
+        retries=DOWNLOAD_RETRIES,
+        backoff=0.5,
+        expected_sha256=None,
     ):
-        # type: (Path, SdkData, bool, str, str) -> None
-        self.path_to_app = path_to_app
-        self.sdk_data = sdk_data
-        self.local = local,
-        self.signing_certificate_name = signing_certificate_name
-        self.provisioning_profile = provisioning_profile
+        # type: (str, int, int, float, str | None) -> None
+        self.uri = uri
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.backoff = backoff
+        self.expected_sha256 = expected_sha256
+        self.size = 0
+        self.sha256 = None  # type: str | None
 
-    @property
-    def app_frameworks(self):
-        # type: () -> Path
-        raise NotImplementedError
+    def download(self, target, response=None):
+        # type: (BinaryIO, HTTPResponse | None) -> str
+        """Write resource to `target` and return its sha256 hex digest."""
+        with profile_span("download", uri=self.uri) as span:
+            self._download(target, response)
+            span.update(bytes=self.size)
+        return self.sha256
 
-    @property
-    def sdk_in_app_frameworks(self):
-        # type: () -> Path
-        return self.app_frameworks.joinpath(self.sdk_data.name)
+    def _download(self, target, response):
+        # type: (BinaryIO, HTTPResponse | None) -> None
+        import http.client
+        import urllib.request
 
-    def instrumentify(self):
-        # type: () -> bool
-        raise NotImplementedError
+        if response is None:
+            response = urllib.request.urlopen(self.uri)
+        length = response.headers.get("Content-Length")
+        total = int(length) if length is not None else None
+        validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+        resumable = response.headers.get("Accept-Ranges") == "bytes"
+        published = response.headers.get(CHECKSUM_HEADER)
+        start = target.tell()
+        hasher = hashlib.sha256()
+        written = 0
+        attempt = 0
+        while True:
+            try:
+                if response is None:
+                    response = self._reconnect(written, resumable, validator)
+                    if response.getcode() != 206:
+                        # resource changed or range was ignored, start from scratch
+                        target.seek(start)
+                        target.truncate()
+                        hasher = hashlib.sha256()
+                        written = 0
+                        length = response.headers.get("Content-Length")
+                        total = int(length) if length is not None else None
+                        published = response.headers.get(CHECKSUM_HEADER)
+                with response:
+                    written += self._copy(response, target, hasher)
+                if total is not None and written < total:
+                    raise ConnectionError(
+                        "connection closed after {} of {} bytes".format(written, total)
+                    )
+                break
+            except (http.client.HTTPException, OSError) as e:
+                # reconnect is attempted on the next iteration, covered by retries too
+                response = None
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                print_verbose(
+                    "Download of `{}` interrupted ({}), retrying...".format(self.uri, e)
+                )
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+        target.flush()
+        self.size = written
+        self.sha256 = hasher.hexdigest()
+        check_sha256(self.uri, self.sha256, self.expected_sha256, published)
 
+    def _reconnect(self, written, resumable, validator):
+        # type: (int, bool, str | None) -> HTTPResponse
+        import urllib.request
 
-class IOSAppPatcherInstrumentifyStrategy(_InstrumentifyStrategy):
-    """Patch IOS `app` with specific SDK."""
+        request = urllib.request.Request(self.uri)
+        if resumable and written:
+            request.add_header("Range", "bytes={}-".format(written))
+            if validator:
+                request.add_header("If-Range", validator)
+        return urllib.request.urlopen(request)
 
-    @property
-    def app_frameworks(self):
-        return Path(self.path_to_app).joinpath("Frameworks")
+    def _copy(self, response, target, hasher):
+        # type: (HTTPResponse, BinaryIO, hashlib._Hash) -> int
+        copied = 0
+        while True:
+            chunk = response.read(self.chunk_size)
+            if not chunk:
+                return copied
+            target.write(chunk)
+            hasher.update(chunk)
+            copied += len(chunk)
 
-    def instrumentify(self):
-        # type: () -> bool
-        return shutil.copytree(self.sdk_data.sdk_location, self.sdk_in_app_frameworks)
 
-class ZipFileWithPermissions(zipfile.ZipFile):
-    """ Custom ZipFile class handling file permissions. """
-    def _extract_member(self, member, targetpath, pwd):
-        if not isinstance(member, zipfile.ZipInfo):
-            member = self.getinfo(member)
+class ResourceChanged(Exception):
+    """Raised when a resource changes between requests of a segmented download."""
 
-        targetpath = super()._extract_member(member, targetpath, pwd)
 
-        attr = member.external_attr >> 16
-        if attr != 0:
-            os.chmod(targetpath, attr)
-        return targetpath
+class ConnectionPool(object):
+    """Keep-alive HTTP connections to one host shared by download threads."""
 
-class IOSIpaInstrumentifyStrategy(_InstrumentifyStrategy):
-    """Patch IOS `ipa` with specific SDK and sign with a specified certificate."""
+    def __init__(self, url, timeout=DOWNLOAD_TIMEOUT):
+        # type: (str, float) -> None
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.timeout = timeout
+        self.opened = 0
+        self.closed = False
+        self._idle = []  # type: list[http.client.HTTPConnection]
+        self._lock = threading.Lock()
 
-    SECURITY = "/usr/bin/security"
-    CODESIGN = "/usr/bin/codesign"
+    @contextmanager
+    def connection(self):
+        # type: () -> Iterator[http.client.HTTPConnection]
+        """Idle or new connection, returned to the pool unless the block fails.
 
-    def __init__(self, *args, **kwargs):
-        super(IOSIpaInstrumentifyStrategy, self).__init__(*args, **kwargs)
+        Connections returned after `close` are closed instead.
+        """
+        import http.client
+
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self.opened += 1
+        if conn is None:
+            if self.scheme == "https":
+                conn = http.client.HTTPSConnection(self.netloc, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+        try:
+            yield conn
+        except BaseException:
+            conn.close()
+            raise
+        with self._lock:
+            if not self.closed:
+                self._idle.append(conn)
+                return
+        conn.close()
 
-        self.tmp_dir = tempfile.mkdtemp()
-        self.extracted_dir_path = Path(self.tmp_dir).joinpath("extracted")
-        self.entitlements_file_path = Path(self.tmp_dir).joinpath("entitlements.plist")
-        self._app_in_payload = None
-        with ZipFileWithPermissions(self.path_to_app) as zfile:
-            zfile.extractall(self.extracted_dir_path)
+    def close(self):
+        with self._lock:
+            self.closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
 
-    @property
-    def app_in_payload(self):
+
+class PrefixHasher(object):
+    """SHA-256 of a file written out of order, advanced over its written prefix.
+
+    Writers report ranges with `written`, `hash_until` reads them back in
+    order while the file is still being written, so they come from the page
+    cache.
+    """
+
+    def __init__(self, path):
+        # type: (Path) -> None
+        self.hashed = 0
+        self._hasher = hashlib.sha256()
+        self._ready = {}  # type: dict[int, int]
+        self._cond = threading.Condition()
+        # unbuffered, a read-ahead buffer would keep stale data of unwritten ranges
+        self._file = open(path, "rb", buffering=0)
+
+    def written(self, start, length):
+        # type: (int, int) -> None
+        with self._cond:
+            self._ready[start] = start + length
+            self._cond.notify()
+
+    def hash_until(self, size, pending):
+        # type: (int, list[futures.Future]) -> None
+        """Hash `size` bytes, returns early once any of `pending` writers failed."""
+        while self.hashed < size:
+            with self._cond:
+                while self.hashed not in self._ready:
+                    if any(
+                        future.done() and future.exception() is not None
+                        for future in pending
+                    ) or all(future.done() for future in pending):
+                        if self.hashed not in self._ready:
+                            return  # a writer failed
+                    self._cond.wait(0.1)
+                end = self._ready.pop(self.hashed)
+            self._file.seek(self.hashed)
+            remaining = end - self.hashed
+            while remaining:
+                chunk = self._file.read(min(remaining, CHUNK_SIZE))
+                if not chunk:
+                    raise IOError("`{}` is shorter than written".format(self._file.name))
+                self._hasher.update(chunk)
+                remaining -= len(chunk)
+            self.hashed = end
+
+    def hexdigest(self):
         # type: () -> str
-        if self._app_in_payload is None:
-            payload_in_app = self.extracted_dir_path.joinpath("Payload")
-            apps_in_payolad = os.listdir(payload_in_app)
-            if len(apps_in_payolad) > 1:
-                raise RuntimeError("Payload contains more then one app")
-            self._app_in_payload = payload_in_app.joinpath(apps_in_payolad[0])
-        return self._app_in_payload
+        return self._hasher.hexdigest()
 
-    @property
-    def app_frameworks(self):
-        return Path(self.app_in_payload).joinpath("Frameworks")
+    def close(self):
+        self._file.close()
 
-    def instrumentify(self):
-        # type: () -> bool
-        if not shutil.copytree(self.sdk_data.sdk_location, self.sdk_in_app_frameworks):
-            return False
 
-        try:
-            self._resign()
-        except Exception:
-            print("Failed to sign. Please, sign it manually")
-            if VERBOSE:
-                traceback.print_exc()
-            return False
+class SegmentedDownloader(object):
+    """Download a resource to a file in segments fetched over parallel connections.
 
-        try:
-            self._repackage()
-        except Exception:
-            print("Failed to repackage. Please, sign it manually")
-            if VERBOSE:
-                traceback.print_exc()
-            return False
-        return True
+    Size, `Accept-Ranges` and validator of the resource come from a `HEAD`
+    request or a response given to `download`. Segments of `segment_size` are
+    requested with `Range` and `If-Range` over a pool of `connections`
+    keep-alive connections, failed ones are resumed with exponential backoff.
+    The file is hashed in order while segments arrive, reading back written
+    data from the page cache instead of the disk after the download.
+    Resources without range support, smaller than two segments, behind a
+    proxy or not served over http are downloaded in a single stream by
+    `StreamingDownloader`.
+    """
 
-    def __extract_entitlements(self, profile_in_app_path):
-        pl_str = subprocess.check_output(
-            [self.SECURITY, "cms", "-D", "-i", profile_in_app_path]
-        )
-        pl = plistlib.loads(pl_str)
-        ent = pl["Entitlements"]
-        with open(self.entitlements_file_path, "wb") as f:
-            plistlib.dump(ent, f)
+    def __init__(
+        self,
+        uri,
+        connections=DOWNLOAD_CONNECTIONS,
+        segment_size=DOWNLOAD_SEGMENT_SIZE,
+        chunk_size=DOWNLOAD_CHUNK_SIZE,
+        retries=DOWNLOAD_RETRIES,
+        backoff=0.5,
+        expected_sha256=None,
+    ):
+        # type: (str, int, int, int, int, float, str | None) -> None
+        self.uri = uri
+        self.expected_sha256 = expected_sha256
+        self.connections = connections
+        self.segment_size = segment_size
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.backoff = backoff
+        self.size = 0
+        self.sha256 = None  # type: str | None
+        self.segments = 0
 
-    def __find_files_to_sign(self):
-        # type: () -> list[str]
-        to_sign_files = []
-        for root, dirs, files in os.walk(self.extracted_dir_path):
-            for name in files:
-                _, ext = os.path.splitext(name)
-                if ext.lstrip(".").lower() in ["dylib"]:
-                    to_sign_files.append(os.path.join(root, name))
-            for dir_name in dirs:
-                _, ext = os.path.splitext(dir_name)
-                if ext.lstrip(".").lower() in ["app", "appex", "framework"]:
-                    to_sign_files.append(os.path.join(root, dir_name))
-        return to_sign_files
+    def download(self, target, response=None):
+        # type: (Path | str, HTTPResponse | None) -> str
+        """Write resource to `target` path and return its sha256 hex digest."""
+        with profile_span("download", uri=self.uri) as span:
+            self._download(Path(target), response)
+            span.update(bytes=self.size, segments=self.segments)
+        return self.sha256
 
-    def __sign_files(self, to_sign_files):
-        # type: (list[str]) -> None
-        for to_sign in to_sign_files:
-            subprocess.check_call(
-                [
-                    self.CODESIGN,
-                    "--continue",
-                    "-f",
-                    "-s",
-                    self.signing_certificate_name,
-                    "--entitlements",
-                    self.entitlements_file_path,
-                    to_sign,
-                ]
-            )
+    def _download(self, target, response):
+        # type: (Path, HTTPResponse | None) -> None
+        import urllib.error
+        import urllib.request
 
-    def _resign(self):
-        if not all([self.signing_certificate_name, self.provisioning_profile]):
-            print_verbose(
-                "No `signing_certificate_name` and `provisioning_profile` provided. Skip signing..."
+        head = response is None
+        if head and urlsplit(self.uri).scheme in ("http", "https"):
+            try:
+                response = urllib.request.urlopen(
+                    urllib.request.Request(self.uri, method="HEAD")
+                )
+            except urllib.error.HTTPError as e:
+                print_verbose("`HEAD {}` failed ({})".format(self.uri, e))
+        if response is not None and self._segmentable(response):
+            with response:
+                url = response.geturl()
+                size = int(response.headers["Content-Length"])
+                validator = response.headers.get("ETag") or response.headers.get(
+                    "Last-Modified"
+                )
+                published = response.headers.get(CHECKSUM_HEADER)
+            try:
+                self._download_segments(target, url, size, validator)
+                check_sha256(self.uri, self.sha256, self.expected_sha256, published)
+                return
+            except ResourceChanged as e:
+                print_verbose("{}, downloading again in one stream".format(e))
+                response, head = None, True
+        with open(target, "wb") as f:
+            downloader = StreamingDownloader(
+                self.uri, self.chunk_size, self.retries, self.backoff, self.expected_sha256
             )
-            return
-        if sys.platform != "darwin":
-            print("Signing with script is available only on macOS. Skip signing...")
-            return
-        profile_in_app_path = Path(self.app_in_payload).joinpath(
-            "embedded.mobileprovision"
+            if head and response is not None:
+                response.close()
+                response = None
+            downloader.download(f, response)
+        self.size, self.sha256, self.segments = downloader.size, downloader.sha256, 1
+
+    def _segmentable(self, response):
+        # type: (HTTPResponse) -> bool
+        import urllib.request
+
+        url = response.geturl()
+        scheme = urlsplit(url).scheme
+        length = response.headers.get("Content-Length")
+        return (
+            self.connections > 1
+            and scheme in ("http", "https")
+            and scheme not in urllib.request.getproxies()
+            and response.headers.get("Accept-Ranges") == "bytes"
+            and length is not None
+            and int(length) >= 2 * self.segment_size
         )
-        shutil.copy2(self.provisioning_profile, profile_in_app_path)
+
+    def _download_segments(self, target, url, size, validator):
+        # type: (Path, str, int, str | None) -> None
+        from concurrent import futures
+
+        segments = [
+            (start, min(start + self.segment_size, size) - 1)
+            for start in range(0, size, self.segment_size)
+        ]
         print_verbose(
-            "Resigning with certificate: {}".format(self.signing_certificate_name)
+            "Downloading `{}` in {} segments over {} connections".format(
+                url, len(segments), self.connections
+            )
         )
-        to_sign_files = self.__find_files_to_sign()
-        self.__extract_entitlements(profile_in_app_path)
-        self.__sign_files(to_sign_files)
-
-    def _repackage(self):
-        old_path = os.getcwd()
+        with open(target, "wb") as f:
+            f.truncate(size)
+        parts = urlsplit(url)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        pool = ConnectionPool(url)
+        hasher = PrefixHasher(target)
+        cancelled = threading.Event()
         try:
-            # Need to be in current folder to archive
-            os.chdir(self.extracted_dir_path)
-            Archiver.zip_dir(".", self.path_to_app)
+            with futures.ThreadPoolExecutor(
+                max_workers=min(self.connections, len(segments))
+            ) as executor:
+                pending = [
+                    executor.submit(
+                        self._download_segment,
+                        pool,
+                        hasher,
+                        target,
+                        path,
+                        validator,
+                        cancelled,
+                        *segment
+                    )
+                    for segment in segments
+                ]
+                try:
+                    hasher.hash_until(size, pending)
+                    done, _ = futures.wait(pending, return_when=futures.FIRST_EXCEPTION)
+                    for future in done:
+                        future.result()
+                except BaseException:
+                    # e.g. `ResourceChanged`, segments of the old resource are not fetched
+                    cancelled.set()
+                    for future in pending:
+                        future.cancel()
+                    pool.close()
+                    raise
         finally:
-            os.chdir(old_path)
-
+            pool.close()
+            hasher.close()
+        self.size, self.sha256, self.segments = size, hasher.hexdigest(), len(segments)
 
-class Archiver(object):
-    @staticmethod
-    def is_dir_in_zip(fileinfo):
-        # type: (zipfile.ZipInfo) -> bool
-        hi = fileinfo.external_attr >> 16
-        return (hi & 0x4000) > 0
+    def _download_segment(self, pool, hasher, target, path, validator, cancelled, start, end):
+        # type: (ConnectionPool, PrefixHasher, Path, str, str | None, threading.Event, int, int) -> None
+        """Fetch bytes `start` to `end`, stops early once `cancelled` is set.
 
-    @staticmethod
-    def zip_dir(dirpath, zippath):
-        with zipfile.ZipFile(zippath, "w", zipfile.ZIP_DEFLATED) as zfile:
-            for root, dirs, files in os.walk(dirpath):
-                if os.path.basename(root)[0] == ".":
-                    continue  # skip hidden directories
-                for f in files:
-                    if f[-1] == "~" or (f[0] == "." and f != ".htaccess"):
-                        # skip backup files and all hidden files except .htaccess
-                        continue
-                    zfile.write(os.path.join(root, f))
+        Sets `cancelled` itself when it fails, so other segments stop at once.
+        """
+        try:
+            self._fetch_segment(pool, hasher, target, path, validator, cancelled, start, end)
+        except BaseException:
+            cancelled.set()
+            raise
 
-    @staticmethod
-    def extract_specific_folder(extract_to_path, zfile, extract_dir_name):
-        # type: (Path, zipfile.ZipFile, str) -> Path
-        target_dir = extract_to_path.joinpath(extract_dir_name)
+    def _fetch_segment(self, pool, hasher, target, path, validator, cancelled, start, end):
+        # type: (ConnectionPool, PrefixHasher, Path, str, str | None, threading.Event, int, int) -> None
+        import http.client
 
-        # if `extract_dir_name` dir not present in archive raise an exception
-        if not all(
-            True
-            for m in zfile.filelist
-            if Archiver.is_dir_in_zip(m) and extract_dir_name in m.filename
+        offset = start
+        attempt = 0
+        with open(target, "r+b") as f, profile_span(
+            "segment", "network", start=start, bytes=end + 1 - start
         ):
-            raise RuntimeError("`{}` not present in archive")
-
-        # find index of searched dir to split in the future
-        extract_dir_name_index = -1
-        for member in zfile.filelist:
-            if not Archiver.is_dir_in_zip(member):
-                continue
-
-            splitted_path = member.filename.split("/")
-            try:
-                found_dir_index = splitted_path.index(extract_dir_name)
-            except ValueError:
-                continue
-            if found_dir_index != -1:
-                extract_dir_name_index = found_dir_index
-                break
+            while offset <= end and not cancelled.is_set():
+                try:
+                    with pool.connection() as conn:
+                        headers = {"Range": "bytes={}-{}".format(offset, end)}
+                        if validator:
+                            headers["If-Range"] = validator
+                        conn.request("GET", path, headers=headers)
+                        response = conn.getresponse()
+                        if response.status == 200:
+                            raise ResourceChanged(
+                                "`{}` changed during download".format(self.uri)
+                            )
+                        if response.status != 206:
+                            raise ConnectionError(
+                                "unexpected status {}".format(response.status)
+                            )
+                        f.seek(offset)
+                        while not cancelled.is_set():
+                            chunk = response.read(min(self.chunk_size, end + 1 - offset))
+                            if not chunk:
+                                break
+                            f.write(chunk)
+                            f.flush()
+                            hasher.written(offset, len(chunk))
+                            offset += len(chunk)
+                        if cancelled.is_set():
+                            # rest of the response is left unread
+                            raise ConnectionAbortedError(
+                                "segment {}-{} cancelled".format(start, end)
+                            )
+                        if offset <= end:
+                            raise ConnectionError(
+                                "connection closed at {} of segment {}-{}".format(
+                                    offset, start, end
+                                )
+                            )
+                except (http.client.HTTPException, OSError) as e:
+                    attempt += 1
+                    if attempt > self.retries or cancelled.is_set():
+                        raise
+                    print_verbose(
+                        "Segment {}-{} of `{}` interrupted ({}), retrying...".format(
+                            start, end, self.uri, e
+                        )
+                    )
+                    time.sleep(self.backoff * 2 ** (attempt - 1))
 
-        for member in zfile.filelist:
-            splitted_path = member.filename.split("/")
-            filename = "/".join(splitted_path[extract_dir_name_index:])
-            # skip top directories
-            if not filename.startswith(extract_dir_name):
-                continue
-            targetpath = extract_to_path.joinpath(filename)
-            # Create all upper directories if necessary.
-            upperdirs = targetpath.parent
-            if upperdirs and not upperdirs.exists():
-                os.makedirs(upperdirs)
-
-            if Archiver.is_dir_in_zip(member):
-                if not targetpath.is_dir():
-                    os.mkdir(targetpath)
-                continue
 
-            with zfile.open(member) as source, open(targetpath, "wb") as target:
-                shutil.copyfileobj(source, target)
-            # Required to get android scripts working
-            os.chmod(targetpath, 0o775)
-        return target_dir
+class SdkCache(object):
+    """Persistent on-disk cache of downloaded SDKs shared between runs.
 
+    Layout of the cache directory::
 
-class Instrumenter(object):
-    """Allow to instrumentify specific application with Applitools SDK."""
+        index.json              source urls with their validators and entries metadata
+        index.lock              guards `index.json`
+        locks/<url sha1>.lock   only one job downloads the same url at a time
+        entries/<key>/          extracted SDK together with the archive it came from
+        entries/<key>.lock      held shared by every job using the entry
+        results/                instrumented apps of `ResultCache`, unless `--no-result-cache`
 
-    instrument_strategies = {
-        "app": IOSAppPatcherInstrumentifyStrategy,
-        "ipa": IOSIpaInstrumentifyStrategy,
-    }
+    Entries are content-addressed with `<sdk version>-<archive sha256 prefix>`
+    key. Known sources are revalidated with `ETag`/`Last-Modified` and least
+    recently used entries are evicted once `max_size` or `max_entries` is exceeded.
+    """
 
     def __init__(
         self,
-        path_to_app,
-        sdk_data,
-        local,
-        signing_certificate_name=None,
-        provisioning_profile=None,
+        root,
+        max_size=CACHE_MAX_SIZE,
+        max_entries=CACHE_MAX_ENTRIES,
+        evict_grace=CACHE_EVICT_GRACE_SECONDS,
     ):
-        # type: (str, SdkData, str, str, bool) -> None
-        self.path_to_app = Path(path_to_app).absolute()
-        self.app_name = path_to_app
-        self.app_ext = self.path_to_app.suffix
-        self.sdk_data = sdk_data
-        self.local = local
-        self._instrumenter = self.instrument_strategies[self.app_ext.lstrip(".")](
-            path_to_app=self.path_to_app,
-            sdk_data=sdk_data,
-            local=local,
-            signing_certificate_name=signing_certificate_name,
-            provisioning_profile=provisioning_profile,
-        )
+        # type: (Path, int, int, float) -> None
+        self.root = Path(root)
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.evict_grace = evict_grace
+        self.index_path = self.root.joinpath("index.json")
+        self.entries_dir = self.root.joinpath("entries")
+        self.locks_dir = self.root.joinpath("locks")
+        self.tmp_dir = self.root.joinpath("tmp")
 
-    def was_already_instrumented(self):
-        # type: () -> bool
-        if self._instrumenter.sdk_in_app_frameworks.exists():
-            return True
-        else:
-            return False
+    def __str__(self):
+        return "SdkCache<{}>".format(self.root)
 
-    def instrumentify(self):
-        # type: () -> bool
-        if self.was_already_instrumented():
-            print_verbose("App already instrumented. Updating...")
-            # remove old installation
-            shutil.rmtree(self._instrumenter.sdk_in_app_frameworks)
-        if not self._instrumenter.instrumentify():
-            print("Failed to instrument `{}`".format(self.path_to_app))
-            return False
-        print_verbose(
-            "`{}` framework was added to `{}`".format(
-                self.sdk_data.name, self._instrumenter.sdk_in_app_frameworks
-            )
-        )
-        print(
-            "`{}` is ready for use with the `{}`".format(
-                self.path_to_app, self.sdk_data.name
-            )
-        )
-        return True
+    def entry_dir(self, key):
+        # type: (str) -> Path
+        return self.entries_dir.joinpath(key)
 
+    def lease(self, key):
+        # type: (str) -> FileLock
+        """Shared lock protecting entry from eviction while it is in use."""
+        lock = FileLock(self.entries_dir.joinpath(key + ".lock"), shared=True)
+        lock.acquire()
+        return lock
 
-def cli_parser():
-    # type: () -> argparse.ArgumentParser
+    def fetch(self, sdk_data, uri):
+        # type: (SdkData, str) -> dict
+        """Return metadata of the up-to-date cache entry for `uri`, downloading it if needed."""
+        import urllib.error
 
-    parser = argparse.ArgumentParser(
-        prog="python applitoolsify.py",
-        description="Applitoolsify (v{}) with Applitools iOS".format(
-            __version__
-        ),
+        url_hash = hashlib.sha1(uri.encode("utf-8")).hexdigest()
+        with FileLock(self.locks_dir.joinpath(url_hash + ".lock")):
+            with self._locked_index() as index:
+                source = index["sources"].get(uri, {})
+                cached_key = source.get("key")
+                if cached_key not in index["entries"] or not self.entry_dir(
+                    cached_key
+                ).joinpath(sdk_data.name).is_dir():
+                    cached_key, source = None, {}
+                elif sdk_data.expected_sha256 and (
+                    index["entries"][cached_key]["sha256"]
+                    != sdk_data.expected_sha256.lower()
+                ):
+                    print_verbose("Cached `{}` has different digest".format(uri))
+                    cached_key, source = None, {}
+                # digest stored on download, cache hits are not hashed again
+                cached_sha256 = index["entries"][cached_key]["sha256"] if cached_key else None
+            try:
+                source = self._revalidate_or_download(sdk_data, uri, source, cached_sha256)
+            except (urllib.error.URLError, OSError) as e:
+                if cached_key is None:
+                    raise
+                print_info(
+                    "! Failed to check `{}` for updates ({}). Using cached version.".format(
+                        uri, e
+                    )
+                )
+            with self._locked_index() as index:
+                index["sources"][uri] = source
+                entry = index["entries"][source["key"]]
+                entry["last_used"] = time.time()
+                entry = dict(entry, key=source["key"])
+        self.evict(keep=[entry["key"]])
+        return entry
+
+    def evict(self, keep=()):
+        # type: (list[str]) -> list[str]
+        """Remove least recently used entries over the limits. Entries in use are skipped."""
+        evicted = []
+        with self._locked_index() as index:
+            entries = index["entries"]
+            for key in [k for k in entries if not self.entry_dir(k).is_dir()]:
+                del entries[key]
+            total_size = sum(entry["size"] for entry in entries.values())
+            now = time.time()
+            for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+                if total_size <= self.max_size and len(entries) <= self.max_entries:
+                    break
+                if key in keep or now - entries[key]["last_used"] < self.evict_grace:
+                    continue
+                lock = FileLock(self.entries_dir.joinpath(key + ".lock"))
+                if not lock.acquire(blocking=False):
+                    continue  # used by another job right now
+                try:
+                    print_verbose("Evicting `{}` from `{}`".format(key, self))
+                    shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+                finally:
+                    lock.release()
+                total_size -= entries.pop(key)["size"]
+                evicted.append(key)
+            for uri in [u for u, s in index["sources"].items() if s["key"] not in entries]:
+                del index["sources"][uri]
+        return evicted
+
+    @contextmanager
+    def _locked_index(self):
+        with FileLock(self.root.joinpath("index.lock")):
+            try:
+                with open(self.index_path, "r") as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = {}
+            index.setdefault("sources", {})
+            index.setdefault("entries", {})
+            yield index
+            tmp_path = self.index_path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(index, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.index_path)
+
+    def _revalidate_or_download(self, sdk_data, uri, source, cached_sha256=None):
+        # type: (SdkData, str, dict, str | None) -> dict
+        import tempfile
+        import urllib.error
+        import urllib.request
+
+        request = urllib.request.Request(uri)
+        if source.get("etag"):
+            request.add_header("If-None-Match", source["etag"])
+        if source.get("last_modified"):
+            request.add_header("If-Modified-Since", source["last_modified"])
+        try:
+            with profile_span("revalidate", "network", uri=uri):
+                response = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and source and self._same_digest(e.headers, cached_sha256):
+                print_verbose("`{}` was not modified, using cached version".format(uri))
+                return source
+            if e.code != 304:
+                raise
+            # digest published for the cached validators changed, download again
+            print_verbose("`{}` has different digest, downloading again".format(uri))
+            response = urllib.request.urlopen(uri)
+        with response:
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "length": response.headers.get("Content-Length"),
+            }
+            # Servers ignoring conditional headers and `file://` urls answer 200 anyway
+            if (
+                source
+                and self._same_validators(source, validators)
+                and self._same_digest(response.headers, cached_sha256)
+            ):
+                print_verbose("`{}` was not modified, using cached version".format(uri))
+                return source
+            print_verbose("Downloading `{}` to `{}`".format(uri, self))
+            self.tmp_dir.mkdir(parents=True, exist_ok=True)
+            staging = Path(tempfile.mkdtemp(dir=self.tmp_dir))
+            try:
+                sha256 = SegmentedDownloader(
+                    uri, expected_sha256=sdk_data.expected_sha256
+                ).download(staging.joinpath(sdk_data.name + ".zip"), response)
+                key = self._store(sdk_data, staging, sha256)
+            except BaseException:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+        return dict(validators, key=key)
+
+    @staticmethod
+    def _same_digest(headers, cached_sha256):
+        # type: (Any, str | None) -> bool
+        """False if the server publishes digest different from the cached one."""
+        published = headers.get(CHECKSUM_HEADER) if headers is not None else None
+        return not published or published.strip().lower() == cached_sha256
+
+    @staticmethod
+    def _same_validators(source, validators):
+        # type: (dict, dict) -> bool
+        if source.get("length") != validators["length"]:
+            return False
+        if validators["etag"]:
+            return source.get("etag") == validators["etag"]
+        if validators["last_modified"]:
+            return source.get("last_modified") == validators["last_modified"]
+        return False
+
+    def _store(self, sdk_data, staging, sha256):
+        # type: (SdkData, Path, str) -> str
+        """Extract archive downloaded to `staging` dir and move it into entries."""
+        import zipfile
+
+        with self._locked_index() as index:
+            for key, entry in index["entries"].items():
+                if entry["sha256"] == sha256 and self.entry_dir(key).is_dir():
+                    shutil.rmtree(staging)
+                    return key
+
+        with zipfile.ZipFile(staging.joinpath(sdk_data.name + ".zip")) as zfile:
+            index = ZipIndex(zfile)
+            Archiver.extract_specific_folder(
+                staging, zfile, extract_dir_name=sdk_data.name, index=index
+            )
+            version = index.sdk_version(sdk_data.name)
+        key = "{}-{}".format(version, sha256[:16])
+        self.entries_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(staging, self.entry_dir(key))
+        except OSError:
+            if not self.entry_dir(key).is_dir():
+                raise
+            # same content was stored from another url meanwhile
+            shutil.rmtree(staging)
+
+        files_path = self.entry_dir(key).joinpath("files.json")
+        if not files_path.exists():
+            with profile_span("sdk_manifest"):
+                files = build_manifest(self.entry_dir(key).joinpath(sdk_data.name))
+            with open(files_path, "w") as f:
+                json.dump(files, f)
+        with self._locked_index() as index:
+            index["entries"][key] = {
+                "name": sdk_data.name,
+                "version": version,
+                "sha256": sha256,
+                "size": dir_size(self.entry_dir(key)),
+                "last_used": time.time(),
+            }
+        return key
+
+
+class ResultCache(object):
+    """Instrumented `ipa` and `apk` files keyed by input, SDK and options.
+
+    Repackaging is deterministic, so the stored artifact is exactly what
+    instrumenting the same input again would give. Every artifact is a
+    `<key><suffix>` file with mtime of its last use, least recently used
+    ones are removed once `max_size` or `max_entries` is exceeded, larger
+    artifacts are not stored at all.
+    """
+
+    def __init__(
+        self, root, max_size=RESULT_CACHE_MAX_SIZE, max_entries=RESULT_CACHE_MAX_ENTRIES
+    ):
+        # type: (Path, int, int) -> None
+        self.root = Path(root)
+        self.max_size = max_size
+        self.max_entries = max_entries
+
+    def __str__(self):
+        return "ResultCache<{}>".format(self.root)
+
+    @staticmethod
+    def key(path, sdk_data, options):
+        # type: (Path, SdkData, dict) -> str
+        """Digest of the input file, SDK, options changing the output and tool version."""
+        sdk_digest = sdk_data.sha256
+        if sdk_digest is None:
+            files = json.dumps(sdk_data.manifest()["files"], sort_keys=True)
+            sdk_digest = hashlib.sha256(files.encode("utf-8")).hexdigest()
+        key = {
+            "input": ResultCache.file_digest(path),
+            "sdk": sdk_digest,
+            "options": options,
+            "version": __version__,
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def file_digest(path):
+        # type: (Path | str) -> str
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def artifact_path(self, key, suffix):
+        # type: (str, str) -> Path
+        return self.root.joinpath(key + suffix)
+
+    def get(self, key, target):
+        # type: (str, Path) -> bool
+        """Replace `target` with the artifact stored for `key`, False if there is none."""
+        artifact = self.artifact_path(key, target.suffix)
+        tmp_path = target.with_name(target.name + ".tmp")
+        try:
+            shutil.copyfile(artifact, tmp_path)
+            os.utime(artifact)
+        except OSError:
+            # missing or evicted meanwhile
+            if tmp_path.exists():
+                os.remove(tmp_path)
+            return False
+        os.replace(tmp_path, target)
+        return True
+
+    def put(self, key, source):
+        # type: (str, Path) -> bool
+        """Store `source` file for `key`, replaced atomically for concurrent readers."""
+        import tempfile
+
+        if source.stat().st_size > self.max_size:
+            print_verbose("`{}` is too large for `{}`".format(source, self))
+            return False
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, self.artifact_path(key, source.suffix))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+        return True
+
+    def evict(self):
+        # type: () -> list[str]
+        """Remove least recently used artifacts over the limits, return their names."""
+        try:
+            artifacts = [
+                entry for entry in os.scandir(self.root) if not entry.name.endswith(".tmp")
+            ]
+        except OSError:
+            return []
+        artifacts.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        evicted = []
+        total_size = 0
+        for i, entry in enumerate(artifacts):
+            total_size += entry.stat().st_size
+            if i >= self.max_entries or total_size > self.max_size:
+                print_verbose("Evicting `{}` from `{}`".format(entry.name, self))
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    continue
+                evicted.append(entry.name)
+        return evicted
+
+
+class SdkDownloadManager(object):
+    """Download and extract selected SDK.
+
+    With `cache` the SDK is taken from the persistent `SdkCache` and kept there
+    for the next runs, otherwise it is downloaded to a temporary directory
+    removed on exit.
+    """
+
+    def __init__(self, sdk_data, local, cache=None):
+        # type: (SdkData, bool, SdkCache | None) -> None
+        self.sdk_data = sdk_data
+        self.local = local
+        self.cache = cache
+        self.sdks_dir = None  # type: Path | None
+        self._lease = None  # type: FileLock | None
+        self._tmp_dir = None  # type: Path | None
+
+    @classmethod
+    def from_sdk_name(cls, sdk_name, local, cache=None, expected_sha256=None, sdk_url=None):
+        # type: (str, bool, SdkCache | None, str | None, str | None) -> SdkDownloadManager
+        return cls(sdk_data_for(sdk_name, expected_sha256, sdk_url), local, cache)
+
+    @property
+    def uri(self):
+        # type: () -> str
+        uri = self.sdk_data.local_url if self.local else self.sdk_data.download_url
+        if uri is None:
+            raise RuntimeError(
+                "No archive of SDK `{}` is released, use `--sdk-url`".format(self.sdk_data.name)
+            )
+        return uri
+
+    def __enter__(self):
+        # type: () -> SdkData
+        return self.download_and_extract()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.remove_sdk_data()
+
+    def remove_sdk_data(self):
+        if self._lease is not None:
+            self._lease.release()
+            self._lease = None
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+
+    def download_and_extract(self):
+        # type: () -> SdkData
+        with profile_span("sdk", sdk=self.sdk_data.name):
+            return self._download_and_extract()
+
+    def _download_and_extract(self):
+        # type: () -> SdkData
+        import tempfile
+        import zipfile
+
+        if self.cache is not None:
+            entry = self.cache.fetch(self.sdk_data, self.uri)
+            self._lease = self.cache.lease(entry["key"])
+            self.sdks_dir = self.cache.entry_dir(entry["key"])
+            self.sdk_data.add_sdk_location(self.sdks_dir.joinpath(self.sdk_data.name))
+            self.sdk_data.version = entry["version"]
+            self.sdk_data.sha256 = entry["sha256"]
+            self.sdk_data.files = None
+            archive = self.sdks_dir.joinpath(self.sdk_data.name + ".zip")
+            self.sdk_data.archive = archive if archive.is_file() else None
+            files_path = self.sdks_dir.joinpath("files.json")
+            if files_path.exists():
+                with open(files_path, "r") as f:
+                    self.sdk_data.files = json.load(f)
+            print_verbose(
+                "Using `{}` {} from `{}`".format(
+                    self.sdk_data.name, self.sdk_data.version, self.sdks_dir
+                )
+            )
+            return self.sdk_data
+
+        self._tmp_dir = self.sdks_dir = Path(tempfile.mkdtemp(prefix="applitoolsify-"))
+        self.sdk_data.add_sdk_location(self.sdks_dir.joinpath(self.sdk_data.name))
+        print_verbose(
+            "Downloading `{}` to `{}`".format(
+                self.sdk_data.name, self.sdk_data.sdk_location
+            )
+        )
+        self.sdk_data.files = None
+        self.sdk_data.archive = self.sdks_dir.joinpath(self.sdk_data.name + ".zip")
+        self.sdk_data.sha256 = SegmentedDownloader(
+            self.uri, expected_sha256=self.sdk_data.expected_sha256
+        ).download(self.sdk_data.archive)
+        with zipfile.ZipFile(self.sdk_data.archive) as zfile:
+            index = ZipIndex(zfile)
+            extracted_path = Archiver.extract_specific_folder(
+                self.sdks_dir, zfile, extract_dir_name=self.sdk_data.name, index=index
+            )
+            self.sdk_data.version = index.sdk_version(self.sdk_data.name)
+        if extracted_path != self.sdk_data.sdk_location:
+            raise RuntimeError(
+                "Mismatch of extract desired location and actual sdk location location."
+            )
+        return self.sdk_data
+
+
+# `CFBundleSupportedPlatforms` of app to `SupportedPlatform` and variant of xcframework library
+APP_PLATFORMS = {
+    "iphoneos": ("ios", None),
+    "iphonesimulator": ("ios", "simulator"),
+    "appletvos": ("tvos", None),
+    "appletvsimulator": ("tvos", "simulator"),
+    "macosx": ("macos", None),
+}
+
+
+def app_platform(info):
+    # type: (dict) -> tuple[str, str | None] | None
+    """Platform and variant the app with `info` plist is built for, if known."""
+    platforms = info.get("CFBundleSupportedPlatforms") or [info.get("DTPlatformName")]
+    if len(platforms) != 1 or not platforms[0]:
+        return None
+    return APP_PLATFORMS.get(platforms[0].lower())
+
+
+def xcframework_slices(info, platform):
+    # type: (dict, tuple[str, str | None]) -> tuple[str | None, list[str]]
+    """Identifier of the library matching `platform` and identifiers of all of them.
+
+    `info` is `Info.plist` of xcframework listing its `AvailableLibraries`.
+    """
+    identifiers = []
+    matching = None
+    for library in info.get("AvailableLibraries", []):
+        identifiers.append(library["LibraryIdentifier"])
+        variant = library.get("SupportedPlatformVariant")
+        if (library.get("SupportedPlatform"), variant) == platform and matching is None:
+            matching = library["LibraryIdentifier"]
+    return matching, identifiers
+
+
+# `(cputype, cpusubtype)` without capability bits to `lipo` names
+MACHO_ARCH_NAMES = {
+    (7, 3): "i386",
+    (0x01000007, 3): "x86_64",
+    (0x01000007, 8): "x86_64h",
+    (12, 9): "armv7",
+    (12, 11): "armv7s",
+    (0x0100000C, 0): "arm64",
+    (0x0100000C, 2): "arm64e",
+    (0x0200000C, 1): "arm64_32",
+}
+
+
+class MachOSlice(object):
+    """Architecture slice of a Mach-O file, `align` is a power of two."""
+
+    def __init__(self, cputype, cpusubtype, offset, size, align=0):
+        # type: (int, int, int, int, int) -> None
+        self.cputype = cputype
+        self.cpusubtype = cpusubtype
+        self.offset = offset
+        self.size = size
+        self.align = align
+
+    def __str__(self):
+        return MACHO_ARCH_NAMES.get(self.arch, "cpu{}.{}".format(*self.arch))
+
+    @property
+    def arch(self):
+        # type: () -> tuple[int, int]
+        return self.cputype, self.cpusubtype & ~CPU_SUBTYPE_MASK
+
+
+class MachOHeader(object):
+    """Slices listed in header of a fat or thin Mach-O file."""
+
+    def __init__(self, magic, slices):
+        # type: (int, list[MachOSlice]) -> None
+        self.magic = magic
+        self.slices = slices
+
+    @property
+    def is_fat(self):
+        # type: () -> bool
+        return self.magic in (FAT_MAGIC, FAT_MAGIC_64)
+
+    @property
+    def archs(self):
+        # type: () -> set[tuple[int, int]]
+        return {s.arch for s in self.slices}
+
+    @classmethod
+    def parse(cls, header, size=None):
+        # type: (bytes, int | None) -> MachOHeader | None
+        """Header of a file of `size` starting with `header` bytes, None if not Mach-O.
+
+        A thin file is a single slice spanning the whole of it.
+        """
+        if len(header) < 12:
+            return None
+        (magic,) = struct.unpack_from(">I", header)
+        if magic in (FAT_MAGIC, FAT_MAGIC_64):
+            (count,) = struct.unpack_from(">I", header, 4)
+            entry = ">IIQQI4x" if magic == FAT_MAGIC_64 else ">IIIII"
+            entry_size = struct.calcsize(entry)
+            if not 0 < count <= MACHO_MAX_FAT_ARCHS or len(header) < 8 + count * entry_size:
+                return None
+            slices = [
+                MachOSlice(*struct.unpack_from(entry, header, 8 + i * entry_size))
+                for i in range(count)
+            ]
+            if size is not None and any(s.offset + s.size > size for s in slices):
+                return None  # truncated
+            return cls(magic, slices)
+        for byte_order in "<>":
+            magic, cputype, cpusubtype = struct.unpack_from(byte_order + "III", header)
+            if magic in (MH_MAGIC, MH_MAGIC_64):
+                return cls(magic, [MachOSlice(cputype, cpusubtype, 0, size or 0)])
+        return None
+
+    @classmethod
+    def from_file(cls, path):
+        # type: (Path | str) -> MachOHeader | None
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            return cls.parse(f.read(MACHO_HEADER_SIZE), os.fstat(f.fileno()).st_size)
+
+    def thin_layout(self, archs):
+        # type: (set[tuple[int, int]]) -> tuple[list[tuple[MachOSlice, int]], int] | None
+        """Slices of `archs` with their offsets in the thinned file and its size.
+
+        None when no slice is left out or none matches, then the file is kept
+        as is. A single slice is laid out as a thin file like `lipo -thin` does.
+        """
+        kept = [s for s in self.slices if s.arch in archs]
+        if not kept or len(kept) == len(self.slices):
+            return None
+        if len(kept) == 1:
+            return [(kept[0], 0)], kept[0].size
+        entry_size = 32 if self.magic == FAT_MAGIC_64 else 20
+        layout = []
+        end = 8 + len(kept) * entry_size
+        for s in kept:
+            alignment = 1 << s.align
+            offset = (end + alignment - 1) // alignment * alignment
+            layout.append((s, offset))
+            end = offset + s.size
+        return layout, end
+
+    def fat_header(self, layout):
+        # type: (list[tuple[MachOSlice, int]]) -> bytes
+        """Fat header listing slices of `layout` at their new offsets."""
+        entry = ">IIQQI4x" if self.magic == FAT_MAGIC_64 else ">IIIII"
+        return struct.pack(">II", self.magic, len(layout)) + b"".join(
+            struct.pack(entry, s.cputype, s.cpusubtype, offset, s.size, s.align)
+            for s, offset in layout
+        )
+
+
+def thin_macho(source, target, archs):
+    # type: (Path | str, Path | str, set[tuple[int, int]]) -> int | None
+    """Write slices of `archs` of Mach-O `source` into `target` like `lipo` does.
+
+    Slices are written straight from a memory map of `source`, never read
+    into memory as a whole. Returns size of `target`, None and writes
+    nothing when `source` is kept as is.
+    """
+    import mmap
+
+    with open(source, "rb") as f:
+        header = MachOHeader.parse(f.read(MACHO_HEADER_SIZE), os.fstat(f.fileno()).st_size)
+        layout = header.thin_layout(archs) if header is not None else None
+        if layout is None:
+            return None
+        slices, size = layout
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, open(
+            target, "wb"
+        ) as out:
+            if len(slices) > 1:
+                out.write(header.fat_header(slices))
+            view = memoryview(mapped)
+            try:
+                for s, offset in slices:
+                    out.write(b"\0" * (offset - out.tell()))
+                    out.write(view[s.offset : s.offset + s.size])
+            finally:
+                view.release()
+    shutil.copymode(source, target)
+    return size
+
+
+class _InstrumentifyStrategy(object):
+    """Base Patch Strategy class. Helps to instrumentify app with specific SDK."""
+
+    def __init__(
+        self,
+        path_to_app,
+        sdk_data,
+        local,
+        signing_certificate_name,
+        provisioning_profile,
+        workers=None,
+        codesign=None,
+        install_mode="auto",
+        compression_level=None,
+        scratch_dir=None,
+    ):
+        # type: (Path, SdkData, bool, str, str, int | None, str | None, str, int | None, Path | str | None) -> None
+        self.path_to_app = path_to_app
+        self.sdk_data = sdk_data
+        self.local = local
+        self.signing_certificate_name = signing_certificate_name
+        self.provisioning_profile = provisioning_profile
+        self.workers = workers
+        self.codesign = codesign
+        self.install_mode = install_mode
+        self.compression_level = compression_level
+        self.scratch_dir = scratch_dir
+        self._excluded_slices = None  # type: list[str] | None
+        self._app_archs = None  # type: set[tuple[int, int]] | None
+        self._thinned_files = None  # type: dict[str, tuple[int, list[str]]] | None
+
+    @property
+    def app_frameworks(self):
+        # type: () -> Path
+        raise NotImplementedError
+
+    def read_app_info(self):
+        # type: () -> dict | None
+        """`Info.plist` of the app, None if there is none."""
+        return None
+
+    @property
+    def excluded_slices(self):
+        # type: () -> list[str]
+        """Libraries of SDK xcframework not matching the app platform, left out of it.
+
+        Empty when platform of the app or libraries of the SDK are unknown,
+        then the whole xcframework is installed.
+        """
+        import plistlib
+
+        if self._excluded_slices is None:
+            self._excluded_slices = []
+            sdk_info = Path(self.sdk_data.sdk_location).joinpath("Info.plist")
+            app_info = self.read_app_info()
+            platform = app_platform(app_info) if app_info else None
+            if platform is not None and sdk_info.is_file():
+                with open(sdk_info, "rb") as f:
+                    matching, identifiers = xcframework_slices(plistlib.load(f), platform)
+                if matching is not None:
+                    self._excluded_slices = [i for i in identifiers if i != matching]
+                    print_verbose(
+                        "Installing `{}` slice of `{}`".format(matching, self.sdk_data.name)
+                    )
+        return self._excluded_slices
+
+    def read_executable_header(self, name):
+        # type: (str) -> MachOHeader | None
+        """Mach-O header of app file of posix `name`, None if there is none."""
+        return None
+
+    @property
+    def app_archs(self):
+        # type: () -> set[tuple[int, int]]
+        """Architectures of the app main executable, empty when unknown."""
+        if self._app_archs is None:
+            self._app_archs = set()
+            app_info = self.read_app_info()
+            executable = app_info.get("CFBundleExecutable") if app_info else None
+            header = self.read_executable_header(executable) if executable else None
+            if header is not None:
+                self._app_archs = header.archs
+        return self._app_archs
+
+    @property
+    def thinned_files(self):
+        # type: () -> dict[str, tuple[int, list[str]]]
+        """Size and architectures of SDK binaries thinned to ones of the app.
+
+        Keys are names relative to SDK dir. Binaries without architectures
+        of the app, or without any other, are installed as is.
+        """
+        if self._thinned_files is None:
+            self._thinned_files = {}
+            archs = self.app_archs
+            for name in sorted(self.sdk_data.manifest()["files"]):
+                if not archs or not self.is_sdk_file(name):
+                    continue
+                header = MachOHeader.from_file(self.sdk_data.sdk_location.joinpath(name))
+                layout = header.thin_layout(archs) if header is not None else None
+                if layout is not None:
+                    slices, size = layout
+                    self._thinned_files[name] = (size, [str(s) for s, _ in slices])
+        return self._thinned_files
+
+    def thin_sdk(self, sdk_dir):
+        # type: (Path) -> None
+        """Thin SDK binaries installed into `sdk_dir`, see `thinned_files`.
+
+        Binaries thinned by a previous run are left untouched. Thinned file
+        replaces the installed one, never written through a hardlink.
+        """
+        if not self.thinned_files:
+            return
+        with profile_span("thin_sdk", files=0, bytes=0) as span:
+            for name, (size, archs) in self.thinned_files.items():
+                path = Path(sdk_dir).joinpath(name)
+                installed_size = path.stat().st_size
+                if installed_size == size:
+                    continue
+                tmp_path = path.with_name(path.name + ".thin")
+                try:
+                    thin_macho(path, tmp_path, self.app_archs)
+                    os.replace(tmp_path, path)
+                finally:
+                    if tmp_path.exists():
+                        os.remove(tmp_path)
+                print_verbose("Thinned `{}` to {}".format(name, ", ".join(archs)))
+                span["files"] += 1
+                span["bytes"] += installed_size - size
+
+    def is_sdk_file(self, name):
+        # type: (str) -> bool
+        """Whether SDK file of posix `name` relative to SDK dir is installed."""
+        return name.split("/", 1)[0] not in self.excluded_slices
+
+    def installed_sdk_size(self):
+        # type: () -> int
+        """Size of SDK files installed into the app, before thinning."""
+        return sum(
+            entry["size"]
+            for name, entry in self.sdk_data.manifest()["files"].items()
+            if self.is_sdk_file(name)
+        )
+
+    def check_output_space(self, required, scratch=None):
+        # type: (int, ScratchSpace | None) -> None
+        """Fail before writing when the new archive doesn't fit next to the app.
+
+        Space of `scratch` is taken from the same volume when it is there.
+        """
+        directory = self.path_to_app.parent
+        free = shutil.disk_usage(directory).free
+        if scratch is not None and os.stat(scratch.path).st_dev == os.stat(directory).st_dev:
+            free -= scratch.required
+        if free < required + SCRATCH_RESERVE:
+            raise RuntimeError(
+                "Not enough space for {} of `{}`: {} free in `{}`".format(
+                    format_size(required),
+                    self.path_to_app.name,
+                    format_size(max(0, free)),
+                    directory,
+                )
+            )
+
+    def sdk_manifest(self):
+        # type: () -> dict
+        """`SdkData.manifest` with files installed into the app only.
+
+        Thinned binaries have their installed `size` and `archs`, `sha256`
+        stays the digest of the SDK file.
+        """
+        manifest = self.sdk_data.manifest()
+        if not self.excluded_slices and not self.thinned_files:
+            return manifest
+        files = {}
+        for name, meta in manifest["files"].items():
+            if not self.is_sdk_file(name):
+                continue
+            if name in self.thinned_files:
+                size, archs = self.thinned_files[name]
+                meta = dict(meta, size=size, archs=archs)
+            files[name] = meta
+        return dict(manifest, files=files)
+
+    def _ignore_excluded_slices(self, directory, names):
+        # type: (str, list[str]) -> list[str]
+        """`ignore` of `shutil.copytree` of the SDK dir."""
+        if Path(directory) != Path(self.sdk_data.sdk_location):
+            return []
+        return [name for name in names if name in self.excluded_slices]
+
+    @property
+    def sdk_in_app_frameworks(self):
+        # type: () -> Path
+        return self.app_frameworks.joinpath(self.sdk_data.name)
+
+    def was_already_instrumented(self):
+        # type: () -> bool
+        return self.sdk_in_app_frameworks.exists()
+
+    def remove_sdk(self):
+        """Remove previous SDK installation before instrumenting again."""
+        shutil.rmtree(self.sdk_in_app_frameworks)
+
+    def installed_manifest(self):
+        # type: () -> dict | None
+        """Manifest of the SDK installed by previous run, if any."""
+        manifest_path = self.sdk_in_app_frameworks.joinpath(SDK_MANIFEST_NAME)
+        if not manifest_path.is_file():
+            return None
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+
+    def installed_file_size(self, name):
+        # type: (str) -> int | None
+        path = self.sdk_in_app_frameworks.joinpath(name)
+        return path.stat().st_size if path.is_file() else None
+
+    def is_up_to_date(self):
+        # type: () -> bool
+        """Whether installed SDK has the same version and files as `sdk_data`."""
+        installed = self.installed_manifest()
+        expected = self.sdk_manifest()
+        if installed is None or (installed.get("version"), installed.get("files")) != (
+            expected["version"],
+            expected["files"],
+        ):
+            return False
+        return all(
+            self.installed_file_size(name) == meta["size"]
+            for name, meta in expected["files"].items()
+        )
+
+    def write_manifest(self, sdk_dir):
+        # type: (Path) -> None
+        with open(Path(sdk_dir).joinpath(SDK_MANIFEST_NAME), "w") as f:
+            json.dump(self.sdk_manifest(), f, indent=2, sort_keys=True)
+
+    def instrumentify(self):
+        # type: () -> bool
+        raise NotImplementedError
+
+    def close(self):
+        """Remove scratch files of the strategy."""
+
+
+class IOSAppPatcherInstrumentifyStrategy(_InstrumentifyStrategy):
+    """Patch IOS `app` with specific SDK."""
+
+    @property
+    def app_frameworks(self):
+        return Path(self.path_to_app).joinpath("Frameworks")
+
+    def read_app_info(self):
+        # type: () -> dict | None
+        import plistlib
+
+        info_path = Path(self.path_to_app).joinpath("Info.plist")
+        if not info_path.is_file():
+            return None
+        with open(info_path, "rb") as f:
+            return plistlib.load(f)
+
+    def read_executable_header(self, name):
+        # type: (str) -> MachOHeader | None
+        return MachOHeader.from_file(Path(self.path_to_app).joinpath(name))
+
+    def remove_sdk(self):
+        """Remove previous SDK installation unless it can be updated file by file."""
+        if self.installed_manifest() is None:
+            super(IOSAppPatcherInstrumentifyStrategy, self).remove_sdk()
+
+    def instrumentify(self):
+        # type: () -> bool
+        installer = FileInstaller(self.install_mode)
+        installed = self.installed_manifest()
+        with profile_span("install_sdk", mode=self.install_mode) as span:
+            if installed is None:
+                shutil.copytree(
+                    self.sdk_data.sdk_location,
+                    self.sdk_in_app_frameworks,
+                    copy_function=installer.copy_file,
+                    ignore=self._ignore_excluded_slices,
+                )
+            else:
+                self._update_sdk(installed["files"], installer)
+            span.update(
+                files=sum(files for files, _ in installer.stats.values()),
+                bytes=sum(size for _, size in installer.stats.values()),
+            )
+        self.thin_sdk(self.sdk_in_app_frameworks)
+        self.write_manifest(self.sdk_in_app_frameworks)
+        print_info(installer.report())
+        return True
+
+    def _update_sdk(self, installed_files, installer):
+        # type: (dict[str, dict], FileInstaller) -> None
+        """Touch only files added, changed or removed since the previous run."""
+        sdk_files = self.sdk_manifest()["files"]
+        removed = [name for name in installed_files if name not in sdk_files]
+        changed = [
+            name
+            for name, meta in sdk_files.items()
+            if installed_files.get(name) != meta
+            or self.installed_file_size(name) != meta["size"]
+        ]
+        for name in removed:
+            path = self.sdk_in_app_frameworks.joinpath(name)
+            if path.is_file():
+                os.remove(path)
+            # drop directories left empty
+            parent = path.parent
+            while parent != self.sdk_in_app_frameworks and parent.is_dir():
+                if any(parent.iterdir()):
+                    break
+                parent.rmdir()
+                parent = parent.parent
+        for name in changed:
+            path = self.sdk_in_app_frameworks.joinpath(name)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # never write through a hardlink shared with the SDK cache
+            if os.path.lexists(path):
+                os.remove(path)
+            installer.copy_file(str(self.sdk_data.sdk_location.joinpath(name)), str(path))
+        print_verbose(
+            "Updated {} and removed {} SDK files".format(len(changed), len(removed))
+        )
+
+
+class FileInstaller(object):
+    """Copy files with the cheapest method the filesystem supports.
+
+    `auto` mode clones files (`FICLONE` on Btrfs/XFS, `clonefile` on APFS),
+    then tries in-kernel `os.copy_file_range` and falls back to a regular copy.
+    `hardlink` shares files with the source, so installed files must not be
+    modified in place. Methods which fail once are not tried again.
+    """
+
+    MODES = ["auto", "reflink", "hardlink", "copy_file_range", "copy"]
+    FICLONE = 0x40049409  # _IOW(0x94, 9, int)
+    # methods sharing data with the source instead of copying it
+    ZERO_COPY = ["reflink", "hardlink"]
+
+    def __init__(self, mode="auto"):
+        # type: (str) -> None
+        if mode not in self.MODES:
+            raise ValueError("Unknown install mode `{}`".format(mode))
+        self.mode = mode
+        self.stats = {}  # type: dict[str, list[int]]
+        self._unsupported = set()  # type: set[str]
+
+    def copy_file(self, src, dst):
+        # type: (str, str) -> str
+        """Copy `src` to `dst` like `shutil.copy2`, usable as `copytree` copy function."""
+        if self.mode == "auto":
+            methods = ["reflink", "copy_file_range", "copy"]
+        else:
+            methods = [self.mode, "copy"]
+        for method in methods:
+            if method in self._unsupported:
+                continue
+            try:
+                getattr(self, "_" + method)(src, dst)
+            except OSError as e:
+                if method == "copy":
+                    raise
+                print_verbose("Install with {} is not available: {}".format(method, e))
+                self._unsupported.add(method)
+                if method != "hardlink" and os.path.lexists(dst):
+                    os.remove(dst)
+                continue
+            if method != "hardlink":
+                shutil.copystat(src, dst)
+            stat = self.stats.setdefault(method, [0, 0])
+            stat[0] += 1
+            stat[1] += os.path.getsize(src)
+            return dst
+
+    @property
+    def bytes_avoided(self):
+        # type: () -> int
+        return sum(self.stats[m][1] for m in self.ZERO_COPY if m in self.stats)
+
+    def report(self):
+        # type: () -> str
+        methods = ", ".join(
+            "{} files with {}".format(files, method)
+            for method, (files, _) in sorted(self.stats.items())
+        )
+        return "Installed {}; avoided copying {}".format(
+            methods or "no files", format_size(self.bytes_avoided)
+        )
+
+    def _reflink(self, src, dst):
+        import ctypes
+
+        if sys.platform == "win32":
+            raise OSError("reflink is not supported on Windows")
+        if sys.platform == "darwin":
+            libc = ctypes.CDLL(None, use_errno=True)
+            if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+            return
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), self.FICLONE, fsrc.fileno())
+
+    def _hardlink(self, src, dst):
+        os.link(src, dst)
+
+    def _copy_file_range(self, src, dst):
+        if not hasattr(os, "copy_file_range"):
+            raise OSError("copy_file_range is not supported on this platform")
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if not copied:
+                    break
+                remaining -= copied
+
+    def _copy(self, src, dst):
+        shutil.copyfile(src, dst)
+
+
+def format_size(size):
+    # type: (float) -> str
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024.0
+    return "{:.1f} {}".format(size, unit) if unit != "B" else "{} B".format(int(size))
+
+
+class ScratchSpace(object):
+    """Temporary dir for files of one run, removed by `close`.
+
+    `scratch_dir`, or a RAM-backed dir when not given, is preferred when
+    `required` bytes fit in it, the system temp dir otherwise. Space required
+    by other scratch dirs of the process stays reserved until they are
+    closed, so parallel jobs don't all pick the same dir. Fails before
+    anything is written when neither has enough free space. Dirs of runs
+    interrupted before `close` are removed at exit.
+    """
+
+    def __init__(self, required, scratch_dir=None):
+        # type: (int, Path | str | None) -> None
+        import tempfile
+
+        self.required = required
+        if scratch_dir:
+            os.makedirs(scratch_dir, exist_ok=True)
+        candidates = [scratch_dir] if scratch_dir else SCRATCH_RAM_DIRS
+        candidates = [str(c) for c in candidates if os.path.isdir(c) and os.access(c, os.W_OK)]
+        candidates.append(tempfile.gettempdir())
+        free = {}
+        with _SCRATCH_LOCK:
+            for candidate in candidates:
+                free[candidate] = shutil.disk_usage(candidate).free - self.reserved(candidate)
+                if free[candidate] >= required + SCRATCH_RESERVE:
+                    break
+            else:
+                raise RuntimeError(
+                    "Not enough space for {} of scratch files: {}".format(
+                        format_size(required),
+                        ", ".join(
+                            "{} free in `{}`".format(format_size(max(0, size)), c)
+                            for c, size in free.items()
+                        ),
+                    )
+                )
+            self.path = Path(tempfile.mkdtemp(prefix="applitoolsify-", dir=candidate))
+            _SCRATCH_DIRS[str(self.path)] = (candidate, required)
+        print_verbose(
+            "Using `{}` for {} of scratch files".format(self.path, format_size(required))
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if str(self.path) in _SCRATCH_DIRS:
+            shutil.rmtree(self.path, ignore_errors=True)
+            _SCRATCH_DIRS.pop(str(self.path), None)
+
+    @staticmethod
+    def reserved(parent):
+        # type: (str) -> int
+        """Bytes required by open scratch dirs in `parent`.
+
+        Written files are counted twice, as used space and as reserved,
+        which errs on the safe side without walking the dirs.
+        """
+        return sum(
+            required for candidate, required in _SCRATCH_DIRS.values() if candidate == parent
+        )
+
+    @staticmethod
+    def remove_all():
+        """Remove scratch dirs left by runs interrupted before `close`."""
+        for path in list(_SCRATCH_DIRS):
+            shutil.rmtree(path, ignore_errors=True)
+            _SCRATCH_DIRS.pop(path, None)
+
+
+atexit.register(ScratchSpace.remove_all)
+
+
+# Object identifier of CMS SignedData, 1.2.840.113549.1.7.2
+SIGNED_DATA_OID = b"\x2a\x86\x48\x86\xf7\x0d\x01\x07\x02"
+# Entitlements plists by sha256 of the provisioning profile they come from
+_ENTITLEMENTS = {}  # type: dict[str, bytes]
+
+
+def read_ber(data, offset=0):
+    # type: (bytes, int) -> tuple[int, int, int, int]
+    """Tag, start and end of content and end of BER element at `offset`.
+
+    DER is a subset of BER. Indefinite lengths are supported, Apple tools
+    write them for constructed elements.
+    """
+    try:
+        tag = data[offset]
+        offset += 1
+        if tag & 0x1F == 0x1F:  # high tag number, continued while bit 8 is set
+            while data[offset] & 0x80:
+                offset += 1
+            offset += 1
+        length = data[offset]
+        offset += 1
+    except IndexError:
+        raise RuntimeError("Truncated BER element")
+    if length == 0x80:
+        end = offset
+        while data[end : end + 2] != b"\0\0":
+            end = read_ber(data, end)[3]
+        return tag, offset, end, end + 2
+    if length & 0x80:
+        size = length & 0x7F
+        length = int.from_bytes(data[offset : offset + size], "big")
+        offset += size
+    if offset + length > len(data):
+        raise RuntimeError("Truncated BER element")
+    return tag, offset, offset + length, offset + length
+
+
+def ber_children(data, element):
+    # type: (bytes, tuple[int, int, int, int]) -> list[tuple[int, int, int, int]]
+    children = []
+    offset, end = element[1], element[2]
+    while offset < end:
+        children.append(read_ber(data, offset))
+        offset = children[-1][3]
+    return children
+
+
+def cms_signed_content(data):
+    # type: (bytes) -> bytes
+    """Content signed by CMS (PKCS#7) SignedData, the signature isn't checked.
+
+    ContentInfo is `SEQUENCE {OID, [0] SignedData}`, SignedData is
+    `SEQUENCE {version, digestAlgorithms, SEQUENCE {OID, [0] OCTET STRING}, ...}`.
+    """
+    content_info = ber_children(data, read_ber(data))
+    oid = content_info[0] if content_info else (0, 0, 0, 0)
+    if len(content_info) < 2 or data[oid[1] : oid[2]] != SIGNED_DATA_OID:
+        raise RuntimeError("Not CMS SignedData")
+    signed_data = ber_children(data, ber_children(data, content_info[1])[0])
+    encapsulated = ber_children(data, signed_data[2])
+    if len(encapsulated) < 2:
+        raise RuntimeError("CMS SignedData without content")
+    content = ber_children(data, encapsulated[1])[0]
+    return _octet_string(data, content)
+
+
+def _octet_string(data, element):
+    # type: (bytes, tuple[int, int, int, int]) -> bytes
+    """Value of OCTET STRING, BER allows it to be split into constructed chunks."""
+    if element[0] == 0x04:
+        return data[element[1] : element[2]]
+    if element[0] == 0x24:
+        return b"".join(_octet_string(data, child) for child in ber_children(data, element))
+    raise RuntimeError("Unexpected BER tag {:#x} of CMS content".format(element[0]))
+
+
+def read_entitlements(profile_path):
+    # type: (Path | str) -> bytes
+    """Entitlements plist of `.mobileprovision`, parsed once per profile content."""
+    import plistlib
+
+    with open(profile_path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    entitlements = _ENTITLEMENTS.get(digest)
+    if entitlements is None:
+        with profile_span("entitlements", size=len(data)):
+            profile = plistlib.loads(cms_signed_content(data))
+            entitlements = plistlib.dumps(profile["Entitlements"])
+        _ENTITLEMENTS[digest] = entitlements
+    return entitlements
+
+
+class IOSIpaInstrumentifyStrategy(_InstrumentifyStrategy):
+    """Patch IOS `ipa` with specific SDK and sign with a specified certificate.
+
+    Only the app bundle is extracted, codesign seals every file of it.
+    Members outside of it and files left unchanged by signing are copied
+    into the new archive without recompression.
+    """
+
+    CODESIGN = "/usr/bin/codesign"
+
+    def __init__(self, *args, **kwargs):
+        super(IOSIpaInstrumentifyStrategy, self).__init__(*args, **kwargs)
+        if self.codesign is None:
+            self.codesign = self.CODESIGN
+
+        self._scratch = None  # type: ScratchSpace | None
+        self._app_info = None  # type: dict | None
+        # stat of extracted files, to find ones changed by signing
+        self._extracted = {}  # type: dict[str, tuple[int, int, int]]
+        try:
+            self._extract()
+        except BaseException:
+            self.close()
+            raise
+
+    def _extract(self):
+        """Extract the app bundle into scratch space sized from the central directory."""
+        import zipfile
+
+        with zipfile.ZipFile(self.path_to_app) as zfile:
+            index = ZipIndex(zfile)
+            app_members = index.members(index.find(str(index.app_in_payload())))
+            info_path = "{}/Info.plist".format(index.app_in_payload())
+            if index.find(info_path) is not None:
+                self._app_info = index.read_plist(info_path)
+            sdk_size = self.installed_sdk_size()
+            # extracted app, SDK installed into it and files changed by signing
+            self._scratch = ScratchSpace(
+                sum(info.file_size for info in app_members) + sdk_size, self.scratch_dir
+            )
+            # repackaged next to the app, SDK files may be stored as is
+            self.check_output_space(self.path_to_app.stat().st_size + sdk_size, self._scratch)
+            self.extracted_dir_path = self._scratch.path.joinpath("extracted")
+            self.entitlements_file_path = self._scratch.path.joinpath("entitlements.plist")
+            self._app_in_payload = self.extracted_dir_path.joinpath(
+                index.app_in_payload()
+            )
+            self._compression_policy = CompressionPolicy.from_archive(
+                zfile,
+                self.compression_level,
+                exclude_prefix="{}/".format(
+                    self.sdk_in_app_frameworks.relative_to(self.extracted_dir_path).as_posix()
+                ),
+            )
+            self._app_prefix = "{}/".format(index.app_in_payload())
+            with profile_span("extract_ipa", files=0, bytes=0) as span:
+                # in archive order, the file is read sequentially
+                for info in app_members:
+                    path = zfile.extract(info, self.extracted_dir_path)
+                    Archiver.restore_permissions(info, path)
+                    if not info.is_dir():
+                        self._extracted[info.filename] = self._stat_key(os.stat(path))
+                        span["files"] += 1
+                        span["bytes"] += info.file_size
+
+    @property
+    def app_in_payload(self):
+        # type: () -> Path
+        return self._app_in_payload
+
+    @property
+    def app_frameworks(self):
+        return Path(self.app_in_payload).joinpath("Frameworks")
+
+    def read_app_info(self):
+        # type: () -> dict | None
+        # read from the archive, SDK slices are chosen before extraction
+        return self._app_info
+
+    def read_executable_header(self, name):
+        # type: (str) -> MachOHeader | None
+        return MachOHeader.from_file(Path(self.app_in_payload).joinpath(name))
+
+    def is_up_to_date(self):
+        # type: () -> bool
+        if all([self.signing_certificate_name, self.provisioning_profile]):
+            return False  # signing identity may differ, sign again
+        return super(IOSIpaInstrumentifyStrategy, self).is_up_to_date()
+
+    def instrumentify(self):
+        # type: () -> bool
+        import traceback
+
+        with profile_span("install_sdk"):
+            if not shutil.copytree(
+                self.sdk_data.sdk_location,
+                self.sdk_in_app_frameworks,
+                ignore=self._ignore_excluded_slices,
+            ):
+                return False
+        self.thin_sdk(self.sdk_in_app_frameworks)
+        self.write_manifest(self.sdk_in_app_frameworks)
+
+        try:
+            self._resign()
+        except Exception:
+            print_info("Failed to sign. Please, sign it manually")
+            if VERBOSE:
+                traceback.print_exc()
+            return False
+
+        try:
+            self._repackage()
+        except Exception:
+            print_info("Failed to repackage. Please, sign it manually")
+            if VERBOSE:
+                traceback.print_exc()
+            return False
+        return True
+
+    def close(self):
+        if self._scratch is not None:
+            self._scratch.close()
+
+    def __extract_entitlements(self, profile_in_app_path):
+        with open(self.entitlements_file_path, "wb") as f:
+            f.write(read_entitlements(profile_in_app_path))
+
+    def __find_files_to_sign(self):
+        # type: () -> SigningPlan
+        return SigningPlan.from_dir(self.extracted_dir_path)
+
+    def __sign_files(self, signing_plan):
+        # type: (SigningPlan) -> None
+        signing_plan.run(
+            [
+                self.codesign,
+                "--continue",
+                "-f",
+                "-s",
+                self.signing_certificate_name,
+                "--entitlements",
+                str(self.entitlements_file_path),
+            ],
+            self.workers,
+        )
+
+    def _resign(self):
+        if not all([self.signing_certificate_name, self.provisioning_profile]):
+            print_verbose(
+                "No `signing_certificate_name` and `provisioning_profile` provided. Skip signing..."
+            )
+            return
+        if sys.platform != "darwin":
+            print_info("Signing with script is available only on macOS. Skip signing...")
+            return
+        profile_in_app_path = Path(self.app_in_payload).joinpath(
+            "embedded.mobileprovision"
+        )
+        shutil.copy2(self.provisioning_profile, profile_in_app_path)
+        print_verbose(
+            "Resigning with certificate: {}".format(self.signing_certificate_name)
+        )
+        with profile_span("sign") as span:
+            signing_plan = self.__find_files_to_sign()
+            span.update(files=len(signing_plan), levels=len(signing_plan.levels))
+            self.__extract_entitlements(profile_in_app_path)
+            self.__sign_files(signing_plan)
+
+    def _repackage(self):
+        """Write app back into `ipa` recompressing only new and changed files."""
+        import zipfile
+
+        tmp_path = self.path_to_app.with_name(self.path_to_app.name + ".tmp")
+        try:
+            with zipfile.ZipFile(self.path_to_app) as source, zipfile.ZipFile(
+                tmp_path, "w", zipfile.ZIP_DEFLATED
+            ) as target, profile_span("repackage", files=0, bytes=0) as span:
+                to_zip = []
+                for member in source.infolist():
+                    if member.filename not in self._extracted:
+                        if self._is_kept(member):
+                            Archiver.copy_raw_member(source, target, member)
+                        continue
+                    path = self.extracted_dir_path.joinpath(member.filename)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue  # removed, e.g. previous SDK
+                    if self._stat_key(stat) == self._extracted[member.filename]:
+                        Archiver.copy_raw_member(source, target, member)
+                        span["files"] += 1
+                        span["bytes"] += member.compress_size
+                    else:
+                        to_zip.append((str(path), member.filename))
+                to_zip += self._new_files(source)
+                Archiver.write_files(
+                    target, to_zip, self.workers, self._compression_policy
+                )
+            os.replace(tmp_path, self.path_to_app)
+        except BaseException:
+            if tmp_path.exists():
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def _stat_key(stat):
+        # type: (os.stat_result) -> tuple[int, int, int]
+        # codesign replaces files it changes, so inode is compared along with mtime
+        return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def _is_kept(self, member):
+        # type: (zipfile.ZipInfo) -> bool
+        """Whether not extracted `member` goes to the new archive as is."""
+        if not member.filename.startswith(self._app_prefix):
+            return True  # outside of the app, never extracted
+        # directory entry of the app, unless the directory was removed
+        return self.extracted_dir_path.joinpath(member.filename).is_dir()
+
+    def _new_files(self, source):
+        # type: (zipfile.ZipFile) -> list[tuple[str, str]]
+        """`(path, arcname)` of files created in the app since extraction."""
+        names = set(source.namelist())
+        new_files = []
+        for root, dirs, files in os.walk(self.app_in_payload):
+            dirs.sort()
+            for f in sorted(files):
+                path = os.path.join(root, f)
+                arcname = Path(path).relative_to(self.extracted_dir_path).as_posix()
+                if arcname not in names and f not in FILES_COPY_SKIP_LIST:
+                    new_files.append((path, arcname))
+        return new_files
+
+
+class SigningPlan(object):
+    """Codesign targets of a directory grouped into levels that are signed in order.
+
+    Signature of a bundle covers the code nested in it, so every target is put
+    one level after the highest target it contains. Targets of the same level
+    don't contain each other and are signed in parallel.
+    """
+
+    SIGNABLE_FILES = ["dylib"]
+    SIGNABLE_DIRS = ["app", "appex", "framework"]
+
+    def __init__(self, targets):
+        # type: (list[str]) -> None
+        targets = sorted(targets)
+        heights = {}  # type: dict[str, int]
+        # nested targets sort after their container, walk backwards to visit them first
+        for i in range(len(targets) - 1, -1, -1):
+            prefix = targets[i] + os.sep
+            nested = [
+                heights[t]
+                for t in targets[i + 1 :]
+                if t.startswith(prefix)
+            ]
+            heights[targets[i]] = max(nested) + 1 if nested else 0
+        self.levels = [
+            [t for t in targets if heights[t] == level]
+            for level in range(max(heights.values()) + 1 if heights else 0)
+        ]  # type: list[list[str]]
+
+    def __len__(self):
+        return sum(len(level) for level in self.levels)
+
+    @classmethod
+    def from_dir(cls, path):
+        # type: (Path | str) -> SigningPlan
+        targets = []
+        for root, dirs, files in os.walk(path):
+            for name in files:
+                _, ext = os.path.splitext(name)
+                if ext.lstrip(".").lower() in cls.SIGNABLE_FILES:
+                    targets.append(os.path.join(root, name))
+            for dir_name in dirs:
+                _, ext = os.path.splitext(dir_name)
+                if ext.lstrip(".").lower() in cls.SIGNABLE_DIRS:
+                    targets.append(os.path.join(root, dir_name))
+        return cls(targets)
+
+    def run(self, command, workers=None):
+        # type: (list[str], int | None) -> None
+        """Call `command + [target]` for every target, level by level.
+
+        Raises `subprocess.CalledProcessError` of the first failed target once
+        its level is finished, following levels are not started.
+        """
+        from concurrent import futures
+
+        workers = workers or os.cpu_count() or 1
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for i, level in enumerate(self.levels):
+                print_verbose("Signing {} targets in parallel".format(len(level)))
+                with profile_span("sign_level", level=i, files=len(level)):
+                    results = list(
+                        executor.map(lambda target: self._sign(command, target), level)
+                    )
+                for result in results:
+                    if VERBOSE and result.stdout:
+                        print_info(result.stdout.decode("utf-8", "replace"), end="")
+                    result.check_returncode()
+
+    @staticmethod
+    def _sign(command, target):
+        # type: (list[str], str) -> subprocess.CompletedProcess
+        import subprocess
+
+        with profile_span(
+            os.path.basename(command[0]), "subprocess", target=target
+        ) as span:
+            result = subprocess.run(
+                command + [target], stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+            )
+            span.update(returncode=result.returncode)
+        return result
+
+
+class IOSIpaSpliceInstrumentifyStrategy(_InstrumentifyStrategy):
+    """Patch IOS `ipa` with specific SDK without extracting it.
+
+    Compressed members of the original `ipa` are copied byte for byte into a new
+    archive, only SDK files are compressed and a new central directory is
+    written. Used when no signing is requested.
+    """
+
+    def __init__(self, *args, **kwargs):
+        import zipfile
+
+        super(IOSIpaSpliceInstrumentifyStrategy, self).__init__(*args, **kwargs)
+        with zipfile.ZipFile(self.path_to_app) as zfile:
+            self._index = ZipIndex(zfile)
+        self._app_in_payload = self._index.app_in_payload()
+
+    @property
+    def app_in_payload(self):
+        # type: () -> PurePosixPath
+        return self._app_in_payload
+
+    @property
+    def app_frameworks(self):
+        return self.app_in_payload.joinpath("Frameworks")
+
+    def read_app_info(self):
+        # type: () -> dict | None
+        import plistlib
+        import zipfile
+
+        info_path = "{}/Info.plist".format(self.app_in_payload)
+        if self._index.find(info_path) is None:
+            return None
+        with zipfile.ZipFile(self.path_to_app) as zfile:
+            return plistlib.loads(zfile.read(info_path))
+
+    def read_executable_header(self, name):
+        # type: (str) -> MachOHeader | None
+        import zipfile
+
+        node = self._index.find("{}/{}".format(self.app_in_payload, name))
+        if node is None or node.is_dir:
+            return None
+        with zipfile.ZipFile(self.path_to_app) as zfile, zfile.open(node.info) as f:
+            return MachOHeader.parse(f.read(MACHO_HEADER_SIZE), node.size)
+
+    def is_copied_as_is(self, name):
+        # type: (str) -> bool
+        """Whether SDK file of posix `name` goes into the app unchanged."""
+        return self.is_sdk_file(name) and name not in self.thinned_files
+
+    def was_already_instrumented(self):
+        # type: () -> bool
+        return self._index.find(str(self.sdk_in_app_frameworks)) is not None
+
+    def remove_sdk(self):
+        """Nothing to remove, old SDK members are skipped while splicing."""
+
+    def installed_manifest(self):
+        # type: () -> dict | None
+        import zipfile
+
+        name = "{}/{}".format(self.sdk_in_app_frameworks, SDK_MANIFEST_NAME)
+        if self._index.find(name) is None:
+            return None
+        with zipfile.ZipFile(self.path_to_app) as zfile:
+            return json.loads(zfile.read(name).decode("utf-8"))
+
+    def installed_file_size(self, name):
+        # type: (str) -> int | None
+        node = self._index.find("{}/{}".format(self.sdk_in_app_frameworks, name))
+        return node.size if node is not None and not node.is_dir else None
+
+    def instrumentify(self):
+        # type: () -> bool
+        import traceback
+        import zipfile
+
+        sdk_prefix = "{}/".format(self.sdk_in_app_frameworks)
+        self.check_output_space(self.path_to_app.stat().st_size + self.installed_sdk_size())
+        tmp_path = self.path_to_app.with_name(self.path_to_app.name + ".tmp")
+        try:
+            with zipfile.ZipFile(self.path_to_app) as source, zipfile.ZipFile(
+                tmp_path, "w", zipfile.ZIP_DEFLATED
+            ) as target, profile_span("splice"):
+                with profile_span("copy_raw", files=0, bytes=0) as span:
+                    for member in source.infolist():
+                        if not member.filename.startswith(sdk_prefix):
+                            Archiver.copy_raw_member(source, target, member)
+                            span["files"] += 1
+                            span["bytes"] += member.compress_size
+                manifest = self.sdk_manifest()
+                to_zip = []
+                if self.sdk_data.archive is not None:
+                    with zipfile.ZipFile(self.sdk_data.archive) as sdk_archive:
+                        Archiver.copy_raw_folder(
+                            sdk_archive,
+                            target,
+                            self.sdk_data.name,
+                            str(self.sdk_in_app_frameworks),
+                            include=self.is_copied_as_is,
+                        )
+                else:
+                    to_zip = [
+                        (str(self.sdk_data.sdk_location.joinpath(name)), sdk_prefix + name)
+                        for name in sorted(manifest["files"])
+                        if name not in self.thinned_files
+                    ]
+                thinned_size = sum(size for size, _ in self.thinned_files.values())
+                with ScratchSpace(
+                    thinned_size, self.scratch_dir
+                ) if self.thinned_files else nullcontext() as scratch:
+                    for i, name in enumerate(sorted(self.thinned_files)):
+                        thin_path = str(scratch.path.joinpath(str(i)))
+                        thin_macho(
+                            self.sdk_data.sdk_location.joinpath(name), thin_path, self.app_archs
+                        )
+                        to_zip.append((thin_path, sdk_prefix + name))
+                    if to_zip:
+                        Archiver.write_files(
+                            target,
+                            to_zip,
+                            self.workers,
+                            CompressionPolicy(self.compression_level),
+                        )
+                Archiver.writestr(
+                    target,
+                    sdk_prefix + SDK_MANIFEST_NAME,
+                    json.dumps(manifest, indent=2, sort_keys=True),
+                )
+            os.replace(tmp_path, self.path_to_app)
+        except Exception:
+            print_info("Failed to repackage. Please, sign it manually")
+            if VERBOSE:
+                traceback.print_exc()
+            if tmp_path.exists():
+                os.remove(tmp_path)
+            return False
+        return True
+
+
+class AndroidApkInstrumentifyStrategy(_InstrumentifyStrategy):
+    """Patch Android `apk` with specific SDK in one streaming pass.
+
+    Members of the original `apk` are copied byte for byte into a new
+    archive and files of the SDK folder are added to its root. Stored
+    members are aligned while written, no separate `zipalign` pass is
+    needed. Signatures are dropped, sign the `apk` again with `apksigner`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        import zipfile
+
+        super(AndroidApkInstrumentifyStrategy, self).__init__(*args, **kwargs)
+        with zipfile.ZipFile(self.path_to_app) as zfile:
+            self._index = ZipIndex(zfile)
+
+    @property
+    def app_frameworks(self):
+        return PurePosixPath("assets")
+
+    @property
+    def manifest_name(self):
+        # type: () -> str
+        return "{}/{}".format(self.sdk_in_app_frameworks, SDK_MANIFEST_NAME)
+
+    def was_already_instrumented(self):
+        # type: () -> bool
+        return self._index.find(self.manifest_name) is not None
+
+    def remove_sdk(self):
+        """Nothing to remove, old SDK members are skipped while copying."""
+
+    def installed_manifest(self):
+        # type: () -> dict | None
+        import zipfile
+
+        if self._index.find(self.manifest_name) is None:
+            return None
+        with zipfile.ZipFile(self.path_to_app) as zfile:
+            return json.loads(zfile.read(self.manifest_name).decode("utf-8"))
+
+    def installed_file_size(self, name):
+        # type: (str) -> int | None
+        node = self._index.find(name)
+        return node.size if node is not None and not node.is_dir else None
+
+    @staticmethod
+    def alignment(member):
+        # type: (zipfile.ZipInfo) -> int | None
+        """Alignment of stored members, compressed ones aren't aligned."""
+        import zipfile
+
+        if member.compress_type != zipfile.ZIP_STORED:
+            return None
+        if member.filename.endswith(".so"):
+            return APK_PAGE_ALIGNMENT
+        return APK_ALIGNMENT
+
+    @staticmethod
+    def is_signature(name):
+        # type: (str) -> bool
+        """Whether `name` is a file of JAR signature, invalid after patching."""
+        directory, basename = posixpath.split(name)
+        return directory == "META-INF" and (
+            basename == "MANIFEST.MF"
+            or posixpath.splitext(basename)[1] in (".SF", ".RSA", ".DSA", ".EC")
+        )
+
+    @contextmanager
+    def _sdk_archive(self):
+        """Archive with SDK folder, made from extracted SDK if not downloaded."""
+        import tempfile
+        import zipfile
+
+        if self.sdk_data.archive is not None:
+            with zipfile.ZipFile(self.sdk_data.archive) as zfile:
+                yield zfile
+            return
+        with tempfile.TemporaryFile() as f:
+            with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as zfile:
+                Archiver.write_dir(
+                    zfile,
+                    self.sdk_data.sdk_location,
+                    self.sdk_data.name,
+                    self.workers,
+                    CompressionPolicy(self.compression_level),
+                )
+            with zipfile.ZipFile(f) as zfile:
+                yield zfile
+
+    def instrumentify(self):
+        # type: () -> bool
+        import traceback
+        import zipfile
+
+        installed = self.installed_manifest() or {}
+        skip = set(installed.get("files", {}))
+        skip.add(self.manifest_name)
+        collisions = sorted(
+            name
+            for name in self.sdk_data.manifest()["files"]
+            if name not in skip and self._index.find(name) is not None
+        )
+        if collisions:
+            raise RuntimeError(
+                "`{}` already has files of SDK `{}`: {}".format(
+                    self.path_to_app, self.sdk_data.name, ", ".join(collisions)
+                )
+            )
+        self.check_output_space(self.path_to_app.stat().st_size + self.installed_sdk_size())
+        tmp_path = self.path_to_app.with_name(self.path_to_app.name + ".tmp")
+        try:
+            with zipfile.ZipFile(self.path_to_app) as source, zipfile.ZipFile(
+                tmp_path, "w", zipfile.ZIP_DEFLATED
+            ) as target, profile_span("splice"):
+                with profile_span("copy_raw", files=0, bytes=0) as span:
+                    for member in source.infolist():
+                        if member.filename in skip or self.is_signature(member.filename):
+                            continue
+                        Archiver.copy_raw_member(
+                            source, target, member, alignment=self.alignment(member)
+                        )
+                        span["files"] += 1
+                        span["bytes"] += member.compress_size
+                with self._sdk_archive() as sdk_archive:
+                    Archiver.copy_raw_folder(
+                        sdk_archive, target, self.sdk_data.name, "", align=self.alignment
+                    )
+                Archiver.writestr(
+                    target,
+                    self.manifest_name,
+                    json.dumps(self.sdk_data.manifest(), indent=2, sort_keys=True),
+                )
+            os.replace(tmp_path, self.path_to_app)
+        except Exception:
+            print_info("Failed to repackage `{}`".format(self.path_to_app))
+            if VERBOSE:
+                traceback.print_exc()
+            if tmp_path.exists():
+                os.remove(tmp_path)
+            return False
+        print_info("`apk` must be signed with `apksigner` before installing")
+        return True
+
+
+class CrcChecker(object):
+    """Running CRC-32 of a zip member checked against its central directory."""
+
+    def __init__(self, member, decompressor=None):
+        # type: (zipfile.ZipInfo, Any) -> None
+        self.member = member
+        self.decompressor = decompressor
+        self.crc = 0
+        self.size = 0
+
+    @classmethod
+    def for_member(cls, member):
+        # type: (zipfile.ZipInfo) -> CrcChecker | None
+        """Checker of stored or deflated `member`, None for other methods."""
+        import zipfile
+
+        if member.compress_type == zipfile.ZIP_STORED:
+            return cls(member)
+        if member.compress_type == zipfile.ZIP_DEFLATED:
+            return cls(member, zlib.decompressobj(-zlib.MAX_WBITS))
+        print_verbose(
+            "Can't verify CRC of `{}` compressed with method {}".format(
+                member.filename, member.compress_type
+            )
+        )
+        return None
+
+    def update(self, chunk):
+        # type: (bytes) -> None
+        if self.decompressor is not None:
+            chunk = self.decompressor.decompress(chunk)
+        self.crc = zlib.crc32(chunk, self.crc)
+        self.size += len(chunk)
+
+    def check(self):
+        # type: () -> None
+        import zipfile
+
+        if self.decompressor is not None:
+            tail = self.decompressor.flush()
+            self.crc = zlib.crc32(tail, self.crc)
+            self.size += len(tail)
+        if self.crc != self.member.CRC or self.size != self.member.file_size:
+            raise zipfile.BadZipFile("Bad CRC-32 of `{}`".format(self.member.filename))
+
+
+class Archiver(object):
+    @staticmethod
+    def is_dir_in_zip(fileinfo):
+        # type: (zipfile.ZipInfo) -> bool
+        hi = fileinfo.external_attr >> 16
+        return (hi & 0x4000) > 0
+
+    @staticmethod
+    def zip_dir(dirpath, zippath, workers=None, policy=None):
+        # type: (str | Path, str | Path, int | None, CompressionPolicy | None) -> None
+        import zipfile
+
+        with zipfile.ZipFile(zippath, "w", zipfile.ZIP_DEFLATED) as zfile:
+            to_zip = []
+            for root, dirs, files in os.walk(dirpath):
+                dirs.sort()
+                if os.path.basename(root)[0] == ".":
+                    continue  # skip hidden directories
+                for f in sorted(files):
+                    if f[-1] == "~" or (f[0] == "." and f != ".htaccess"):
+                        # skip backup files and all hidden files except .htaccess
+                        continue
+                    path = os.path.join(root, f)
+                    to_zip.append((path, os.path.relpath(path, dirpath)))
+            Archiver.write_files(zfile, to_zip, workers, policy)
+
+    @staticmethod
+    def write_dir(zfile, dirpath, arcname, workers=None, policy=None):
+        # type: (zipfile.ZipFile, Path, str, int | None, CompressionPolicy | None) -> None
+        """Compress files of `dirpath` into `zfile` under `arcname` prefix."""
+        to_zip = []
+        for root, dirs, files in os.walk(dirpath):
+            dirs.sort()
+            rel_root = Path(root).relative_to(dirpath).as_posix()
+            for f in sorted(files):
+                if f in FILES_COPY_SKIP_LIST:
+                    continue
+                to_zip.append(
+                    (
+                        os.path.join(root, f),
+                        posixpath.normpath(posixpath.join(arcname, rel_root, f)),
+                    )
+                )
+        Archiver.write_files(zfile, to_zip, workers, policy)
+
+    @staticmethod
+    def write_files(zfile, to_zip, workers=None, policy=None):
+        # type: (zipfile.ZipFile, list[tuple[str, str]], int | None, CompressionPolicy | None) -> None
+        """Compress `(path, arcname)` pairs in a thread pool and append them in order.
+
+        zlib releases the GIL, so members are compressed in parallel. At most
+        `2 * workers` compressed members are in flight, each spooled to disk
+        above `COMPRESS_SPOOL_SIZE`, which bounds memory for any member count.
+        Members stored by `policy` are read from their files when appended.
+        """
+        import zipfile
+        from concurrent import futures
+
+        workers = workers or os.cpu_count() or 1
+        policy = policy or CompressionPolicy(zfile.compresslevel)
+        pending = deque()
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor, profile_span(
+            "compress", workers=workers, level=policy.level
+        ) as span:
+            span.update(files=len(to_zip), bytes=0, stored=0)
+
+            def append(future):
+                zinfo, compressed = future.result()
+                span["bytes"] += zinfo.file_size
+                if zinfo.compress_type == zipfile.ZIP_STORED:
+                    span["stored"] += 1
+                Archiver._append_compressed(zfile, zinfo, compressed)
+
+            try:
+                for path, arcname in to_zip:
+                    pending.append(
+                        executor.submit(Archiver._compress_file, path, arcname, policy)
+                    )
+                    if len(pending) >= 2 * workers:
+                        append(pending.popleft())
+                while pending:
+                    append(pending.popleft())
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    @staticmethod
+    def normalize(zinfo):
+        # type: (zipfile.ZipInfo) -> zipfile.ZipInfo
+        """Drop filesystem details from `zinfo`: timestamp, owner permissions, host OS.
+
+        Files keep only whether they are executable, like in git.
+        """
+        mode = zinfo.external_attr >> 16
+        zinfo.date_time = ZIP_DATE_TIME
+        zinfo.create_system = 3  # unix, permissions are in `external_attr`
+        if zinfo.is_dir():
+            zinfo.external_attr = (0o40755 << 16) | 0x10
+        else:
+            zinfo.external_attr = (0o100755 if mode & 0o111 else 0o100644) << 16
+        return zinfo
+
+    @staticmethod
+    def writestr(zfile, arcname, data):
+        # type: (zipfile.ZipFile, str, str | bytes) -> None
+        """Compress `data` into `zfile` as a normalized member."""
+        import zipfile
+
+        zinfo = zipfile.ZipInfo(arcname, ZIP_DATE_TIME)
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zfile.writestr(Archiver.normalize(zinfo), data)
+
+    @staticmethod
+    def _compress_file(path, arcname, policy):
+        # type: (str, str, CompressionPolicy) -> tuple[zipfile.ZipInfo, BinaryIO]
+        """Return member info and a file object of data to append after its header."""
+        import tempfile
+        import zipfile
+
+        # not `ZipInfo.from_file`, it fails on mtime before 1980 which is dropped anyway
+        zinfo = zipfile.ZipInfo(arcname, ZIP_DATE_TIME)
+        zinfo.external_attr = (os.stat(path).st_mode & 0xFFFF) << 16
+        Archiver.normalize(zinfo)
+        zinfo.compress_type = policy.method(path, zinfo.filename)
+        if zinfo.compress_type == zipfile.ZIP_STORED:
+            compressor = None
+            compressed = open(path, "rb")
+        else:
+            compressor = zlib.compressobj(policy.zlib_level, zlib.DEFLATED, -15)
+            compressed = tempfile.SpooledTemporaryFile(max_size=COMPRESS_SPOOL_SIZE)
+        crc = 0
+        size = 0
+        try:
+            with open(path, "rb") as f:
+                while True:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    crc = zlib.crc32(chunk, crc)
+                    size += len(chunk)
+                    if compressor is not None:
+                        compressed.write(compressor.compress(chunk))
+            if compressor is not None:
+                compressed.write(compressor.flush())
+        except BaseException:
+            compressed.close()
+            raise
+        zinfo.CRC = crc
+        zinfo.file_size = size
+        zinfo.compress_size = size if compressor is None else compressed.tell()
+        compressed.seek(0)
+        return zinfo, compressed
+
+    @staticmethod
+    def _append_compressed(zfile, zinfo, compressed):
+        # type: (zipfile.ZipFile, zipfile.ZipInfo, BinaryIO) -> None
+        with compressed:
+            Archiver._append_raw(zfile, zinfo, compressed)
+
+    @staticmethod
+    def _append_raw(zfile, zinfo, data, on_chunk=None):
+        # type: (zipfile.ZipFile, zipfile.ZipInfo, BinaryIO, Callable | None) -> None
+        """Write header of `zinfo` and `compress_size` bytes of `data` to `zfile`."""
+        import zipfile
+
+        zinfo.header_offset = zfile.fp.tell()
+        zfile.fp.write(zinfo.FileHeader())
+        remaining = zinfo.compress_size
+        while remaining:
+            chunk = data.read(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                raise zipfile.BadZipFile("Truncated `{}`".format(zinfo.filename))
+            if on_chunk is not None:
+                on_chunk(chunk)
+            zfile.fp.write(chunk)
+            remaining -= len(chunk)
+
+        # register member so `zfile.close()` writes it to the central directory
+        zfile.filelist.append(zinfo)
+        zfile.NameToInfo[zinfo.filename] = zinfo
+        zfile.start_dir = zfile.fp.tell()
+        zfile._didModify = True
+
+    @staticmethod
+    def copy_raw_member(
+        source, target, member, arcname=None, verify=None, alignment=None, mode=None
+    ):
+        # type: (zipfile.ZipFile, zipfile.ZipFile, zipfile.ZipInfo, str | None, bool | None, int | None, int | None) -> zipfile.ZipInfo
+        """Copy compressed bytes of `member` from `source` into `target` as is.
+
+        CRC and sizes are reused from the central directory, so the data is
+        neither decompressed nor compressed again. The copy is renamed to
+        `arcname` if given. With `verify` (`VERIFY_CRC` by default) the data
+        is decompressed on the fly to check its CRC. With `alignment` the data
+        starts at its multiple, padded by extra field of the local header.
+        With `mode` the copy gets these permissions and goes through
+        `normalize` like members compressed by applitoolsify.
+        """
+        import zipfile
+
+        source.fp.seek(member.header_offset)
+        header = source.fp.read(zipfile.sizeFileHeader)
+        if header[:4] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile("Bad local header of `{}`".format(member.filename))
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        data_offset = (
+            member.header_offset + zipfile.sizeFileHeader + name_length + extra_length
+        )
+
+        new_member = copy.copy(member)
+        if arcname is not None:
+            new_member.filename = arcname
+        if mode is not None:
+            new_member.external_attr = (0o100000 | mode) << 16
+            Archiver.normalize(new_member)
+        # CRC and sizes are known upfront so no data descriptor is required
+        new_member.flag_bits &= ~0x08
+        new_member.extra = Archiver._strip_extra(member.extra, [ZIP64_EXTRA_ID])
+        extra = None
+        if alignment:
+            # old zipalign pads with zero bytes, read as fields of id 0
+            extra = Archiver._strip_extra(new_member.extra, [0, ALIGNMENT_EXTRA_ID])
+            new_member.extra = extra
+            new_member.extra = Archiver._aligned_extra(
+                extra, target.fp.tell() + len(new_member.FileHeader()), alignment
+            )
+        source.fp.seek(data_offset)
+        checker = None
+        if VERIFY_CRC if verify is None else verify:
+            checker = CrcChecker.for_member(member)
+        Archiver._append_raw(
+            target, new_member, source.fp, checker.update if checker else None
+        )
+        if extra is not None:
+            # padding is needed in the local header only
+            new_member.extra = extra
+        if checker is not None:
+            checker.check()
+        return new_member
+
+    @staticmethod
+    def _aligned_extra(extra, data_offset, alignment):
+        # type: (bytes, int, int) -> bytes
+        """`extra` with padding field moving data at `data_offset` to a multiple of `alignment`.
+
+        Same field as `apksigner` and `zipflinger` write: id, size, alignment
+        and zero padding.
+        """
+        padding = -(data_offset + 6) % alignment
+        return extra + struct.pack("<HHH", ALIGNMENT_EXTRA_ID, 2 + padding, alignment) + (
+            b"\0" * padding
+        )
+
+    @staticmethod
+    def _strip_extra(extra, header_ids):
+        # type: (bytes, list[int]) -> bytes
+        """Drop extra fields of `header_ids`.
+
+        Zip64 field is dropped from copied members, `ZipFile` adds a fresh
+        one when required.
+        """
+        stripped = b""
+        i = 0
+        while i + 4 <= len(extra):
+            header_id, size = struct.unpack("<HH", extra[i : i + 4])
+            if header_id not in header_ids:
+                stripped += extra[i : i + 4 + size]
+            i += 4 + size
+        return stripped
+
+    @staticmethod
+    def copy_raw_folder(
+        source, target, folder_name, arcname, index=None, align=None, include=None
+    ):
+        # type: (zipfile.ZipFile, zipfile.ZipFile, str, str, ZipIndex | None, Callable | None, Callable | None) -> None
+        """Copy files of `folder_name` dir of `source` into `target` under `arcname`.
+
+        Same members as `extract_specific_folder` followed by `write_dir` give,
+        without decompressing and compressing them again. `align` returns
+        alignment of a member, see `copy_raw_member`. `include` filters files
+        by name relative to `folder_name`.
+        """
+        import zipfile
+
+        index = index or ZipIndex(source)
+        found = index.find_dir(folder_name)
+        if found is None:
+            raise RuntimeError("`{}` not present in archive".format(folder_name))
+        with profile_span("copy_raw_sdk", files=0, bytes=0) as span:
+            for member in index.members(found):
+                basename = posixpath.basename(member.filename)
+                if member.is_dir() or basename in FILES_COPY_SKIP_LIST:
+                    continue
+                relative_name = member.filename[len(found.path) + 1 :]
+                if include is not None and not include(relative_name):
+                    continue
+                name = posixpath.join(arcname, relative_name)
+                if member.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                    new_member = Archiver.copy_raw_member(
+                        source,
+                        target,
+                        member,
+                        name,
+                        alignment=align(member) if align is not None else None,
+                        mode=SDK_FILE_MODE,
+                    )
+                else:
+                    # not readable by every unzip, compressed again
+                    new_member = zipfile.ZipInfo(name)
+                    new_member.external_attr = (0o100000 | SDK_FILE_MODE) << 16
+                    new_member.compress_type = zipfile.ZIP_DEFLATED
+                    Archiver.normalize(new_member)
+                    with source.open(member) as src, target.open(new_member, "w") as dst:
+                        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+                span["files"] += 1
+                span["bytes"] += member.file_size
+
+    @staticmethod
+    def restore_permissions(member, path):
+        # type: (zipfile.ZipInfo, str) -> None
+        """Apply unix permissions of `member` to its extracted `path`."""
+        attr = member.external_attr >> 16
+        if attr != 0:
+            os.chmod(path, attr)
+
+    @staticmethod
+    def extract_specific_folder(extract_to_path, zfile, extract_dir_name, index=None):
+        # type: (Path, zipfile.ZipFile, str, ZipIndex | None) -> Path
+        index = index or ZipIndex(zfile)
+        found = index.find_dir(extract_dir_name)
+        # if `extract_dir_name` dir not present in archive raise an exception
+        if found is None:
+            raise RuntimeError("`{}` not present in archive".format(extract_dir_name))
+
+        # strip top directories
+        top_dirs_length = len(found.path) - len(extract_dir_name)
+        with profile_span("extract_sdk", files=0, bytes=0) as span:
+            for node in index.walk(found):
+                targetpath = extract_to_path.joinpath(node.path[top_dirs_length:])
+                if node.is_dir:
+                    targetpath.mkdir(parents=True, exist_ok=True)
+                    continue
+                # Create all upper directories if necessary.
+                targetpath.parent.mkdir(parents=True, exist_ok=True)
+                with zfile.open(node.info) as source, open(targetpath, "wb") as target:
+                    shutil.copyfileobj(source, target)
+                # Required to get android scripts working
+                os.chmod(targetpath, SDK_FILE_MODE)
+                span["files"] += 1
+                span["bytes"] += node.size
+        return extract_to_path.joinpath(extract_dir_name)
+
+
+class CompressionPolicy(object):
+    """Choose compression of archive members.
+
+    Members of `original_methods` (arcname to method of the archive being
+    repackaged) keep their method. Files with `STORED_EXTENSIONS` and files
+    whose first `sample_size` bytes don't shrink by deflate are stored,
+    everything else is deflated with `level`.
+    """
+
+    def __init__(
+        self,
+        level=None,
+        original_methods=None,
+        store_extensions=STORED_EXTENSIONS,
+        sample_size=64 * 1024,
+        min_saving=0.05,
+    ):
+        # type: (int | None, dict[str, int] | None, list[str], int, float) -> None
+        self.level = level
+        self.original_methods = original_methods or {}
+        self.store_extensions = set(store_extensions)
+        self.sample_size = sample_size
+        self.min_saving = min_saving
+
+    @property
+    def zlib_level(self):
+        # type: () -> int
+        return zlib.Z_DEFAULT_COMPRESSION if self.level is None else self.level
+
+    @classmethod
+    def from_archive(cls, zfile, level=None, exclude_prefix=None):
+        # type: (zipfile.ZipFile, int | None, str | None) -> CompressionPolicy
+        """Policy keeping methods of `zfile` members, except ones under `exclude_prefix`."""
+        return cls(
+            level,
+            original_methods={
+                info.filename: info.compress_type
+                for info in zfile.infolist()
+                if not (exclude_prefix and info.filename.startswith(exclude_prefix))
+            },
+        )
+
+    def method(self, path, arcname):
+        # type: (str, str) -> int
+        import zipfile
+
+        original = self.original_methods.get(arcname)
+        if original in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            return original
+        if self.level == 0:
+            return zipfile.ZIP_STORED
+        if os.path.splitext(arcname)[1].lower() in self.store_extensions:
+            return zipfile.ZIP_STORED
+        if self.sample_size and not self._compressible(path):
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def _compressible(self, path):
+        # type: (str) -> bool
+        with open(path, "rb") as f:
+            sample = f.read(self.sample_size)
+        if not sample:
+            return True
+        compressed = zlib.compress(sample, 1)
+        return len(compressed) <= len(sample) * (1 - self.min_saving)
+
+
+class ZipIndex(object):
+    """Prefix tree of archive members built in one pass over the central directory.
+
+    Lookups by path cost O(depth) instead of a scan over all members.
+    Directories implied by member paths are present even if the archive has no
+    entries for them.
+    """
+
+    class Node(object):
+        __slots__ = ("name", "path", "is_dir", "info", "children")
+
+        def __init__(self, name, path, is_dir):
+            # type: (str, str, bool) -> None
+            self.name = name
+            self.path = path
+            self.is_dir = is_dir
+            self.info = None  # type: zipfile.ZipInfo | None
+            self.children = {}  # type: dict[str, ZipIndex.Node]
+
+        def __repr__(self):
+            return "ZipIndex.Node<{}>".format(self.path)
+
+        @property
+        def size(self):
+            # type: () -> int
+            return self.info.file_size if self.info else 0
+
+        @property
+        def compress_size(self):
+            # type: () -> int
+            return self.info.compress_size if self.info else 0
+
+        @property
+        def offset(self):
+            # type: () -> int | None
+            return self.info.header_offset if self.info else None
+
+    def __init__(self, zfile):
+        # type: (zipfile.ZipFile) -> None
+        self.zfile = zfile
+        self.root = ZipIndex.Node("", "", True)
+        self._dirs_by_name = {}  # type: dict[str, list[ZipIndex.Node]]
+        for info in zfile.infolist():
+            is_dir = info.filename.endswith("/") or Archiver.is_dir_in_zip(info)
+            parts = info.filename.rstrip("/").split("/")
+            node = self.root
+            for i, part in enumerate(parts):
+                last = i == len(parts) - 1
+                child = node.children.get(part)
+                if child is None:
+                    child = ZipIndex.Node(
+                        part, "/".join(parts[: i + 1]), is_dir or not last
+                    )
+                    node.children[part] = child
+                    if child.is_dir:
+                        self._dirs_by_name.setdefault(part, []).append(child)
+                node = child
+            node.info = info
+
+    def find(self, path):
+        # type: (str) -> ZipIndex.Node | None
+        node = self.root
+        for part in path.strip("/").split("/"):
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def find_dir(self, name):
+        # type: (str) -> ZipIndex.Node | None
+        """Return the topmost directory with `name` anywhere in the archive."""
+        dirs = self._dirs_by_name.get(name)
+        if not dirs:
+            return None
+        return min(dirs, key=lambda node: node.path.count("/"))
+
+    def walk(self, node=None):
+        # type: (ZipIndex.Node | None) -> Iterator[ZipIndex.Node]
+        """Yield `node` and all nodes below it, parents before children."""
+        stack = [node or self.root]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(list(node.children.values())))
+
+    def members(self, node=None):
+        # type: (ZipIndex.Node | None) -> list[zipfile.ZipInfo]
+        """Archive members of `node` and below in central directory order."""
+        members = [n.info for n in self.walk(node) if n.info is not None]
+        return sorted(members, key=lambda info: info.header_offset)
+
+    def app_in_payload(self):
+        # type: () -> PurePosixPath
+        """Path of the single `.app` inside `Payload` of `ipa`."""
+        payload = self.find("Payload")
+        apps = [
+            name for name in (payload.children if payload else {}) if name.endswith(".app")
+        ]
+        if len(apps) > 1:
+            raise RuntimeError("Payload contains more then one app")
+        if not apps:
+            raise RuntimeError("Payload doesn't contain app")
+        return PurePosixPath("Payload", apps[0])
+
+    def read_plist(self, path):
+        # type: (str) -> dict
+        import plistlib
+
+        return plistlib.loads(self.zfile.read(self.find(path).info))
+
+    def sdk_version(self, name):
+        # type: (str) -> str
+        """Read `<short version>.<build>` of `name` xcframework, same as `extract.py`."""
+        sdk = self.find_dir(name)
+        for slice_name in sorted(sdk.children if sdk else {}):
+            for framework in sorted(sdk.children[slice_name].children):
+                info_plist = "{}/{}/{}/Info.plist".format(sdk.path, slice_name, framework)
+                if framework.endswith(".framework") and self.find(info_plist):
+                    pl = self.read_plist(info_plist)
+                    return "{}.{}".format(
+                        pl["CFBundleShortVersionString"], pl["CFBundleVersion"]
+                    )
+        return "unknown"
+
+
+class Instrumenter(object):
+    """Allow to instrumentify specific application with Applitools SDK."""
+
+    instrument_strategies = {
+        "app": IOSAppPatcherInstrumentifyStrategy,
+        "ipa": IOSIpaInstrumentifyStrategy,
+        "apk": AndroidApkInstrumentifyStrategy,
+    }
+    # Used when no signing is required, app content is left untouched
+    splice_strategies = {
+        "ipa": IOSIpaSpliceInstrumentifyStrategy,
+    }
+
+    def __init__(
+        self,
+        path_to_app,
+        sdk_data,
+        local,
+        signing_certificate_name=None,
+        provisioning_profile=None,
+        splice=True,
+        workers=None,
+        codesign=None,
+        install_mode="auto",
+        compression_level=None,
+        result_cache=None,
+        scratch_dir=None,
+    ):
+        # type: (str, SdkData, str, str, str, bool, int | None, str | None, str, int | None, ResultCache | None, Path | str | None) -> None
+        self.path_to_app = Path(path_to_app).absolute()
+        self.app_name = path_to_app
+        self.app_ext = self.path_to_app.suffix
+        self.sdk_data = sdk_data
+        self.local = local
+        # set when the app was already instrumented with the same SDK
+        self.up_to_date = False
+        required = SUPPORTED_FRAMEWORKS[APP_SDKS[self.app_ext]]
+        if sdk_data.name != required.name:
+            raise RuntimeError(
+                "`{}` can't be instrumented with `{}`, `{}` is required".format(
+                    self.path_to_app, sdk_data.name, required.name
+                )
+            )
+        strategy = self.instrument_strategies[self.app_ext.lstrip(".")]
+        signing = all([signing_certificate_name, provisioning_profile])
+        if splice and not signing:
+            strategy = self.splice_strategies.get(self.app_ext.lstrip("."), strategy)
+        self._strategy = strategy
+        self._strategy_options = {
+            "path_to_app": self.path_to_app,
+            "sdk_data": sdk_data,
+            "local": local,
+            "signing_certificate_name": signing_certificate_name,
+            "provisioning_profile": provisioning_profile,
+            "workers": workers,
+            "codesign": codesign,
+            "install_mode": install_mode,
+            "compression_level": compression_level,
+            "scratch_dir": scratch_dir,
+        }
+        self._strategy_instance = None  # type: _InstrumentifyStrategy | None
+        # `.app` dirs are patched in place, only archives are cached
+        self.result_cache = result_cache if self.path_to_app.is_file() else None
+        # options changing the output, part of result cache key
+        self._output_options = {
+            "strategy": strategy.__name__,
+            "signing_certificate_name": signing_certificate_name,
+            "provisioning_profile": provisioning_profile,
+            "codesign": codesign,
+            "compression_level": compression_level,
+        }
+        # set when the app was taken from the result cache
+        self.cached = False
+
+    @property
+    def _instrumenter(self):
+        # type: () -> _InstrumentifyStrategy
+        """Strategy made on first use, result cache hits don't extract the app."""
+        if self._strategy_instance is None:
+            self._strategy_instance = self._strategy(**self._strategy_options)
+        return self._strategy_instance
+
+    def was_already_instrumented(self):
+        # type: () -> bool
+        return self._instrumenter.was_already_instrumented()
+
+    def instrumentify(self):
+        # type: () -> bool
+        """Instrument the app, scratch files of the strategy are removed once done."""
+        try:
+            return self._instrumentify_cached()
+        finally:
+            if self._strategy_instance is not None:
+                self._strategy_instance.close()
+
+    def _instrumentify_cached(self):
+        # type: () -> bool
+        with profile_span("instrument", path=str(self.path_to_app)):
+            if self.result_cache is None:
+                return self._instrumentify()
+            with profile_span("result_cache") as span:
+                options = dict(self._output_options)
+                if options["provisioning_profile"]:
+                    # same path may hold another profile, its content is keyed
+                    options["provisioning_profile"] = ResultCache.file_digest(
+                        options["provisioning_profile"]
+                    )
+                key = self.result_cache.key(self.path_to_app, self.sdk_data, options)
+                self.cached = span["hit"] = self.result_cache.get(key, self.path_to_app)
+            if self.cached:
+                print_info(
+                    "`{}` is ready for use with the `{}` (from `{}`)".format(
+                        self.path_to_app, self.sdk_data.name, self.result_cache
+                    )
+                )
+                return True
+            if not self._instrumentify():
+                return False
+            # output of up to date apps is the input, nothing to keep
+            if not self.up_to_date:
+                self.result_cache.put(key, self.path_to_app)
+            return True
+
+    def _instrumentify(self):
+        # type: () -> bool
+        if self.was_already_instrumented():
+            if self._instrumenter.is_up_to_date():
+                self.up_to_date = True
+                print_info(
+                    "`{}` is already instrumented with `{}` {}".format(
+                        self.path_to_app, self.sdk_data.name, self.sdk_data.version
+                    )
+                )
+                return True
+            print_verbose("App already instrumented. Updating...")
+            # remove old installation
+            self._instrumenter.remove_sdk()
+        if not self._instrumenter.instrumentify():
+            print_info("Failed to instrument `{}`".format(self.path_to_app))
+            return False
+        print_verbose(
+            "`{}` framework was added to `{}`".format(
+                self.sdk_data.name, self._instrumenter.sdk_in_app_frameworks
+            )
+        )
+        print_info(
+            "`{}` is ready for use with the `{}`".format(
+                self.path_to_app, self.sdk_data.name
+            )
+        )
+        return True
+
+
+class BatchResult(object):
+    """DTO with outcome of instrumenting one app in batch."""
+
+    def __init__(self, path, ok, duration, error=None):
+        # type: (str, bool, float, str | None) -> None
+        self.path = path
+        self.ok = ok
+        self.duration = duration
+        self.error = error
+
+    def __str__(self):
+        return "BatchResult<{}, ok={}>".format(self.path, self.ok)
+
+
+def instrument_job(path, sdk_data, local, **options):
+    # type: (str, SdkData, bool, ...) -> BatchResult
+    """Instrument one app of batch or service with `Instrumenter` `options`.
+
+    Failures are reported in the result instead of raised.
+    """
+    import traceback
+
+    start = time.time()
+    if not validate_path_to_app(path):
+        return BatchResult(path, False, 0.0, "invalid path")
+    try:
+        ok = Instrumenter(path, sdk_data, local, **options).instrumentify()
+        error = None if ok else "failed to instrument"
+    except Exception as e:
+        if VERBOSE:
+            traceback.print_exc()
+        ok, error = False, str(e) or e.__class__.__name__
+    return BatchResult(path, ok, time.time() - start, error)
+
+
+class BatchInstrumenter(object):
+    """Instrument many apps with one shared SDK using a pool of workers."""
+
+    def __init__(
+        self,
+        paths,
+        sdk_data,
+        local,
+        signing_certificate_name=None,
+        provisioning_profile=None,
+        splice=True,
+        workers=None,
+        parallel=None,
+        codesign=None,
+        install_mode="auto",
+        compression_level=None,
+        result_cache=None,
+        scratch_dir=None,
+    ):
+        # type: (list[str], SdkData, bool, str, str, bool, int | None, int | None, str | None, str, int | None, ResultCache | None, Path | str | None) -> None
+        self.paths = []  # type: list[str]
+        for path in paths:
+            if path not in self.paths:
+                self.paths.append(path)
+        self.sdk_data = sdk_data
+        self.local = local
+        self.signing_certificate_name = signing_certificate_name
+        self.provisioning_profile = provisioning_profile
+        self.splice = splice
+        self.codesign = codesign
+        self.install_mode = install_mode
+        self.compression_level = compression_level
+        self.result_cache = result_cache
+        self.scratch_dir = scratch_dir
+        cpus = os.cpu_count() or 1
+        self.parallel = max(1, min(parallel or cpus, len(self.paths)))
+        # share CPUs between apps processed at once
+        self.workers = workers or max(1, cpus // self.parallel)
+
+    def run(self):
+        # type: () -> list[BatchResult]
+        """Instrument all apps and return results in the order of `paths`."""
+        from concurrent import futures
+
+        print_info(
+            "Instrumenting {} apps, {} at once...".format(len(self.paths), self.parallel)
+        )
+        with futures.ThreadPoolExecutor(max_workers=self.parallel) as executor:
+            return list(executor.map(self.instrument, self.paths))
+
+    def instrument(self, path):
+        # type: (str) -> BatchResult
+        """Instrument one app, failures are reported in the result instead of raised."""
+        return instrument_job(
+            path,
+            self.sdk_data,
+            self.local,
+            signing_certificate_name=self.signing_certificate_name,
+            provisioning_profile=self.provisioning_profile,
+            splice=self.splice,
+            workers=self.workers,
+            codesign=self.codesign,
+            install_mode=self.install_mode,
+            compression_level=self.compression_level,
+            result_cache=self.result_cache,
+            scratch_dir=self.scratch_dir,
+        )
+
+
+def read_manifest(path):
+    # type: (str) -> list[str]
+    """Read app paths listed one per line, relative ones are relative to the manifest.
+
+    Empty lines and lines starting with `#` are skipped.
+    """
+    manifest_dir = Path(path).absolute().parent
+    paths = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                paths.append(str(manifest_dir.joinpath(line)))
+    return paths
+
+
+def print_batch_summary(results):
+    # type: (list[BatchResult]) -> None
+    failed = [result for result in results if not result.ok]
+    print_info(
+        "Summary: {} succeeded, {} failed".format(
+            len(results) - len(failed), len(failed)
+        )
+    )
+    for result in results:
+        print_info(
+            "  {:<7}{:>8.1f}s  {}{}".format(
+                "OK" if result.ok else "FAILED",
+                result.duration,
+                result.path,
+                ": {}".format(result.error) if result.error else "",
+            )
+        )
+
+
+@contextmanager
+def _api_call(profiler):
+    # type: (Profiler) -> Iterator[Profiler]
+    """Silence output of the current thread and record its spans to `profiler`."""
+    ident = threading.get_ident()
+    previous = _API_CALLS.get(ident)
+    _API_CALLS[ident] = profiler
+    try:
+        yield profiler
+    finally:
+        if previous is None:
+            del _API_CALLS[ident]
+        else:
+            _API_CALLS[ident] = previous
+
+
+class SdkBundle(object):
+    """SDK downloaded once and shared by `instrument` calls.
+
+    Loaded on first use or by `load`, kept until `close`::
+
+        with SdkBundle.from_sdk_name("ios_nmg") as bundle:
+            for path in paths:
+                result = instrument(path, bundle)
+    """
+
+    def __init__(self, sdk_data, local=False, cache=None):
+        # type: (SdkData, bool, SdkCache | None) -> None
+        # copied, bundles of the same SDK don't share download state
+        self.sdk_data = copy.copy(sdk_data)
+        self.local = local
+        self._manager = SdkDownloadManager(self.sdk_data, local, cache)
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.timings = {}  # type: dict[str, float]
+
+    @classmethod
+    def from_sdk_name(
+        cls,
+        sdk_name="ios_nmg",
+        local=False,
+        cache_dir=None,
+        cache=True,
+        expected_sha256=None,
+        sdk_url=None,
+    ):
+        # type: (str, bool, Path | str | None, bool, str | None, str | None) -> SdkBundle
+        """Bundle of supported SDK, `cache=False` downloads it to a temporary directory."""
+        sdk_cache = None
+        if cache:
+            sdk_cache = SdkCache(Path(cache_dir) if cache_dir else default_cache_dir())
+        return cls(sdk_data_for(sdk_name, expected_sha256, sdk_url), local, sdk_cache)
+
+    @property
+    def version(self):
+        # type: () -> str | None
+        return self.sdk_data.version
+
+    def load(self):
+        # type: () -> SdkBundle
+        """Download SDK unless already loaded, safe to call from several threads."""
+        with self._lock:
+            if not self._loaded:
+                with _api_call(Profiler()) as profiler:
+                    self._manager.download_and_extract()
+                self.timings = {
+                    name: total["seconds"] for name, total in profiler.totals().items()
+                }
+                self._loaded = True
+        return self
+
+    def close(self):
+        # type: () -> None
+        """Release the SDK, the bundle is loaded again on next use."""
+        with self._lock:
+            if self._loaded:
+                self._manager.remove_sdk_data()
+                self._loaded = False
+
+    def __enter__(self):
+        # type: () -> SdkBundle
+        return self.load()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class InstrumentOptions(object):
+    """DTO with options of `instrument`, same as the CLI ones.
+
+    `output_path` makes a copy of the app to instrument instead of
+    instrumenting it in place. `result_cache` is off unless given.
+    """
+
+    def __init__(
+        self,
+        output_path=None,
+        signing_certificate_name=None,
+        provisioning_profile=None,
+        splice=True,
+        workers=None,
+        codesign=None,
+        install_mode="auto",
+        compression_level=None,
+        result_cache=None,
+        scratch_dir=None,
+    ):
+        # type: (Path | str | None, str | None, str | None, bool, int | None, str | None, str, int | None, ResultCache | None, Path | str | None) -> None
+        self.output_path = output_path
+        self.signing_certificate_name = signing_certificate_name
+        self.provisioning_profile = provisioning_profile
+        self.splice = splice
+        self.workers = workers
+        self.codesign = codesign
+        self.install_mode = install_mode
+        self.compression_level = compression_level
+        self.result_cache = result_cache
+        self.scratch_dir = scratch_dir
+
+
+class InstrumentResult(object):
+    """DTO with outcome of `instrument`.
+
+    `timings` maps phases to seconds spent in them, `total` included.
+    Sizes are in bytes, `.app` sizes are sums of its files.
+    """
+
+    def __init__(self, path, output_path):
+        # type: (Path, Path) -> None
+        self.path = path
+        self.output_path = output_path
+        self.ok = False
+        self.up_to_date = False
+        # taken from the result cache
+        self.cached = False
+        self.error = None  # type: str | None
+        self.input_size = None  # type: int | None
+        self.output_size = None  # type: int | None
+        self.timings = {}  # type: dict[str, float]
+
+    def __str__(self):
+        return "InstrumentResult<{}, ok={}>".format(self.output_path, self.ok)
+
+
+def app_size(path):
+    # type: (Path) -> int
+    return dir_size(path) if path.is_dir() else os.path.getsize(path)
+
+
+def instrument(path, bundle, options=None):
+    # type: (Path | str, SdkBundle, InstrumentOptions | None) -> InstrumentResult
+    """Instrument `.app`, `.ipa` or `.apk` at `path` with SDK of `bundle`.
+
+    `.apk` requires a bundle of the Android SDK with its `sdk_url`, the SDK
+    is not released yet.
+
+    Nothing is printed and failures are reported in the result instead of
+    raised. Calls from several threads are fine as long as they instrument
+    different apps.
+    """
+    options = options or InstrumentOptions()
+    path = Path(path).absolute()
+    output_path = Path(options.output_path).absolute() if options.output_path else path
+    result = InstrumentResult(path, output_path)
+    start = time.perf_counter()
+    with _api_call(Profiler()) as profiler:
+        try:
+            if path.suffix.lstrip(".") not in Instrumenter.instrument_strategies:
+                raise RuntimeError("Supported only `*.app`, `*.ipa` or `*.apk` apps")
+            if not path.exists():
+                raise RuntimeError("Path `{}` does not exist".format(path))
+            bundle.load()
+            result.input_size = app_size(path)
+            if output_path != path:
+                with profile_span("copy_app"):
+                    if path.is_dir():
+                        shutil.rmtree(output_path, ignore_errors=True)
+                        shutil.copytree(path, output_path, symlinks=True)
+                    else:
+                        shutil.copy2(path, output_path)
+            instrumenter = Instrumenter(
+                str(output_path),
+                bundle.sdk_data,
+                bundle.local,
+                options.signing_certificate_name,
+                options.provisioning_profile,
+                splice=options.splice,
+                workers=options.workers,
+                codesign=options.codesign,
+                install_mode=options.install_mode,
+                compression_level=options.compression_level,
+                result_cache=options.result_cache,
+                scratch_dir=options.scratch_dir,
+            )
+            result.ok = instrumenter.instrumentify()
+            result.up_to_date = instrumenter.up_to_date
+            result.cached = instrumenter.cached
+            if not result.ok:
+                result.error = "failed to instrument"
+            result.output_size = app_size(output_path)
+        except Exception as e:
+            result.error = str(e) or e.__class__.__name__
+    result.timings = {name: total["seconds"] for name, total in profiler.totals().items()}
+    result.timings["total"] = time.perf_counter() - start
+    return result
+
+
+class ServiceBusy(Exception):
+    """Raised when all job slots and the queue of `InstrumentationService` are taken."""
+
+
+class ServiceMetrics(object):
+    """Throughput and latency counters of `InstrumentationService`."""
+
+    WINDOW = 1000  # latencies of the most recent jobs kept for percentiles
+
+    def __init__(self):
+        self.started = time.time()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.queued = 0
+        self.latencies = deque(maxlen=self.WINDOW)  # type: deque[float]
+        self.waits = deque(maxlen=self.WINDOW)  # type: deque[float]
+
+    def record(self, ok, wait, latency):
+        # type: (bool, float, float) -> None
+        if ok:
+            self.completed += 1
+        else:
+            self.failed += 1
+        self.waits.append(wait)
+        self.latencies.append(latency)
+
+    def snapshot(self):
+        # type: () -> dict
+        uptime = time.time() - self.started
+        return {
+            "uptime_seconds": uptime,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "jobs_per_minute": (self.completed + self.failed) * 60 / uptime
+            if uptime
+            else 0.0,
+            "latency_seconds": self._stats(self.latencies),
+            "queue_wait_seconds": self._stats(self.waits),
+        }
+
+    @staticmethod
+    def _stats(values):
+        # type: (deque[float]) -> dict
+        if not values:
+            return {"mean": None, "p50": None, "p95": None, "max": None}
+        ordered = sorted(values)
+
+        def percentile(p):
+            return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+        return {
+            "mean": sum(ordered) / len(ordered),
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "max": ordered[-1],
+        }
+
+
+def is_loopback(host):
+    # type: (str) -> bool
+    """Whether `host` address is reachable from the local machine only."""
+    import ipaddress
+
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class InstrumentationService(object):
+    """HTTP service on localhost instrumenting apps with an SDK kept warm between jobs.
+
+    `POST /instrument?path=<path>` instruments `.app`, `.ipa` or `.apk` on the local disk
+    in place and answers with JSON result. It is served on loopback `host` only and
+    requires `Authorization: Bearer <token>`, with `token` generated at startup and
+    written to `token_file` readable by the user only. A browser can't send the header
+    cross-origin without a preflight, which the service doesn't answer.
+    `POST /instrument?name=<name>.ipa` with `.ipa` as the body answers with the
+    instrumented `.ipa`.
+    `GET /metrics` answers with `ServiceMetrics`, `GET /health` with the SDK in use.
+
+    At most `concurrency` jobs run at once, up to `max_queue` more wait for a
+    slot in order of arrival and the rest are rejected with 503.
+    """
+
+    def __init__(
+        self,
+        sdk_data,
+        local,
+        host="127.0.0.1",
+        port=SERVICE_PORT,
+        concurrency=None,
+        max_queue=SERVICE_MAX_QUEUE,
+        splice=True,
+        workers=None,
+        codesign=None,
+        install_mode="auto",
+        compression_level=None,
+        result_cache=None,
+        scratch_dir=None,
+        token_file=None,
+    ):
+        # type: (SdkData, bool, str, int, int | None, int, bool, int | None, str | None, str, int | None, ResultCache | None, Path | str | None, Path | str | None) -> None
+        import secrets
+        from concurrent import futures
+
+        cpus = os.cpu_count() or 1
+        self.sdk_data = sdk_data
+        self.host = host
+        self.port = port
+        # anyone reaching the port could rewrite any file the service can write
+        self.serves_paths = is_loopback(host)
+        self.token = secrets.token_urlsafe(32)
+        self.token_file = Path(token_file) if token_file else None
+        self.concurrency = max(1, concurrency or cpus)
+        self.max_queue = max_queue
+        self.metrics = ServiceMetrics()
+        self.local = local
+        # `Instrumenter` options of every job
+        self._job_options = {
+            "splice": splice,
+            # share CPUs between jobs running at once
+            "workers": workers or max(1, cpus // self.concurrency),
+            "codesign": codesign,
+            "install_mode": install_mode,
+            "compression_level": compression_level,
+            "result_cache": result_cache,
+            "scratch_dir": scratch_dir,
+        }
+        self._executor = futures.ThreadPoolExecutor(max_workers=self.concurrency)
+        self._slots = None  # type: asyncio.Semaphore | None
+        self._path_locks = {}  # type: dict[str, list]
+        self._server = None  # type: asyncio.AbstractServer | None
+
+    @property
+    def url(self):
+        # type: () -> str
+        return "http://{}:{}".format(self.host, self.port)
+
+    async def start(self):
+        # type: () -> None
+        import asyncio
+
+        # listing of SDK files is reused by every job
+        self.sdk_data.manifest()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.token_file is not None and self.serves_paths:
+            self.token_file.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(str(self.token_file), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            # mode of an existing file is kept by `os.open`
+            os.chmod(self.token_file, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(self.token)
+
+    async def close(self):
+        # type: () -> None
+        self._server.close()
+        await self._server.wait_closed()
+        self._executor.shutdown(wait=True)
+        if self.token_file is not None and self.token_file.exists():
+            os.remove(self.token_file)
+
+    async def serve_forever(self):
+        # type: () -> None
+        await self.start()
+        print_info(
+            "Serving on {} with `{}` {}, {} jobs at once".format(
+                self.url, self.sdk_data.name, self.sdk_data.version, self.concurrency
+            )
+        )
+        if not self.serves_paths:
+            print_info("! Not a loopback address, only uploads are instrumented")
+        elif self.token_file is not None:
+            print_info("Token of `path` jobs is in `{}`".format(self.token_file))
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def instrument(self, path):
+        # type: (str) -> BatchResult
+        """Run instrumentation of `path` once a job slot is free.
+
+        Jobs for the same path are run one after another.
+        """
+        import asyncio
+
+        if self._slots.locked() and self.metrics.queued >= self.max_queue:
+            self.metrics.rejected += 1
+            raise ServiceBusy("{} jobs are queued".format(self.metrics.queued))
+        start = time.perf_counter()
+        path_lock = self._path_locks.setdefault(path, [asyncio.Lock(), 0])
+        path_lock[1] += 1
+        self.metrics.queued += 1
+        queued = True
+        try:
+            async with path_lock[0], self._slots:
+                self.metrics.queued -= 1
+                queued = False
+                wait = time.perf_counter() - start
+                self.metrics.in_flight += 1
+                try:
+                    result = await asyncio.get_running_loop().run_in_executor(
+                        self._executor, self._run_job, path
+                    )
+                finally:
+                    self.metrics.in_flight -= 1
+        finally:
+            if queued:  # cancelled while waiting
+                self.metrics.queued -= 1
+            path_lock[1] -= 1
+            if not path_lock[1]:
+                del self._path_locks[path]
+        self.metrics.record(result.ok, wait, time.perf_counter() - start)
+        return result
+
+    def _run_job(self, path):
+        # type: (str) -> BatchResult
+        return instrument_job(path, self.sdk_data, self.local, **self._job_options)
+
+    async def _handle(self, reader, writer):
+        # type: (asyncio.StreamReader, asyncio.StreamWriter) -> None
+        import asyncio
+        import traceback
+
+        try:
+            method, target, headers = await self._read_head(reader)
+            url = urlsplit(target)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if method == "GET" and url.path == "/metrics":
+                await self._respond_json(writer, 200, self.metrics.snapshot())
+            elif method == "GET" and url.path == "/health":
+                await self._respond_json(
+                    writer,
+                    200,
+                    {"sdk": self.sdk_data.name, "version": self.sdk_data.version},
+                )
+            elif method == "POST" and url.path == "/instrument":
+                if "path" in query and not self.serves_paths:
+                    await self._respond_json(
+                        writer, 403, {"error": "`path` is served on loopback addresses only"}
+                    )
+                elif "path" in query and not self._authorized(headers):
+                    await self._respond_json(
+                        writer,
+                        401,
+                        {"error": "`path` requires `Authorization: Bearer <token>`"},
+                    )
+                elif "path" in query:
+                    await self._instrument_path(writer, query["path"])
+                else:
+                    await self._instrument_upload(
+                        reader, writer, headers, query.get("name", "app.ipa")
+                    )
+            else:
+                await self._respond_json(writer, 404, {"error": "not found"})
+        except ServiceBusy as e:
+            await self._respond_json(writer, 503, {"error": str(e)})
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            await self._respond_json(writer, 400, {"error": str(e)})
+        except ConnectionError:
+            pass  # client went away
+        except Exception as e:
+            if VERBOSE:
+                traceback.print_exc()
+            await self._respond_json(writer, 500, {"error": str(e)})
+        finally:
+            writer.close()
+
+    def _authorized(self, headers):
+        # type: (dict[str, str]) -> bool
+        import hmac
+
+        expected = "Bearer {}".format(self.token)
+        return hmac.compare_digest(
+            headers.get("authorization", "").encode("latin-1"), expected.encode("latin-1")
+        )
+
+    async def _instrument_path(self, writer, path):
+        # type: (asyncio.StreamWriter, str) -> None
+        if not os.path.isabs(path):
+            raise ValueError("`path` has to be absolute")
+        result = await self.instrument(path)
+        await self._respond_json(writer, 200 if result.ok else 422, self._result(result))
+
+    async def _instrument_upload(self, reader, writer, headers, name):
+        # type: (asyncio.StreamReader, asyncio.StreamWriter, dict, str) -> None
+        import asyncio
+        import tempfile
+
+        name = os.path.basename(name)
+        if not name.endswith(".ipa"):
+            raise ValueError("Only `.ipa` can be uploaded")
+        if "content-length" not in headers:
+            raise ValueError("`Content-Length` is required")
+        remaining = int(headers["content-length"])
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, name)
+            with open(path, "wb") as f:
+                while remaining:
+                    chunk = await reader.read(min(remaining, CHUNK_SIZE))
+                    if not chunk:
+                        raise asyncio.IncompleteReadError(b"", remaining)
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            result = await self.instrument(path)
+            if not result.ok:
+                await self._respond_json(writer, 422, self._result(result))
+                return
+            await self._write_head(
+                writer,
+                200,
+                {
+                    "Content-Type": "application/octet-stream",
+                    "Content-Length": os.path.getsize(path),
+                    "Content-Disposition": 'attachment; filename="{}"'.format(name),
+                },
+            )
+            with open(path, "rb") as f:
+                while True:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    writer.write(chunk)
+                    await writer.drain()
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @staticmethod
+    def _result(result):
+        # type: (BatchResult) -> dict
+        return {
+            "path": result.path,
+            "ok": result.ok,
+            "seconds": result.duration,
+            "error": result.error,
+        }
+
+    @staticmethod
+    async def _read_head(reader):
+        # type: (asyncio.StreamReader) -> tuple[str, str, dict[str, str]]
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            raise ValueError("Malformed request line")
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+        return request_line[0], request_line[1], headers
+
+    @staticmethod
+    async def _write_head(writer, status, headers):
+        # type: (asyncio.StreamWriter, int, dict) -> None
+        import http
+
+        lines = ["HTTP/1.1 {} {}".format(status, http.HTTPStatus(status).phrase)]
+        lines += ["{}: {}".format(k, v) for k, v in headers.items()]
+        lines.append("Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+    @classmethod
+    async def _respond_json(cls, writer, status, body):
+        # type: (asyncio.StreamWriter, int, dict) -> None
+        data = json.dumps(body, indent=2, sort_keys=True).encode("utf-8")
+        await cls._write_head(
+            writer,
+            status,
+            {"Content-Type": "application/json", "Content-Length": len(data)},
+        )
+        writer.write(data)
+        await writer.drain()
+
+
+def cli_parser():
+    # type: () -> argparse.ArgumentParser
+
+    parser = argparse.ArgumentParser(
+        prog="python applitoolsify.py",
+        description="Applitoolsify (v{}) with Applitools iOS".format(
+            __version__
+        ),
         add_help=False,
     )
     # options
@@ -465,16 +4247,157 @@ def cli_parser():
         action="store_true",
         help="Use local SDK instead of fetching latest",
     )
-    
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=None,
+        help="Directory of the persistent SDK cache (default: `{}`)".format(
+            default_cache_dir()
+        ),
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Download SDK to a temporary directory and remove it afterwards",
+    )
+    parser.add_argument(
+        "--no-result-cache",
+        action="store_true",
+        help="Instrument `.ipa` even if the same input was instrumented "
+        "with the same SDK and options before",
+    )
+    parser.add_argument(
+        "--sdk-sha256",
+        type=str,
+        default=None,
+        metavar="HEX",
+        help="Expected SHA-256 of the SDK archive, instrumentation fails on mismatch "
+        "(default: digest published by the server, if any)",
+    )
+    parser.add_argument(
+        "--sdk-url",
+        type=str,
+        default=None,
+        metavar="URL",
+        help="Download the SDK archive from URL instead of the released one",
+    )
+    parser.add_argument(
+        "--verify-crc",
+        action="store_true",
+        help="Check CRC of zip members copied without recompression",
+    )
+    parser.add_argument(
+        "--no-splice",
+        action="store_true",
+        help="Extract and recompress the whole `.ipa` even when signing is not required",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of parallel compression and signing workers (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--install-mode",
+        choices=FileInstaller.MODES,
+        default="auto",
+        help="How SDK files are put into `.app`: `auto` clones them when the "
+        "filesystem supports it, `hardlink` shares them with the SDK cache",
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        choices=range(10),
+        default=None,
+        metavar="{0-9}",
+        help="Deflate level of repackaged files, 0 stores them uncompressed "
+        "(default: zlib default). Already compressed files are stored and "
+        "untouched files keep their original compression",
+    )
+    parser.add_argument(
+        "--scratch-dir",
+        type=Path,
+        default=None,
+        help="Dir for files extracted from `.ipa`, used when they fit in it "
+        "(default: `/dev/shm`, then the system temp dir)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print time spent in every phase and write a Chrome trace of them",
+    )
+    parser.add_argument(
+        "--trace-file",
+        type=Path,
+        default=None,
+        help="Where `--profile` writes the trace in Chrome trace event format "
+        "(default: `{}`), implies `--profile`".format(TRACE_FILE_NAME),
+    )
 
     # main params
     parser.add_argument(
         "path_to_app",
         type=str,
-        help="Path to the `.app` or `.ipa` for applitoolsify",
+        nargs="?",
+        help="Path to the `.app`, `.ipa` or `.apk` (with `--sdk-url`) for applitoolsify",
+    )
+
+    # batch mode
+    parser.add_argument(
+        "--batch",
+        nargs="+",
+        default=[],
+        metavar="PATH_TO_APP",
+        help="Instrument several `.app`, `.ipa` or `.apk` with one shared SDK",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help="File with paths of apps to instrument in batch, one per line",
+    )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=None,
+        help="Number of apps instrumented at once in batch (default: number of CPUs)",
+    )
+
+    # service mode
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run HTTP service instrumenting apps on request with SDK kept ready",
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Address the service listens on (default: 127.0.0.1). On other than "
+        "loopback addresses only uploaded `.ipa` are instrumented, never local paths",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=SERVICE_PORT,
+        help="Port the service listens on (default: {})".format(SERVICE_PORT),
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help="Number of apps the service instruments at once (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        default=SERVICE_MAX_QUEUE,
+        help="Number of requests waiting for a free slot before new ones are rejected "
+        "(default: {})".format(SERVICE_MAX_QUEUE),
     )
 
-    # optional signing
+    # optional signing, `--codesign` path of `codesign` executable goes along
     # parser.add_argument(
     #     "signing_certificate_name",
     #     nargs="?",
@@ -490,22 +4413,114 @@ def cli_parser():
 
 def run():
     args, _ = cli_parser().parse_known_args()
-    if not validate_path_to_app(args.path_to_app):
+    paths = [args.path_to_app] if args.path_to_app else []
+    paths += args.batch
+    if args.manifest:
+        paths += read_manifest(args.manifest)
+    batch = bool(args.batch or args.manifest)
+    if not paths and not args.serve:
+        print("! Path to the `.app`, `.ipa` or `.apk` is required")
+        sys.exit(1)
+    if not batch and not args.serve and not validate_path_to_app(args.path_to_app):
+        sys.exit(1)
+    sdks = {APP_SDKS[Path(path).suffix] for path in paths if Path(path).suffix in APP_SDKS}
+    if len(sdks) > 1:
+        print("! iOS and Android apps can't be instrumented together")
+        sys.exit(1)
+    sdk = sdks.pop() if sdks else SdkParams.ios_nmg
+    if SUPPORTED_FRAMEWORKS[sdk].download_url is None and not args.sdk_url:
+        print("! `--sdk-url` is required, SDK for `{}` apps is not released".format(sdk.value))
         sys.exit(1)
 
     if args.verbose:
         global VERBOSE
         VERBOSE = True
+    if args.verify_crc:
+        global VERIFY_CRC
+        VERIFY_CRC = True
+    if args.profile or args.trace_file:
+        global PROFILER
+        PROFILER = Profiler()
+        try:
+            _run(args, paths, batch, sdk)
+        finally:
+            trace_file = args.trace_file or Path(TRACE_FILE_NAME)
+            PROFILER.write_trace(trace_file)
+            print(PROFILER.summary())
+            print("Trace written to `{}`".format(trace_file))
+        return
+    _run(args, paths, batch, sdk)
+
 
+def _run(args, paths, batch, sdk=SdkParams.ios_nmg):
+    # type: (argparse.Namespace, list[str], bool, SdkParams) -> None
     print("Instrumentation start")
     print("Getting assets...")
-    with SdkDownloadManager.from_sdk_name("ios_nmg", args.local) as sdk_data:
+    cache = result_cache = None
+    if not args.no_cache:
+        cache = SdkCache(args.cache_dir or default_cache_dir())
+        if not args.no_result_cache:
+            result_cache = ResultCache(cache.root.joinpath("results"))
+    with SdkDownloadManager.from_sdk_name(
+        sdk.value, args.local, cache, args.sdk_sha256, args.sdk_url
+    ) as sdk_data:
+        if args.serve:
+            import asyncio
+
+            service = InstrumentationService(
+                sdk_data,
+                args.local,
+                host=args.host,
+                port=args.port,
+                concurrency=args.concurrency,
+                max_queue=args.max_queue,
+                splice=not args.no_splice,
+                workers=args.jobs,
+                codesign=getattr(args, "codesign", None),
+                install_mode=args.install_mode,
+                compression_level=args.compression_level,
+                result_cache=result_cache,
+                scratch_dir=args.scratch_dir,
+                token_file=Path(args.cache_dir or default_cache_dir()).joinpath(
+                    SERVICE_TOKEN_FILE_NAME
+                ),
+            )
+            try:
+                asyncio.run(service.serve_forever())
+            except KeyboardInterrupt:
+                print("Service stopped")
+            return
+        if batch:
+            results = BatchInstrumenter(
+                paths,
+                sdk_data,
+                args.local,
+                getattr(args, "signing_certificate_name", None),
+                getattr(args, "provisioning_profile", None),
+                splice=not args.no_splice,
+                workers=args.jobs,
+                parallel=args.parallel,
+                codesign=getattr(args, "codesign", None),
+                install_mode=args.install_mode,
+                compression_level=args.compression_level,
+                result_cache=result_cache,
+                scratch_dir=args.scratch_dir,
+            ).run()
+            print_batch_summary(results)
+            sys.exit(0 if all(result.ok for result in results) else 1)
         instrumenter = Instrumenter(
             args.path_to_app,
             sdk_data,
             args.local,
             getattr(args, "signing_certificate_name", None),
             getattr(args, "provisioning_profile", None),
+            splice=not args.no_splice,
+            workers=args.jobs,
+            codesign=getattr(args, "codesign", None),
+            install_mode=args.install_mode,
+            compression_level=args.compression_level,
+            result_cache=result_cache,
+            scratch_dir=args.scratch_dir,
         )
         instrumenter.instrumentify()
 
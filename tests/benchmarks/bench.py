@@ -0,0 +1,278 @@
+"""Benchmarks of instrumentation phases on synthetic inputs.
+
+Every phase runs in a fresh process, so peak RSS is measured for that phase
+alone. Results are compared with `budgets.json` to catch regressions::
+
+    python -m tests.benchmarks.bench --preset small --check
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+from src.instrument import (
+    Archiver,
+    FileInstaller,
+    IOSIpaSpliceInstrumentifyStrategy,
+    SdkData,
+    SegmentedDownloader,
+    SigningPlan,
+    read_entitlements,
+)
+from tests.benchmarks.generators import MB, make_synthetic_ipa
+from tests.conftest import get_resource_path
+from tests.utils import make_sdk_zip, serve_directory
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SDK_NAME = "Applitools_iOS.xcframework"
+BUDGETS_PATH = Path(__file__).absolute().parent / "budgets.json"
+PRESETS = {
+    "tiny": {"files": 200, "size": 16 * MB, "sdk_size": 24 * MB},
+    "small": {"files": 300, "size": 24 * MB, "sdk_size": 32 * MB},
+    "medium": {"files": 3000, "size": 512 * MB, "sdk_size": 128 * MB},
+    "large": {"files": 20000, "size": 2048 * MB, "sdk_size": 256 * MB},
+}
+# fixed worker count keeps memory of parallel phases comparable between machines
+WORKERS = 4
+CODESIGN_STUB = "#!{python}\nimport sys\nopen(sys.argv[-1] + '.signed', 'w').close()\n"
+
+
+def peak_rss():
+    # type: () -> int | None
+    """Peak resident set size of the current process in bytes."""
+    try:
+        # unlike `ru_maxrss`, not inherited from the parent through fork and exec
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def phase_download(workspace):
+    with serve_directory(workspace.joinpath("server")) as server:
+        downloader = SegmentedDownloader("{}/{}.zip".format(server.url, SDK_NAME))
+        downloader.download(workspace.joinpath("downloaded.zip"))
+    return {"bytes": downloader.size}
+
+
+def phase_extract(workspace):
+    with zipfile.ZipFile(workspace.joinpath("input.ipa")) as zfile:
+        for member in zfile.infolist():
+            path = zfile.extract(member, workspace.joinpath("extracted"))
+            Archiver.restore_permissions(member, path)
+        return {
+            "bytes": sum(info.file_size for info in zfile.infolist()),
+            "files": len(zfile.infolist()),
+        }
+
+
+def phase_copy(workspace):
+    installer = FileInstaller()
+    shutil.copytree(
+        workspace.joinpath("sdk", SDK_NAME),
+        workspace.joinpath("prepared", "Payload", "Synthetic.app", "Frameworks", SDK_NAME),
+        copy_function=installer.copy_file,
+    )
+    return {
+        "bytes": sum(size for _, size in installer.stats.values()),
+        "files": sum(files for files, _ in installer.stats.values()),
+    }
+
+
+def phase_entitlements(workspace):
+    profile = workspace.joinpath("embedded.mobileprovision")
+    read_entitlements(profile)
+    return {"bytes": os.path.getsize(profile)}
+
+
+def phase_sign(workspace):
+    stub = workspace.joinpath("codesign")
+    plan = SigningPlan.from_dir(workspace.joinpath("prepared"))
+    plan.run([str(stub)], WORKERS)
+    return {"files": len(plan), "levels": len(plan.levels)}
+
+
+def phase_repackage(workspace):
+    Archiver.zip_dir(
+        workspace.joinpath("prepared"), workspace.joinpath("output.ipa"), WORKERS
+    )
+    return {"bytes": os.path.getsize(workspace.joinpath("output.ipa"))}
+
+
+def phase_splice(workspace):
+    sdk_data = SdkData(SDK_NAME, "", "")
+    sdk_data.add_sdk_location(workspace.joinpath("sdk", SDK_NAME))
+    sdk_data.version = "bench"
+    ipa = workspace.joinpath("splice.ipa")
+    strategy = IOSIpaSpliceInstrumentifyStrategy(
+        ipa, sdk_data, False, None, None, workers=WORKERS
+    )
+    if not strategy.instrumentify():
+        raise RuntimeError("Splice failed")
+    return {"bytes": os.path.getsize(ipa)}
+
+
+PHASES = [
+    ("download", phase_download),
+    ("extract", phase_extract),
+    ("copy", phase_copy),
+    ("entitlements", phase_entitlements),
+    ("sign", phase_sign),
+    ("repackage", phase_repackage),
+    ("splice", phase_splice),
+]
+
+
+def _phase_worker(queue, name, workspace):
+    phase = dict(PHASES)[name]
+    rss_before = peak_rss()
+    start = time.perf_counter()
+    metrics = phase(Path(workspace))
+    metrics["seconds"] = time.perf_counter() - start
+    rss_after = peak_rss()
+    if rss_after is not None:
+        metrics["peak_rss_mb"] = rss_after / MB
+        metrics["rss_growth_mb"] = (rss_after - rss_before) / MB
+    queue.put(metrics)
+
+
+def run_phase(name, workspace):
+    # type: (str, Path) -> dict
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_phase_worker, args=(queue, name, str(workspace)))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError("Benchmark phase `{}` failed".format(name))
+    return queue.get()
+
+
+def prepare_workspace(workspace, files, size, sdk_size):
+    # type: (Path, int, int, int) -> None
+    """Generate inputs of all phases, not included in measurements."""
+    workspace.joinpath("server").mkdir(parents=True)
+    sdk_zip = make_sdk_zip(
+        workspace.joinpath("server", SDK_NAME + ".zip"), binary_size=sdk_size // 2
+    )
+    with zipfile.ZipFile(sdk_zip) as zfile:
+        zfile.extractall(workspace.joinpath("sdk"))
+    make_synthetic_ipa(workspace.joinpath("input.ipa"), files=files, size=size)
+    shutil.copy2(workspace.joinpath("input.ipa"), workspace.joinpath("splice.ipa"))
+    with zipfile.ZipFile(workspace.joinpath("input.ipa")) as zfile:
+        zfile.extractall(workspace.joinpath("prepared"))
+    with zipfile.ZipFile(get_resource_path("IOSTestApp.ipa")) as zfile:
+        workspace.joinpath("embedded.mobileprovision").write_bytes(
+            zfile.read("Payload/IOSTestApp.app/embedded.mobileprovision")
+        )
+    stub = workspace.joinpath("codesign")
+    stub.write_text(CODESIGN_STUB.format(python=sys.executable))
+    stub.chmod(0o755)
+
+
+def run_benchmarks(preset, workspace=None, phases=None):
+    # type: (str, Path | None, list[str] | None) -> dict[str, dict]
+    """Run benchmark `phases` (all by default) of `preset` and return their metrics."""
+    tmp_dir = None
+    if workspace is None:
+        workspace = tmp_dir = Path(tempfile.mkdtemp())
+    try:
+        prepare_workspace(Path(workspace), **PRESETS[preset])
+        results = {}
+        for name, _ in PHASES:
+            if phases and name not in phases:
+                continue
+            if name == "sign" and sys.platform == "win32":
+                continue  # codesign stub is a script
+            results[name] = run_phase(name, Path(workspace))
+        return results
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def check_budgets(results, budgets):
+    # type: (dict[str, dict], dict[str, dict]) -> list[str]
+    """Return descriptions of metrics over their budget."""
+    violations = []
+    for phase, limits in sorted(budgets.items()):
+        for metric, limit in sorted(limits.items()):
+            value = results.get(phase, {}).get(metric)
+            if value is not None and value > limit:
+                violations.append(
+                    "{} {} is {:.2f}, budget is {:.2f}".format(phase, metric, value, limit)
+                )
+    return violations
+
+
+def load_budgets(preset):
+    # type: (str) -> dict[str, dict]
+    with open(BUDGETS_PATH, "r") as f:
+        return json.load(f).get(preset, {})
+
+
+def format_mb(value):
+    # type: (float | None) -> str
+    return "-" if value is None else "{:.1f}".format(value)
+
+
+def format_results(results):
+    # type: (dict[str, dict]) -> str
+    lines = [
+        "{:<12} {:>9} {:>10} {:>11} {:>11} {:>8}".format(
+            "phase", "seconds", "MB", "peak RSS MB", "RSS growth", "files"
+        )
+    ]
+    for phase, metrics in results.items():
+        lines.append(
+            "{:<12} {:>9.2f} {:>10.1f} {:>11} {:>11} {:>8}".format(
+                phase,
+                metrics["seconds"],
+                metrics.get("bytes", 0) / MB,
+                format_mb(metrics.get("peak_rss_mb")),
+                format_mb(metrics.get("rss_growth_mb")),
+                metrics.get("files", "-"),
+            )
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m tests.benchmarks.bench")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--phase", action="append", choices=[n for n, _ in PHASES])
+    parser.add_argument("--workspace", type=Path, default=None)
+    parser.add_argument("--json", type=Path, default=None, help="Write results to file")
+    parser.add_argument("--check", action="store_true", help="Fail when over budget")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.preset, args.workspace, args.phase)
+    print(format_results(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.check:
+        violations = check_budgets(results, load_budgets(args.preset))
+        for violation in violations:
+            print("! Over budget: {}".format(violation))
+        sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Generators of synthetic `.app` and `.ipa` inputs for benchmarks."""
+import os
+import plistlib
+import random
+import shutil
+import struct
+import tempfile
+import zipfile
+from pathlib import Path
+
+MB = 1024 * 1024
+CHUNK_SIZE = MB
+# Mach-O 64-bit header of arm64 executable without load commands
+ARM64_HEADER = struct.pack("<IiiIIIII", 0xFEEDFACF, 0x0100000C, 0, 2, 0, 0, 0, 0)
+
+
+def write_file(path, size, compressible, rng, header=b""):
+    # type: (Path, int, bool, random.Random, bytes) -> None
+    """Write `size` bytes in chunks, either repeated text or random bytes."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(header[:size])
+        remaining = size - len(header[:size])
+        text = b"<key>synthetic</key><string>applitoolsify</string>\n"
+        while remaining:
+            n = min(remaining, CHUNK_SIZE)
+            if compressible:
+                chunk = (text * (n // len(text) + 1))[:n]
+            else:
+                chunk = rng.getrandbits(8 * n).to_bytes(n, "little")
+            f.write(chunk)
+            remaining -= n
+
+
+def make_bundle(path, name, executable_size, rng, extension="framework"):
+    # type: (Path, str, int, random.Random, str) -> Path
+    bundle = path.joinpath("{}.{}".format(name, extension))
+    bundle.mkdir(parents=True, exist_ok=True)
+    with open(bundle.joinpath("Info.plist"), "wb") as f:
+        plistlib.dump(
+            {
+                "CFBundleExecutable": name,
+                "CFBundleIdentifier": "com.applitools.synthetic.{}".format(name),
+                "CFBundleSupportedPlatforms": ["iPhoneOS"],
+                "DTPlatformName": "iphoneos",
+                "MinimumOSVersion": "13.0",
+            },
+            f,
+        )
+    write_file(bundle.joinpath(name), executable_size, False, rng, ARM64_HEADER)
+    return bundle
+
+
+def make_synthetic_app(path, files=300, size=20 * MB, frameworks=2, seed=0):
+    # type: (Path | str, int, int, int, int) -> Path
+    """Generate `.app` bundle at `path` with about `files` files of `size` bytes total.
+
+    Every framework nests one more framework and the app has one extension, so
+    signing has several levels. Half of the asset files are incompressible like
+    PNG or media, the other half is plist-like text.
+    """
+    rng = random.Random(seed)
+    path = Path(path)
+    executable_size = max(size // 10, 1024)
+    app = make_bundle(path.parent, path.stem, executable_size, rng, "app")
+    if app != path:
+        os.replace(app, path)
+    created = 2
+    bundle_size = max(size // 50, 1024)
+    for i in range(frameworks):
+        framework = make_bundle(
+            path.joinpath("Frameworks"), "Dep{}".format(i), bundle_size, rng
+        )
+        make_bundle(framework.joinpath("Frameworks"), "Inner{}".format(i), bundle_size, rng)
+        created += 4
+    extension = make_bundle(path.joinpath("PlugIns"), "Widget", bundle_size, rng, "appex")
+    write_file(
+        extension.parent.joinpath("Widget.appex", "Frameworks", "libWidget.dylib"),
+        bundle_size,
+        False,
+        rng,
+        ARM64_HEADER,
+    )
+    created += 3
+
+    assets = max(files - created, 1)
+    asset_size = max((size - executable_size - bundle_size * (2 * frameworks + 2)) // assets, 1)
+    for i in range(assets):
+        compressible = i % 2 == 0
+        write_file(
+            path.joinpath(
+                "Assets",
+                "group{}".format(i % 16),
+                "asset{}.{}".format(i, "json" if compressible else "png"),
+            ),
+            asset_size,
+            compressible,
+            rng,
+        )
+    return path
+
+
+def make_synthetic_ipa(path, **kwargs):
+    # type: (Path | str, ...) -> Path
+    """Generate `.ipa` with `make_synthetic_app` payload, see it for arguments."""
+    path = Path(path)
+    tmp_dir = Path(tempfile.mkdtemp(dir=str(path.parent)))
+    try:
+        app = make_synthetic_app(tmp_dir.joinpath("Payload", "Synthetic.app"), **kwargs)
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zfile:
+            for root, dirs, files in os.walk(app):
+                dirs.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    zfile.write(file_path, os.path.relpath(file_path, str(tmp_dir)))
+    finally:
+        shutil.rmtree(tmp_dir)
+    return path
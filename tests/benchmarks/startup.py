@@ -0,0 +1,141 @@
+"""Startup time of the tool, measured with `python -X importtime`.
+
+Modules needed by instrumentation only have to stay lazily imported, so
+`--version` is fast::
+
+    python -m tests.benchmarks.startup --check
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from tests.benchmarks.bench import check_budgets, load_budgets
+
+ROOT = Path(__file__).absolute().parent.parent.parent
+MODULE = "src.instrument"
+# must not be imported before a phase needs them
+LAZY_MODULES = [
+    "asyncio",
+    "concurrent.futures",
+    "ctypes",
+    "http.client",
+    "ipaddress",
+    "mmap",
+    "plistlib",
+    "ssl",
+    "subprocess",
+    "tempfile",
+    "traceback",
+    "urllib.request",
+    "zipfile",
+]
+# imported by modules the tool can't do without, `pathlib` imports
+# `ipaddress` through `urllib.parse` on some Python versions
+EAGER_MODULES = ["argparse", "json", "pathlib", "shutil", "threading", "urllib.parse"]
+LOADED_MODULES_SCRIPT = """
+import sys
+sys.argv = ["applitoolsify.py"] + sys.argv[1:]
+from src.instrument import run
+try:
+    run()
+except SystemExit:
+    pass
+print(" ".join(sorted(sys.modules)))
+"""
+
+
+def _python(args, **kwargs):
+    # type: (list[str], ...) -> subprocess.CompletedProcess
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)  # measure with cached bytecode
+    return subprocess.run(
+        [sys.executable] + args,
+        cwd=str(ROOT),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+        **kwargs
+    )
+
+
+def import_time(module=MODULE, runs=5):
+    # type: (str, int) -> float
+    """Best cumulative import time of `module` in milliseconds."""
+    _python(["-c", "import " + module])  # write bytecode
+    times = []
+    for _ in range(runs):
+        output = _python(["-X", "importtime", "-c", "import " + module])
+        for line in output.stderr.splitlines():
+            columns = [c.strip() for c in line.split("|")]
+            if len(columns) == 3 and columns[2] == module:
+                times.append(int(columns[1]) / 1000.0)
+    return min(times)
+
+
+def wall_time(args, runs=5):
+    # type: (list[str], int) -> float
+    """Best wall time of running python with `args` in milliseconds."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        _python(args)
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times)
+
+
+def loaded_lazy_modules(cli_args=("--version",)):
+    # type: (tuple[str, ...]) -> list[str]
+    """`LAZY_MODULES` imported by a run of the CLI with `cli_args`.
+
+    Modules imported by `EAGER_MODULES` themselves are not counted.
+    """
+    eager = _python(
+        ["-c", "import sys, {}; print(' '.join(sys.modules))".format(", ".join(EAGER_MODULES))]
+    )
+    unavoidable = set(eager.stdout.split())
+    output = _python(["-c", LOADED_MODULES_SCRIPT] + list(cli_args))
+    loaded = output.stdout.splitlines()[-1].split()
+    return [name for name in LAZY_MODULES if name in loaded and name not in unavoidable]
+
+
+def run_startup_benchmarks(runs=5):
+    # type: (int) -> dict[str, dict]
+    interpreter = wall_time(["-c", "pass"], runs)
+    return {
+        "import": {"milliseconds": import_time(runs=runs)},
+        "version": {
+            "overhead_milliseconds": wall_time(["applitoolsify.py", "--version"], runs)
+            - interpreter
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m tests.benchmarks.startup")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--check", action="store_true", help="Fail when over budget")
+    args = parser.parse_args()
+
+    results = run_startup_benchmarks(args.runs)
+    print("import of `{}`: {:.1f} ms".format(MODULE, results["import"]["milliseconds"]))
+    print(
+        "`--version` over bare interpreter: {:.1f} ms".format(
+            results["version"]["overhead_milliseconds"]
+        )
+    )
+    violations = check_budgets(results, load_budgets("startup"))
+    loaded = loaded_lazy_modules()
+    if loaded:
+        violations.append("`--version` imports {}".format(", ".join(loaded)))
+    for violation in violations:
+        print("! Over budget: {}".format(violation))
+    if args.check:
+        sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
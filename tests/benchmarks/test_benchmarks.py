@@ -0,0 +1,26 @@
+import zipfile
+
+from tests.benchmarks.bench import check_budgets, load_budgets, run_benchmarks
+from tests.benchmarks.generators import MB, make_synthetic_app, make_synthetic_ipa
+
+
+def test_synthetic_app_has_requested_shape(tmp_path):
+    app = make_synthetic_app(tmp_path / "Synthetic.app", files=120, size=4 * MB)
+    files = [p for p in app.rglob("*") if p.is_file()]
+    assert len(files) == 120
+    assert abs(sum(p.stat().st_size for p in files) - 4 * MB) < 0.05 * 4 * MB
+    assert app.joinpath("Frameworks", "Dep1.framework", "Frameworks", "Inner1.framework").is_dir()
+    assert app.joinpath("PlugIns", "Widget.appex", "Frameworks", "libWidget.dylib").is_file()
+
+
+def test_synthetic_ipa_has_payload(tmp_path):
+    ipa = make_synthetic_ipa(tmp_path / "Synthetic.ipa", files=50, size=MB)
+    with zipfile.ZipFile(ipa) as zfile:
+        assert len(zfile.namelist()) == 50
+        assert all(n.startswith("Payload/Synthetic.app/") for n in zfile.namelist())
+
+
+def test_tiny_preset_within_budgets(tmp_path):
+    results = run_benchmarks("tiny", tmp_path)
+    assert {"download", "extract", "copy", "repackage", "splice"} <= set(results)
+    assert check_budgets(results, load_budgets("tiny")) == []
@@ -0,0 +1,11 @@
+from tests.benchmarks.bench import check_budgets, load_budgets
+from tests.benchmarks.startup import loaded_lazy_modules, run_startup_benchmarks
+
+
+def test_version_skips_lazy_modules():
+    assert loaded_lazy_modules(["--version"]) == []
+
+
+def test_startup_within_budget():
+    results = run_startup_benchmarks(runs=3)
+    assert check_budgets(results, load_budgets("startup")) == []
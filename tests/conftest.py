@@ -6,6 +6,8 @@ from pathlib import Path
 
 import pytest
 
+from tests.utils import make_sdk_zip, serve_directory
+
 here = Path(__file__).absolute().parent
 
 
@@ -66,6 +68,33 @@ def path_to_ipa_relative_to_applitoolsify() -> str:
         os.remove(dst)
 
 
+@pytest.fixture()
+def sdk_zip(tmp_path) -> Path:
+    return make_sdk_zip(tmp_path / "Applitools_iOS.xcframework.zip")
+
+
+@pytest.fixture()
+def sdk_data(sdk_zip):
+    from src.instrument import SdkData
+
+    uri = sdk_zip.absolute().as_uri()
+    return SdkData(name="Applitools_iOS.xcframework", download_url=uri, local_url=uri)
+
+
+@pytest.fixture()
+def sdk(tmp_path, sdk_data):
+    from src.instrument import SdkCache, SdkDownloadManager
+
+    with SdkDownloadManager(sdk_data, False, SdkCache(tmp_path / "cache")) as sdk:
+        yield sdk
+
+
+@pytest.fixture()
+def sdk_server(sdk_zip):
+    with serve_directory(sdk_zip.parent) as server:
+        yield server
+
+
 @pytest.fixture
 def sauce_driver_url() -> str:
     return "https://{}:{}@ondemand.saucelabs.com:443/wd/hub".format(
@@ -0,0 +1,112 @@
+import shutil
+import zipfile
+
+import pytest
+
+from src.instrument import (
+    SUPPORTED_FRAMEWORKS,
+    AndroidApkInstrumentifyStrategy,
+    Instrumenter,
+    SdkBundle,
+    SdkCache,
+    SdkData,
+    SdkDownloadManager,
+    SdkParams,
+    instrument,
+)
+from tests.conftest import get_resource_path
+from tests.utils import make_android_sdk_zip
+
+SDK_NAME = "Applitools_Android"
+
+
+@pytest.fixture()
+def path_to_apk(tmp_path):
+    path = tmp_path / "hello.apk"
+    shutil.copy2(get_resource_path("eyes-android-hello-world.apk"), path)
+    return path
+
+
+@pytest.fixture()
+def android_sdk(tmp_path):
+    uri = make_android_sdk_zip(tmp_path / (SDK_NAME + ".zip")).absolute().as_uri()
+    sdk_data = SdkData(SDK_NAME, uri, uri)
+    with SdkDownloadManager(sdk_data, False, SdkCache(tmp_path / "cache")) as sdk:
+        yield sdk
+
+
+def data_offset(zfile, member):
+    zfile.fp.seek(member.header_offset + 26)
+    name_length, extra_length = (
+        int.from_bytes(zfile.fp.read(2), "little"),
+        int.from_bytes(zfile.fp.read(2), "little"),
+    )
+    return member.header_offset + 30 + name_length + extra_length
+
+
+def test_apk_is_patched_and_aligned_in_one_pass(path_to_apk, android_sdk):
+    with zipfile.ZipFile(path_to_apk) as zfile:
+        original = {m.filename: m.CRC for m in zfile.infolist()}
+
+    instrumenter = Instrumenter(path_to_apk, android_sdk, False)
+    assert isinstance(instrumenter._instrumenter, AndroidApkInstrumentifyStrategy)
+    assert instrumenter.instrumentify()
+
+    with zipfile.ZipFile(path_to_apk) as zfile:
+        assert zfile.testzip() is None
+        names = zfile.namelist()
+        assert "lib/arm64-v8a/libapplitools.so" in names
+        assert "assets/applitools/config.json" in names
+        assert "assets/{}/applitoolsify_manifest.json".format(SDK_NAME) in names
+        # signatures are invalid after patching
+        assert not any(n.startswith("META-INF/CERT") for n in names)
+        for name, crc in original.items():
+            if not name.startswith("META-INF/"):
+                assert zfile.getinfo(name).CRC == crc
+        for member in zfile.infolist():
+            if member.compress_type == zipfile.ZIP_STORED:
+                alignment = 4096 if member.filename.endswith(".so") else 4
+                assert data_offset(zfile, member) % alignment == 0, member.filename
+                # padding is kept out of the central directory
+                assert len(member.extra) < 6
+
+
+def test_apk_reinstrumentation_replaces_sdk(path_to_apk, android_sdk):
+    assert Instrumenter(path_to_apk, android_sdk, False).instrumentify()
+    size = path_to_apk.stat().st_size
+
+    instrumenter = Instrumenter(path_to_apk, android_sdk, False)
+    assert instrumenter.was_already_instrumented()
+    assert instrumenter.instrumentify() and instrumenter.up_to_date
+
+    android_sdk.sdk_location.joinpath("lib", "x86_64", "libapplitools.so").unlink()
+    android_sdk.files = None
+    android_sdk.archive = None  # written from the extracted SDK
+    assert Instrumenter(path_to_apk, android_sdk, False).instrumentify()
+    with zipfile.ZipFile(path_to_apk) as zfile:
+        names = zfile.namelist()
+        assert "lib/x86_64/libapplitools.so" not in names
+        assert names.count("lib/arm64-v8a/libapplitools.so") == 1
+    assert path_to_apk.stat().st_size < size
+
+
+def test_apk_files_colliding_with_sdk_are_not_replaced(path_to_apk, android_sdk):
+    with zipfile.ZipFile(path_to_apk, "a") as zfile:
+        zfile.writestr("lib/arm64-v8a/libapplitools.so", b"app library")
+    original = path_to_apk.read_bytes()
+
+    with pytest.raises(RuntimeError, match="lib/arm64-v8a/libapplitools.so"):
+        Instrumenter(path_to_apk, android_sdk, False).instrumentify()
+    assert path_to_apk.read_bytes() == original
+    assert not path_to_apk.with_name(path_to_apk.name + ".tmp").exists()
+
+
+def test_android_sdk_is_downloaded_from_given_url_only(tmp_path, path_to_apk):
+    uri = make_android_sdk_zip(tmp_path / (SDK_NAME + ".zip")).absolute().as_uri()
+    unreleased = SdkBundle.from_sdk_name("android_nmg", cache_dir=tmp_path / "cache")
+    result = instrument(path_to_apk, unreleased)
+    assert not result.ok and "--sdk-url" in result.error
+
+    bundle = SdkBundle.from_sdk_name("android_nmg", cache_dir=tmp_path / "cache", sdk_url=uri)
+    assert instrument(path_to_apk, bundle).ok
+    assert SUPPORTED_FRAMEWORKS[SdkParams.android_nmg].download_url is None
@@ -0,0 +1,67 @@
+import shutil
+import threading
+import zipfile
+
+from src.instrument import InstrumentOptions, SdkBundle, SdkCache, instrument
+from tests.conftest import get_resource_path
+
+
+def test_instrument_reuses_bundle_and_prints_nothing(
+    tmp_path, path_to_ipa, path_to_app, sdk_data, capsys
+):
+    bundle = SdkBundle(sdk_data, cache=SdkCache(tmp_path / "cache"))
+    with bundle:
+        output = tmp_path / "out.ipa"
+        first = instrument(path_to_ipa, bundle, InstrumentOptions(output_path=output))
+        second = instrument(path_to_app, bundle)
+        again = instrument(output, bundle)
+        location = bundle.sdk_data.sdk_location
+
+    assert first.ok and second.ok and again.ok, (first.error, second.error)
+    assert first.output_path == output and first.input_size == path_to_ipa.stat().st_size
+    assert first.output_size == output.stat().st_size > first.input_size
+    assert "instrument" in first.timings and first.timings["total"] > 0
+    assert again.up_to_date and not first.up_to_date
+    assert "download" in bundle.timings
+    with zipfile.ZipFile(path_to_ipa) as zfile:
+        # original is left untouched
+        assert not any("Applitools_iOS.xcframework" in n for n in zfile.namelist())
+    assert location.is_dir()  # kept in the cache
+    assert capsys.readouterr().out == ""
+
+
+def test_instrument_reports_failures_in_result(tmp_path, sdk_data, capsys):
+    bundle = SdkBundle(sdk_data, cache=SdkCache(tmp_path / "cache"))
+    missing = instrument(tmp_path / "missing.ipa", bundle)
+    unsupported = instrument(tmp_path / "app.aab", bundle)
+
+    assert not missing.ok and "does not exist" in missing.error
+    assert not unsupported.ok and "Supported only" in unsupported.error
+    assert capsys.readouterr().out == ""
+
+
+def test_instrument_rejects_sdk_of_other_platform(tmp_path, sdk_data, capsys):
+    apk = tmp_path / "app.apk"
+    shutil.copy2(get_resource_path("eyes-android-hello-world.apk"), apk)
+    original = apk.read_bytes()
+    result = instrument(apk, SdkBundle(sdk_data, cache=SdkCache(tmp_path / "cache")))
+
+    assert not result.ok and "`Applitools_Android` is required" in result.error
+    assert apk.read_bytes() == original
+    assert capsys.readouterr().out == ""
+
+
+def test_bundle_loads_once_from_several_threads(tmp_path, sdk_data, monkeypatch):
+    bundle = SdkBundle(sdk_data, cache=SdkCache(tmp_path / "cache"))
+    loads = []
+    download = bundle._manager.download_and_extract
+    monkeypatch.setattr(
+        bundle._manager, "download_and_extract", lambda: loads.append(1) or download()
+    )
+    threads = [threading.Thread(target=bundle.load) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert loads == [1] and bundle.version == "1.2.3.45"
+    bundle.close()
@@ -0,0 +1,285 @@
+import os
+import shutil
+import zipfile
+from pathlib import PurePosixPath
+
+import pytest
+
+from src.instrument import (
+    Archiver,
+    CompressionPolicy,
+    Instrumenter,
+    IOSIpaInstrumentifyStrategy,
+    IOSIpaSpliceInstrumentifyStrategy,
+    ZIP_DATE_TIME,
+    ZipIndex,
+)
+
+SDK_PREFIX = "Payload/IOSTestApp.app/Frameworks/Applitools_iOS.xcframework/"
+
+
+def read_raw(zfile, member):
+    zfile.fp.seek(member.header_offset + 26)
+    name_length, extra_length = (
+        int.from_bytes(zfile.fp.read(2), "little"),
+        int.from_bytes(zfile.fp.read(2), "little"),
+    )
+    zfile.fp.seek(name_length + extra_length, 1)
+    return zfile.fp.read(member.compress_size)
+
+
+def test_copy_raw_member_keeps_compressed_bytes(tmp_path, path_to_ipa):
+    target_path = tmp_path / "copy.zip"
+    with zipfile.ZipFile(path_to_ipa) as source:
+        with zipfile.ZipFile(target_path, "w") as target:
+            for member in source.infolist():
+                Archiver.copy_raw_member(source, target, member)
+            target.writestr("extra.txt", b"extra")
+
+        with zipfile.ZipFile(target_path) as copied:
+            assert copied.testzip() is None
+            assert copied.namelist() == source.namelist() + ["extra.txt"]
+            for member in source.infolist():
+                copied_member = copied.getinfo(member.filename)
+                assert copied_member.CRC == member.CRC
+                assert read_raw(copied, copied_member) == read_raw(source, member)
+
+
+def test_copy_raw_member_verifies_crc(tmp_path):
+    source_path = tmp_path / "source.zip"
+    with zipfile.ZipFile(source_path, "w") as zfile:
+        zfile.writestr("stored.txt", b"stored" * 100)
+        zfile.writestr("deflated.txt", b"deflated" * 100, zipfile.ZIP_DEFLATED)
+    with zipfile.ZipFile(source_path) as source:
+        with zipfile.ZipFile(tmp_path / "copy.zip", "w") as target:
+            for member in source.infolist():
+                Archiver.copy_raw_member(source, target, member, verify=True)
+            for member in source.infolist():
+                member.CRC ^= 1  # as if the data was corrupted
+                with pytest.raises(zipfile.BadZipFile):
+                    Archiver.copy_raw_member(
+                        source, target, member, arcname="bad/" + member.filename, verify=True
+                    )
+
+
+def test_splice_ipa_adds_only_sdk_entries(path_to_ipa, sdk):
+    with zipfile.ZipFile(path_to_ipa) as zfile:
+        original = {m.filename: m.CRC for m in zfile.infolist()}
+
+    instrumenter = Instrumenter(path_to_ipa, sdk, False)
+    assert isinstance(instrumenter._instrumenter, IOSIpaSpliceInstrumentifyStrategy)
+    assert instrumenter._instrumenter.local is False
+    assert instrumenter.instrumentify()
+
+    with zipfile.ZipFile(path_to_ipa) as zfile:
+        assert zfile.testzip() is None
+        patched = {m.filename: m.CRC for m in zfile.infolist()}
+    added = set(patched) - set(original)
+    assert {k: patched[k] for k in original} == original
+    assert added and all(name.startswith(SDK_PREFIX) for name in added)
+    assert SDK_PREFIX + "ios-arm64/Applitools_iOS.framework/Info.plist" in added
+
+    # instrumenting again replaces SDK instead of duplicating it
+    instrumenter = Instrumenter(path_to_ipa, sdk, False)
+    assert instrumenter.was_already_instrumented()
+    assert instrumenter.instrumentify()
+    with zipfile.ZipFile(path_to_ipa) as zfile:
+        assert sorted(zfile.namelist()) == sorted(patched)
+
+
+def test_splice_copies_sdk_members_from_sdk_archive(path_to_ipa, sdk, sdk_zip):
+    assert sdk.archive is not None
+    assert Instrumenter(path_to_ipa, sdk, False).instrumentify()
+
+    with zipfile.ZipFile(sdk_zip) as source, zipfile.ZipFile(path_to_ipa) as zfile:
+        assert zfile.testzip() is None
+        for member in source.infolist():
+            name = SDK_PREFIX + member.filename.split("/", 1)[1]
+            if member.is_dir():
+                continue
+            if "-simulator/" in name:
+                # device ipa gets only the device slice
+                assert name not in zfile.namelist()
+                continue
+            copied = zfile.getinfo(name)
+            assert copied.CRC == member.CRC
+            assert read_raw(zfile, copied) == read_raw(source, member)
+            assert copied.external_attr >> 16 == 0o100755
+            assert copied.date_time == ZIP_DATE_TIME
+        assert SDK_PREFIX + "applitoolsify_manifest.json" in zfile.namelist()
+
+
+def test_splice_writes_same_sdk_metadata_with_and_without_sdk_archive(
+    tmp_path, path_to_ipa, sdk
+):
+    compressed_ipa = tmp_path / "compressed.ipa"
+    shutil.copy2(path_to_ipa, compressed_ipa)
+    assert Instrumenter(path_to_ipa, sdk, False).instrumentify()
+    sdk.archive = None  # written from the extracted SDK
+    assert Instrumenter(compressed_ipa, sdk, False).instrumentify()
+
+    def sdk_metadata(path):
+        with zipfile.ZipFile(path) as zfile:
+            return {
+                m.filename: (m.external_attr, m.date_time, m.create_system)
+                for m in zfile.infolist()
+                if m.filename.startswith(SDK_PREFIX)
+            }
+
+    assert sdk_metadata(path_to_ipa) == sdk_metadata(compressed_ipa)
+
+
+def test_ipa_strategy_extracts_app_and_recompresses_only_changed_files(
+    tmp_path, path_to_ipa, sdk
+):
+    with zipfile.ZipFile(path_to_ipa, "a") as zfile:
+        zfile.writestr("SwiftSupport/iphoneos/libswiftCore.dylib", b"swift" * 1000)
+    with zipfile.ZipFile(path_to_ipa) as zfile:
+        original = {m.filename: read_raw(zfile, m) for m in zfile.infolist()}
+
+    strategy = IOSIpaInstrumentifyStrategy(path_to_ipa, sdk, False, None, None)
+    extracted = strategy.extracted_dir_path
+    assert not extracted.joinpath("SwiftSupport").exists()
+    # what signing does to a binary
+    binary = extracted / "Payload" / "IOSTestApp.app" / "IOSTestApp"
+    signed = binary.read_bytes() + b"signature"
+    binary.unlink()
+    binary.write_bytes(signed)
+    assert strategy.instrumentify()
+
+    with zipfile.ZipFile(path_to_ipa) as zfile:
+        assert zfile.testzip() is None
+        assert zfile.read("Payload/IOSTestApp.app/IOSTestApp") == signed
+        assert zfile.read("SwiftSupport/iphoneos/libswiftCore.dylib") == b"swift" * 1000
+        changed = [
+            m.filename
+            for m in zfile.infolist()
+            if m.filename in original and read_raw(zfile, m) != original[m.filename]
+        ]
+        added = set(zfile.namelist()) - set(original)
+    assert changed == ["Payload/IOSTestApp.app/IOSTestApp"]
+    assert added and all(name.startswith(SDK_PREFIX) for name in added)
+
+
+def test_zip_dir_parallel_is_valid_and_deterministic(tmp_path):
+    src = tmp_path / "src"
+    for i in range(300):
+        member = src / "dir{}".format(i % 7) / "file{}.txt".format(i)
+        member.parent.mkdir(parents=True, exist_ok=True)
+        member.write_bytes(("line {}\n".format(i) * (i * 10)).encode())
+    (src / "big.bin").write_bytes(os.urandom(5 * 1024 * 1024))
+
+    Archiver.zip_dir(src, tmp_path / "serial.zip", workers=1)
+    Archiver.zip_dir(src, tmp_path / "parallel.zip", workers=8)
+
+    assert (tmp_path / "serial.zip").read_bytes() == (
+        tmp_path / "parallel.zip"
+    ).read_bytes()
+    with zipfile.ZipFile(tmp_path / "parallel.zip") as zfile:
+        assert zfile.testzip() is None
+        assert len(zfile.namelist()) == 301
+        assert zfile.read("dir3/file10.txt") == (src / "dir3" / "file10.txt").read_bytes()
+        assert zfile.read("big.bin") == (src / "big.bin").read_bytes()
+        assert zfile.getinfo("big.bin").file_size == 5 * 1024 * 1024
+
+
+def test_zip_dir_ignores_order_timestamps_and_owner_permissions(tmp_path):
+    first, second = tmp_path / "first", tmp_path / "second"
+    for root, names in [(first, ["b", "a", "c"]), (second, ["c", "a", "b"])]:
+        for name in names:
+            path = root / "dir" / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(name.encode() * 100)
+    os.utime(second / "dir" / "a", (0, 0))
+    (first / "dir" / "b").chmod(0o600)
+    (first / "dir" / "c").chmod(0o775)
+    (second / "dir" / "c").chmod(0o700)
+
+    Archiver.zip_dir(first, tmp_path / "first.zip")
+    Archiver.zip_dir(second, tmp_path / "second.zip")
+
+    assert (tmp_path / "first.zip").read_bytes() == (tmp_path / "second.zip").read_bytes()
+    with zipfile.ZipFile(tmp_path / "first.zip") as zfile:
+        assert zfile.namelist() == ["dir/a", "dir/b", "dir/c"]
+        if os.name != "nt":
+            assert zfile.getinfo("dir/b").external_attr >> 16 == 0o100644
+            assert zfile.getinfo("dir/c").external_attr >> 16 == 0o100755
+
+
+def test_compression_policy_stores_incompressible_files(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "text.txt").write_bytes(b"compressible " * 10000)
+    (src / "icon.png").write_bytes(b"compressible " * 10000)
+    (src / "random.bin").write_bytes(os.urandom(200 * 1024))
+    (src / "kept.txt").write_bytes(b"compressible " * 10000)
+
+    policy = CompressionPolicy(level=1, original_methods={"kept.txt": zipfile.ZIP_STORED})
+    Archiver.zip_dir(src, tmp_path / "out.zip", policy=policy)
+
+    with zipfile.ZipFile(tmp_path / "out.zip") as zfile:
+        assert zfile.testzip() is None
+        methods = {info.filename: info.compress_type for info in zfile.infolist()}
+        assert methods == {
+            "text.txt": zipfile.ZIP_DEFLATED,
+            "icon.png": zipfile.ZIP_STORED,
+            "random.bin": zipfile.ZIP_STORED,
+            "kept.txt": zipfile.ZIP_STORED,
+        }
+        assert zfile.getinfo("random.bin").compress_size == 200 * 1024
+        assert zfile.read("random.bin") == (src / "random.bin").read_bytes()
+
+    Archiver.zip_dir(src, tmp_path / "stored.zip", policy=CompressionPolicy(level=0))
+    with zipfile.ZipFile(tmp_path / "stored.zip") as zfile:
+        assert {i.compress_type for i in zfile.infolist()} == {zipfile.ZIP_STORED}
+
+
+def test_compression_policy_from_archive_skips_prefix(path_to_ipa):
+    with zipfile.ZipFile(path_to_ipa) as zfile:
+        prefix = "Payload/IOSTestApp.app/Base.lproj/"
+        policy = CompressionPolicy.from_archive(zfile, exclude_prefix=prefix)
+        assert policy.original_methods
+        assert not [n for n in policy.original_methods if n.startswith(prefix)]
+        info = zfile.getinfo("Payload/IOSTestApp.app/Info.plist")
+        assert policy.method("unused", info.filename) == info.compress_type
+
+
+def test_zip_index_lookups(path_to_ipa, sdk_zip):
+    with zipfile.ZipFile(path_to_ipa) as zfile:
+        index = ZipIndex(zfile)
+        assert index.app_in_payload() == PurePosixPath("Payload/IOSTestApp.app")
+        # ipa has no directory entries, they are implied by member paths
+        frameworks = index.find("Payload/IOSTestApp.app/Base.lproj")
+        assert frameworks.is_dir and frameworks.info is None
+        plist = index.find("Payload/IOSTestApp.app/Info.plist")
+        assert not plist.is_dir
+        assert plist.size == zfile.getinfo(plist.path).file_size
+        assert plist.offset == zfile.getinfo(plist.path).header_offset
+        assert "CFBundleIdentifier" in index.read_plist(plist.path)
+        assert index.find("Payload/Missing.app") is None
+        assert index.members() == sorted(
+            zfile.infolist(), key=lambda info: info.header_offset
+        )
+
+    with zipfile.ZipFile(sdk_zip) as zfile:
+        index = ZipIndex(zfile)
+        assert index.find_dir("ios-arm64").path == "Applitools_iOS.xcframework/ios-arm64"
+        assert index.sdk_version("Applitools_iOS.xcframework") == "1.2.3.45"
+
+
+def test_extract_specific_folder_strips_top_dirs(tmp_path, sdk_zip):
+    nested = tmp_path / "nested.zip"
+    with zipfile.ZipFile(sdk_zip) as source, zipfile.ZipFile(nested, "w") as target:
+        for member in source.infolist():
+            target.writestr("top/" + member.filename, source.read(member))
+        target.writestr("top/other.txt", b"other")
+
+    with zipfile.ZipFile(nested) as zfile:
+        extracted = Archiver.extract_specific_folder(
+            tmp_path / "out", zfile, "Applitools_iOS.xcframework"
+        )
+        with pytest.raises(RuntimeError):
+            Archiver.extract_specific_folder(tmp_path / "out", zfile, "Missing")
+    assert extracted == tmp_path / "out" / "Applitools_iOS.xcframework"
+    assert extracted.joinpath("ios-arm64", "Applitools_iOS.framework", "Info.plist").is_file()
+    assert sorted(os.listdir(tmp_path / "out")) == ["Applitools_iOS.xcframework"]
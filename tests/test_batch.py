@@ -0,0 +1,59 @@
+import shutil
+import subprocess
+import sys
+import zipfile
+from pathlib import Path
+
+from src.instrument import BatchInstrumenter, read_manifest
+from tests.utils import make_sdk_zip
+
+FRAMEWORK = "Applitools_iOS.xcframework"
+APPLITOOLSIFY = Path(__file__).absolute().parent.parent / "applitoolsify.py"
+
+
+def sdk_members(ipa):
+    with zipfile.ZipFile(ipa) as zfile:
+        return [n for n in zfile.namelist() if "/Frameworks/{}/".format(FRAMEWORK) in n]
+
+
+def test_batch_instruments_all_apps_with_shared_sdk(tmp_path, path_to_ipa, path_to_app, sdk):
+    second_ipa = tmp_path / "second.ipa"
+    shutil.copy2(path_to_ipa, second_ipa)
+    broken_ipa = tmp_path / "broken.ipa"
+    broken_ipa.write_bytes(b"not a zip")
+
+    paths = [str(path_to_ipa), str(second_ipa), str(path_to_app), str(broken_ipa)]
+    results = BatchInstrumenter(paths, sdk, False, parallel=3).run()
+
+    assert [r.path for r in results] == paths
+    assert [r.ok for r in results] == [True, True, True, False]
+    assert results[3].error
+    assert sdk_members(path_to_ipa) and sdk_members(second_ipa)
+    assert path_to_app.joinpath("Frameworks", FRAMEWORK).is_dir()
+
+
+def test_read_manifest_resolves_relative_paths(tmp_path):
+    manifest = tmp_path / "apps.txt"
+    manifest.write_text("# nightly variants\n\nfirst.ipa\n  sub/second.app \n/abs/third.ipa\n")
+    assert read_manifest(str(manifest)) == [
+        str(tmp_path / "first.ipa"),
+        str(tmp_path / "sub" / "second.app"),
+        str(Path("/abs/third.ipa")),
+    ]
+
+
+def test_batch_cli_reports_summary_exit_code(tmp_path, path_to_ipa):
+    (tmp_path / "frameworks").mkdir()
+    make_sdk_zip(tmp_path / "frameworks" / "{}.zip".format(FRAMEWORK))
+    (tmp_path / "apps.txt").write_text("{}\nmissing.ipa\n".format(path_to_ipa.name))
+
+    output = subprocess.run(
+        [sys.executable, str(APPLITOOLSIFY), "--local", "--cache-dir", "cache"]
+        + ["--manifest", "apps.txt"],
+        cwd=str(tmp_path),
+        capture_output=True,
+        text=True,
+    )
+    assert output.returncode == 1, output.stdout + output.stderr
+    assert "Summary: 1 succeeded, 1 failed" in output.stdout
+    assert sdk_members(path_to_ipa)
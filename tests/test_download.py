@@ -0,0 +1,176 @@
+import hashlib
+import os
+import tempfile
+import urllib.request
+from urllib.request import Request, urlopen
+
+import pytest
+
+from src.instrument import (
+    IntegrityError,
+    SdkCache,
+    SdkData,
+    SegmentedDownloader,
+    StreamingDownloader,
+)
+from tests.utils import make_sdk_zip, serve_directory
+
+
+def sdk_url(server, sdk_zip):
+    return "{}/{}".format(server.url, sdk_zip.name)
+
+
+def test_streaming_download_hashes_in_chunks(sdk_server, sdk_zip):
+    downloader = StreamingDownloader(sdk_url(sdk_server, sdk_zip), chunk_size=1024)
+    with tempfile.SpooledTemporaryFile(max_size=2048) as target:
+        digest = downloader.download(target)
+        assert target._rolled  # bigger than the spool limit, kept on disk
+        target.seek(0)
+        assert target.read() == sdk_zip.read_bytes()
+    assert digest == hashlib.sha256(sdk_zip.read_bytes()).hexdigest()
+    assert downloader.size == sdk_zip.stat().st_size
+
+
+def test_streaming_download_resumes_with_range(sdk_server, sdk_zip):
+    sdk_server.drop_after = 3000
+    downloader = StreamingDownloader(sdk_url(sdk_server, sdk_zip), backoff=0)
+    with tempfile.TemporaryFile() as target:
+        digest = downloader.download(target)
+        target.seek(0)
+        assert target.read() == sdk_zip.read_bytes()
+    assert digest == hashlib.sha256(sdk_zip.read_bytes()).hexdigest()
+    assert sdk_server.requests == [("GET", None), ("GET", "bytes=3000-")]
+
+
+def test_streaming_download_retries_refused_reconnect(sdk_server, sdk_zip, monkeypatch):
+    sdk_server.drop_after = 3000
+    calls = []
+
+    def flaky_urlopen(request):
+        calls.append(request)
+        if len(calls) == 2:
+            raise ConnectionRefusedError("refused")
+        return urlopen(request)
+
+    monkeypatch.setattr(urllib.request, "urlopen", flaky_urlopen)
+    downloader = StreamingDownloader(sdk_url(sdk_server, sdk_zip), backoff=0)
+    with tempfile.TemporaryFile() as target:
+        downloader.download(target)
+        target.seek(0)
+        assert target.read() == sdk_zip.read_bytes()
+    assert len(calls) == 3
+    assert sdk_server.requests == [("GET", None), ("GET", "bytes=3000-")]
+
+
+def test_streaming_download_restarts_without_range_support(sdk_zip):
+    with serve_directory(sdk_zip.parent, ranges=False) as server:
+        server.drop_after = 3000
+        downloader = StreamingDownloader(sdk_url(server, sdk_zip), backoff=0)
+        with tempfile.TemporaryFile() as target:
+            downloader.download(target)
+            target.seek(0)
+            assert target.read() == sdk_zip.read_bytes()
+        assert server.requests == [("GET", None), ("GET", None)]
+
+
+def test_sdk_cache_over_http_revalidates_with_etag(tmp_path, sdk_server, sdk_zip):
+    uri = sdk_url(sdk_server, sdk_zip)
+    sdk_data = SdkData("Applitools_iOS.xcframework", uri, uri)
+    cache = SdkCache(tmp_path / "cache")
+    first = cache.fetch(sdk_data, uri)
+    second = cache.fetch(sdk_data, uri)
+    assert first["key"] == second["key"]
+    assert first["sha256"] == hashlib.sha256(sdk_zip.read_bytes()).hexdigest()
+    assert len(sdk_server.requests) == 2  # second one answered with 304
+
+
+def test_segmented_download_reuses_connections(tmp_path, sdk_server, sdk_zip):
+    downloader = SegmentedDownloader(
+        sdk_url(sdk_server, sdk_zip), connections=2, segment_size=1024
+    )
+    digest = downloader.download(tmp_path / "sdk.zip")
+
+    assert (tmp_path / "sdk.zip").read_bytes() == sdk_zip.read_bytes()
+    assert digest == hashlib.sha256(sdk_zip.read_bytes()).hexdigest()
+    assert downloader.segments == -(-sdk_zip.stat().st_size // 1024)
+    ranges = sorted(r for method, r in sdk_server.requests if method == "GET")
+    assert len(ranges) == downloader.segments
+    # one connection for HEAD, then at most one per worker
+    assert len(sdk_server.connections) <= 3 < downloader.segments
+
+
+def test_segmented_download_retries_dropped_segment(tmp_path, sdk_server, sdk_zip):
+    sdk_server.drop_after = 100
+    downloader = SegmentedDownloader(
+        sdk_url(sdk_server, sdk_zip), connections=4, segment_size=1024, backoff=0
+    )
+    downloader.download(tmp_path / "sdk.zip")
+
+    assert (tmp_path / "sdk.zip").read_bytes() == sdk_zip.read_bytes()
+    resumed = [
+        r for _, r in sdk_server.requests if r and int(r[6:].split("-")[0]) % 1024 == 100
+    ]
+    assert len(resumed) == 1
+
+
+def test_segmented_download_falls_back_to_single_stream(tmp_path, sdk_zip):
+    with serve_directory(sdk_zip.parent, ranges=False) as server:
+        downloader = SegmentedDownloader(sdk_url(server, sdk_zip), segment_size=1024)
+        downloader.download(tmp_path / "sdk.zip")
+        assert server.requests == [("HEAD", None), ("GET", None)]
+    assert downloader.segments == 1
+    assert (tmp_path / "sdk.zip").read_bytes() == sdk_zip.read_bytes()
+
+
+def test_segmented_download_restarts_when_resource_changes(tmp_path, sdk_server, sdk_zip):
+    url = sdk_url(sdk_server, sdk_zip)
+    response = urlopen(Request(url, method="HEAD"))
+    make_sdk_zip(sdk_zip, version="2.0.0")
+    os.utime(sdk_zip, ns=(0, 0))  # new ETag
+
+    downloader = SegmentedDownloader(url, connections=2, segment_size=1024, backoff=0)
+    downloader.download(tmp_path / "sdk.zip", response)
+    assert (tmp_path / "sdk.zip").read_bytes() == sdk_zip.read_bytes()
+    assert downloader.segments == 1
+    # segments queued after the change are cancelled, not fetched
+    ranged = [r for method, r in sdk_server.requests if method == "GET" and r]
+    assert len(ranged) <= 2 < -(-sdk_zip.stat().st_size // 1024)
+
+
+def test_segmented_download_checks_pinned_digest(tmp_path, sdk_server, sdk_zip):
+    uri = sdk_url(sdk_server, sdk_zip)
+    sha256 = hashlib.sha256(sdk_zip.read_bytes()).hexdigest()
+    downloader = SegmentedDownloader(uri, segment_size=1024, expected_sha256=sha256.upper())
+    assert downloader.download(tmp_path / "sdk.zip") == sha256
+
+    downloader = SegmentedDownloader(uri, segment_size=1024, expected_sha256="0" * 64)
+    with pytest.raises(IntegrityError):
+        downloader.download(tmp_path / "sdk.zip")
+
+
+def test_streaming_download_checks_published_digest(sdk_server, sdk_zip):
+    sdk_server.checksum = hashlib.sha256(b"other").hexdigest()
+    downloader = StreamingDownloader(sdk_url(sdk_server, sdk_zip))
+    with tempfile.TemporaryFile() as target:
+        with pytest.raises(IntegrityError):
+            downloader.download(target)
+
+
+def test_sdk_cache_redownloads_on_published_digest_change(tmp_path, sdk_server, sdk_zip):
+    uri = sdk_url(sdk_server, sdk_zip)
+    sdk_data = SdkData("Applitools_iOS.xcframework", uri, uri)
+    cache = SdkCache(tmp_path / "cache")
+    sdk_server.checksum = hashlib.sha256(sdk_zip.read_bytes()).hexdigest()
+    first = cache.fetch(sdk_data, uri)
+    # cache hit is trusted without hashing the archive again
+    cache.entry_dir(first["key"]).joinpath(sdk_data.name + ".zip").write_bytes(b"")
+    assert cache.fetch(sdk_data, uri)["key"] == first["key"]
+
+    sdk_server.checksum = "0" * 64
+    with pytest.raises(IntegrityError):
+        cache.fetch(sdk_data, uri)
+    sdk_data.expected_sha256 = "1" * 64
+    sdk_server.checksum = None
+    with pytest.raises(IntegrityError):
+        cache.fetch(sdk_data, uri)
+    assert os.listdir(tmp_path / "cache" / "entries") == [first["key"]]
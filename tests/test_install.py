@@ -0,0 +1,160 @@
+import json
+import os
+import shutil
+import sys
+
+import pytest
+
+from src.instrument import (
+    SDK_MANIFEST_NAME,
+    FileInstaller,
+    Instrumenter,
+    SdkData,
+    build_manifest,
+    format_size,
+    xcframework_slices,
+)
+
+SIMULATOR = "ios-arm64_x86_64-simulator"
+
+
+def simulator_files(files):
+    """Files of SDK manifest installed into simulator app, device slice left out."""
+    return {name: meta for name, meta in files.items() if not name.startswith("ios-arm64/")}
+
+
+@pytest.fixture()
+def src_dir(tmp_path):
+    src = tmp_path / "src"
+    src.joinpath("nested").mkdir(parents=True)
+    src.joinpath("binary").write_bytes(os.urandom(10000))
+    src.joinpath("nested", "Info.plist").write_bytes(b"plist" * 100)
+    src.joinpath("binary").chmod(0o755)
+    return src
+
+
+def install(src, dst, mode):
+    installer = FileInstaller(mode)
+    shutil.copytree(src, dst, copy_function=installer.copy_file)
+    assert dst.joinpath("binary").read_bytes() == src.joinpath("binary").read_bytes()
+    assert dst.joinpath("nested", "Info.plist").read_bytes() == b"plist" * 100
+    return installer
+
+
+def test_install_copy(src_dir, tmp_path):
+    installer = install(src_dir, tmp_path / "dst", "copy")
+    assert installer.stats == {"copy": [2, 10500]}
+    assert installer.bytes_avoided == 0
+    assert os.stat(tmp_path / "dst" / "binary").st_mode & 0o777 == 0o755
+    assert installer.report() == "Installed 2 files with copy; avoided copying 0 B"
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="hardlinks need admin rights")
+def test_install_hardlink_shares_inodes(src_dir, tmp_path):
+    installer = install(src_dir, tmp_path / "dst", "hardlink")
+    assert installer.stats == {"hardlink": [2, 10500]}
+    assert installer.bytes_avoided == 10500
+    assert os.path.samefile(tmp_path / "dst" / "binary", src_dir / "binary")
+
+
+def test_install_auto_falls_back_to_supported_method(src_dir, tmp_path):
+    installer = install(src_dir, tmp_path / "dst", "auto")
+    assert sum(files for files, _ in installer.stats.values()) == 2
+    assert set(installer.stats) <= {"reflink", "copy_file_range", "copy"}
+    assert not os.path.samefile(tmp_path / "dst" / "binary", src_dir / "binary")
+
+
+def test_install_unknown_mode():
+    with pytest.raises(ValueError):
+        FileInstaller("symlink")
+
+
+def test_format_size():
+    assert format_size(10) == "10 B"
+    assert format_size(1536) == "1.5 KB"
+    assert format_size(3 * 1024 ** 3) == "3.0 GB"
+
+
+def test_app_strategy_reports_install_method(path_to_app, sdk, capsys):
+    assert Instrumenter(path_to_app, sdk, False, install_mode="copy").instrumentify()
+    assert "with copy" in capsys.readouterr().out
+    installed = path_to_app.joinpath("Frameworks", sdk.name)
+    assert installed.joinpath(SIMULATOR, "Applitools_iOS.framework", "Info.plist").is_file()
+    # test app is built for simulator, device slice is not installed
+    assert not installed.joinpath("ios-arm64").exists()
+
+
+def test_xcframework_slices_match_platform_and_variant():
+    info = {
+        "AvailableLibraries": [
+            {"LibraryIdentifier": "ios-arm64", "SupportedPlatform": "ios"},
+            {
+                "LibraryIdentifier": SIMULATOR,
+                "SupportedPlatform": "ios",
+                "SupportedPlatformVariant": "simulator",
+            },
+        ]
+    }
+    assert xcframework_slices(info, ("ios", None)) == ("ios-arm64", ["ios-arm64", SIMULATOR])
+    assert xcframework_slices(info, ("ios", "simulator"))[0] == SIMULATOR
+    assert xcframework_slices(info, ("tvos", None))[0] is None
+
+
+def test_app_strategy_installs_whole_sdk_without_info_plist(path_to_app, sdk):
+    sdk.sdk_location.joinpath("Info.plist").unlink()
+    sdk.files = None
+    assert Instrumenter(path_to_app, sdk, False).instrumentify()
+    installed = path_to_app.joinpath("Frameworks", sdk.name)
+    assert installed.joinpath("ios-arm64").is_dir()
+    assert installed.joinpath(SIMULATOR).is_dir()
+
+
+def test_reinstrument_app_skips_up_to_date_sdk(path_to_app, sdk, capsys):
+    assert Instrumenter(path_to_app, sdk, False).instrumentify()
+    installed = path_to_app.joinpath("Frameworks", sdk.name)
+    manifest = json.loads(installed.joinpath(SDK_MANIFEST_NAME).read_text())
+    assert manifest["version"] == "1.2.3.45"
+    assert manifest["files"] == simulator_files(build_manifest(sdk.sdk_location))
+    mtimes = {p: p.stat().st_mtime_ns for p in installed.rglob("*")}
+    capsys.readouterr()
+
+    assert Instrumenter(path_to_app, sdk, False).instrumentify()
+    assert "is already instrumented with" in capsys.readouterr().out
+    assert {p: p.stat().st_mtime_ns for p in installed.rglob("*")} == mtimes
+
+
+def test_reinstrument_app_touches_only_changed_files(tmp_path, path_to_app, sdk):
+    assert Instrumenter(path_to_app, sdk, False, install_mode="copy").instrumentify()
+    installed = path_to_app.joinpath("Frameworks", sdk.name)
+    headers = SIMULATOR + "/Applitools_iOS.framework/Headers/Applitools_iOS.h"
+    unchanged_inode = installed.joinpath(headers).stat().st_ino
+
+    new_sdk = SdkData(sdk.name, sdk.download_url, sdk.local_url)
+    new_sdk.add_sdk_location(tmp_path / "new" / sdk.name)
+    new_sdk.version = "1.3.0.1"
+    shutil.copytree(sdk.sdk_location, new_sdk.sdk_location)
+    binary = SIMULATOR + "/Applitools_iOS.framework/Applitools_iOS"
+    new_sdk.sdk_location.joinpath(binary).write_bytes(b"new binary")
+    removed = SIMULATOR + "/Applitools_iOS.framework/Info.plist"
+    new_sdk.sdk_location.joinpath(removed).unlink()
+    new_sdk.sdk_location.joinpath(SIMULATOR, "added.txt").write_bytes(b"added")
+
+    instrumenter = Instrumenter(path_to_app, new_sdk, False, install_mode="copy")
+    assert not instrumenter._instrumenter.is_up_to_date()
+    assert instrumenter.instrumentify()
+
+    assert installed.joinpath(headers).stat().st_ino == unchanged_inode
+    assert installed.joinpath(binary).read_bytes() == b"new binary"
+    assert installed.joinpath(SIMULATOR, "added.txt").read_bytes() == b"added"
+    assert not installed.joinpath(removed).exists()
+    manifest = json.loads(installed.joinpath(SDK_MANIFEST_NAME).read_text())
+    assert manifest["version"] == "1.3.0.1"
+    assert manifest["files"] == simulator_files(build_manifest(new_sdk.sdk_location))
+
+
+def test_reinstrument_ipa_skips_up_to_date_sdk(path_to_ipa, sdk):
+    assert Instrumenter(path_to_ipa, sdk, False).instrumentify()
+    instrumented = path_to_ipa.read_bytes()
+    assert Instrumenter(path_to_ipa, sdk, False)._instrumenter.is_up_to_date()
+    assert Instrumenter(path_to_ipa, sdk, False).instrumentify()
+    assert path_to_ipa.read_bytes() == instrumented
@@ -0,0 +1,107 @@
+import json
+import zipfile
+
+import pytest
+
+from src.instrument import (
+    SDK_MANIFEST_NAME,
+    Instrumenter,
+    MachOHeader,
+    thin_macho,
+)
+from tests.utils import make_fat_macho, make_macho
+
+ARM64 = (0x0100000C, 0)
+ARM64E = (0x0100000C, 0x80000002)  # with pointer authentication ABI bits
+ARM64E_ARCH = (0x0100000C, 2)
+X86_64 = (0x01000007, 3)
+ARMV7 = (12, 9)
+SDK_BINARY = "{}/Applitools_iOS.framework/Applitools_iOS"
+
+
+@pytest.fixture()
+def fat_binary(tmp_path):
+    path = tmp_path / "fat"
+    path.write_bytes(
+        make_fat_macho([make_macho(*X86_64, 300), make_macho(*ARM64, 500), make_macho(*ARM64E)])
+    )
+    path.chmod(0o755)
+    return path
+
+
+def test_parse_fat_and_thin_headers(fat_binary):
+    header = MachOHeader.from_file(fat_binary)
+    assert header.is_fat
+    assert [str(s) for s in header.slices] == ["x86_64", "arm64", "arm64e"]
+    assert [s.offset % 4096 for s in header.slices] == [0, 0, 0]
+
+    thin = MachOHeader.parse(make_macho(*ARM64), 256)
+    assert not thin.is_fat and thin.archs == {ARM64}
+    # Java class file shares the fat magic
+    assert MachOHeader.parse(bytes.fromhex("cafebabe00000034") + b"\0" * 32) is None
+    assert MachOHeader.parse(b"#!/bin/sh\n" + b"\0" * 32) is None
+
+
+def test_thin_to_single_arch_writes_thin_file(tmp_path, fat_binary):
+    target = tmp_path / "thin"
+    assert thin_macho(fat_binary, target, {ARM64}) == 500
+    assert target.read_bytes() == make_macho(*ARM64, 500)
+    assert target.stat().st_mode & 0o777 == 0o755
+
+
+def test_thin_to_several_archs_keeps_fat_alignment(tmp_path, fat_binary):
+    target = tmp_path / "thin"
+    size = thin_macho(fat_binary, target, {X86_64, ARM64E_ARCH})
+    assert size == target.stat().st_size
+    header = MachOHeader.from_file(target)
+    assert [str(s) for s in header.slices] == ["x86_64", "arm64e"]
+    data = target.read_bytes()
+    for s, thin in zip(header.slices, [make_macho(*X86_64, 300), make_macho(*ARM64E)]):
+        assert s.offset % 4096 == 0
+        assert data[s.offset : s.offset + s.size] == thin
+
+
+def test_thin_keeps_file_without_other_or_matching_archs(tmp_path, fat_binary):
+    target = tmp_path / "thin"
+    assert thin_macho(fat_binary, target, {X86_64, ARM64, ARM64E_ARCH}) is None
+    assert thin_macho(fat_binary, target, {ARMV7}) is None
+    assert not target.exists()
+
+
+def test_app_sdk_binary_is_thinned_to_app_archs(path_to_app, sdk):
+    # test app is a simulator build for x86_64
+    binary = SDK_BINARY.format("ios-arm64_x86_64-simulator")
+    sdk.sdk_location.joinpath(binary).write_bytes(
+        make_fat_macho([make_macho(*X86_64, 300), make_macho(*ARM64)])
+    )
+    sdk.files = None
+    assert Instrumenter(path_to_app, sdk, False, install_mode="hardlink").instrumentify()
+
+    installed = path_to_app.joinpath("Frameworks", sdk.name)
+    assert installed.joinpath(binary).read_bytes() == make_macho(*X86_64, 300)
+    # SDK cache is not written through the hardlink
+    assert MachOHeader.from_file(sdk.sdk_location.joinpath(binary)).is_fat
+    manifest = json.loads(installed.joinpath(SDK_MANIFEST_NAME).read_text())
+    assert manifest["files"][binary]["size"] == 300
+    assert manifest["files"][binary]["archs"] == ["x86_64"]
+
+    instrumenter = Instrumenter(path_to_app, sdk, False)
+    assert instrumenter.instrumentify() and instrumenter.up_to_date
+
+
+def test_spliced_sdk_binary_is_thinned_to_app_archs(path_to_ipa, sdk):
+    # test ipa executable is armv7 and arm64
+    binary = SDK_BINARY.format("ios-arm64")
+    fat = make_fat_macho(
+        [make_macho(*ARMV7), make_macho(*X86_64), make_macho(*ARM64)], align=14
+    )
+    sdk.sdk_location.joinpath(binary).write_bytes(fat)
+    sdk.files = None
+    assert Instrumenter(path_to_ipa, sdk, False).instrumentify()
+
+    with zipfile.ZipFile(path_to_ipa) as zfile:
+        data = zfile.read("Payload/IOSTestApp.app/Frameworks/{}/{}".format(sdk.name, binary))
+    header = MachOHeader.parse(data, len(data))
+    assert [str(s) for s in header.slices] == ["armv7", "arm64"]
+    assert all(s.offset % (1 << 14) == 0 and s.align == 14 for s in header.slices)
+    assert data[header.slices[1].offset :] == make_macho(*ARM64)
@@ -0,0 +1,82 @@
+import json
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import src.instrument as instrument
+from src.instrument import Instrumenter, Profiler, profile_span
+from tests.utils import make_sdk_zip
+
+FRAMEWORK = "Applitools_iOS.xcframework"
+APPLITOOLSIFY = Path(__file__).absolute().parent.parent / "applitoolsify.py"
+
+
+def test_profiler_records_spans_of_threads():
+    profiler = Profiler()
+    def sign():
+        with profiler.span("codesign", "subprocess"):
+            pass
+
+    with profiler.span("outer", bytes=10) as span:
+        span["files"] = 2
+        threads = [threading.Thread(target=sign) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    spans = profiler.spans()
+    assert [s["name"] for s in spans] == ["codesign", "codesign", "outer"]
+    outer = spans[2]
+    assert outer["args"] == {"bytes": 10, "files": 2}
+    assert all(outer["ts"] <= s["ts"] for s in spans)
+    # every thread is named once for the trace viewer
+    named = [e["tid"] for e in profiler.events if e["ph"] == "M"]
+    assert sorted(named) == sorted({s["tid"] for s in spans})
+
+    summary = profiler.summary().splitlines()
+    assert summary[1].split()[:2] == ["outer", "1"]
+    assert summary[2].split()[:2] == ["subprocess:codesign", "2"]
+
+
+def test_profile_span_is_noop_without_profiler():
+    assert instrument.PROFILER is None
+    with profile_span("anything", files=1) as span:
+        assert span == {"files": 1}
+
+
+def test_profile_splice_phases(tmp_path, path_to_ipa, sdk, monkeypatch):
+    profiler = Profiler()
+    monkeypatch.setattr(instrument, "PROFILER", profiler)
+    assert Instrumenter(path_to_ipa, sdk, False).instrumentify()
+
+    spans = {s["name"]: s for s in profiler.spans()}
+    assert {"instrument", "splice", "copy_raw", "copy_raw_sdk"} <= set(spans)
+    assert spans["copy_raw"]["args"]["files"] > 0
+    device_files = [n for n in sdk.manifest()["files"] if "-simulator/" not in n]
+    assert spans["copy_raw_sdk"]["args"]["files"] == len(device_files)
+
+    trace_file = tmp_path / "trace.json"
+    profiler.write_trace(trace_file)
+    with open(trace_file) as f:
+        trace = json.load(f)
+    assert len(trace["traceEvents"]) == len(profiler.events)
+
+
+def test_cli_writes_trace_file(tmp_path, path_to_ipa):
+    (tmp_path / "frameworks").mkdir()
+    make_sdk_zip(tmp_path / "frameworks" / "{}.zip".format(FRAMEWORK))
+
+    output = subprocess.run(
+        [sys.executable, str(APPLITOOLSIFY), "--local", "--no-cache"]
+        + ["--trace-file", "trace.json", str(path_to_ipa)],
+        cwd=str(tmp_path),
+        capture_output=True,
+        text=True,
+    )
+    assert output.returncode == 0, output.stdout + output.stderr
+    assert "Trace written to `trace.json`" in output.stdout
+    with open(tmp_path / "trace.json") as f:
+        names = {e["name"] for e in json.load(f)["traceEvents"]}
+    assert {"sdk", "download", "extract_sdk", "instrument", "splice"} <= names
@@ -0,0 +1,82 @@
+import plistlib
+import zipfile
+
+import pytest
+
+from src import instrument
+from src.instrument import cms_signed_content, read_entitlements
+from tests.conftest import get_resource_path
+
+SIGNED_DATA_OID = bytes.fromhex("06092a864886f70d010702")
+
+
+def der(tag, content):
+    length = len(content)
+    if length < 0x80:
+        return bytes([tag, length]) + content
+    size = (length.bit_length() + 7) // 8
+    return bytes([tag, 0x80 | size]) + length.to_bytes(size, "big") + content
+
+
+def indefinite(tag, *children):
+    return bytes([tag, 0x80]) + b"".join(children) + b"\0\0"
+
+
+@pytest.fixture()
+def profile_path(tmp_path):
+    with zipfile.ZipFile(get_resource_path("IOSTestApp.ipa")) as zfile:
+        data = zfile.read("Payload/IOSTestApp.app/embedded.mobileprovision")
+    path = tmp_path / "embedded.mobileprovision"
+    path.write_bytes(data)
+    return path
+
+
+def test_read_entitlements_of_signed_profile(profile_path):
+    entitlements = plistlib.loads(read_entitlements(profile_path))
+    assert entitlements["com.apple.developer.team-identifier"] == "VG29NU3JGS"
+    assert entitlements["get-task-allow"] is True
+
+
+def test_read_entitlements_is_memoized_by_content(profile_path, tmp_path, monkeypatch):
+    first = read_entitlements(profile_path)
+    copy = tmp_path / "copy.mobileprovision"
+    copy.write_bytes(profile_path.read_bytes())
+
+    def fail(data):
+        raise AssertionError("parsed again")
+
+    monkeypatch.setattr(instrument, "cms_signed_content", fail)
+    assert read_entitlements(copy) == first
+
+
+def test_cms_content_with_indefinite_lengths_and_chunks():
+    payload = plistlib.dumps({"Entitlements": {"a": 1}})
+    data = indefinite(
+        0x30,
+        SIGNED_DATA_OID,
+        indefinite(
+            0xA0,
+            indefinite(
+                0x30,
+                der(0x02, b"\x01"),
+                der(0x31, b""),
+                indefinite(
+                    0x30,
+                    der(0x06, bytes.fromhex("2a864886f70d010701")),
+                    indefinite(
+                        0xA0,
+                        indefinite(0x24, der(0x04, payload[:10]), der(0x04, payload[10:])),
+                    ),
+                ),
+                der(0x31, b""),
+            ),
+        ),
+    )
+    assert cms_signed_content(data) == payload
+
+
+def test_cms_content_rejects_other_data():
+    with pytest.raises(RuntimeError):
+        cms_signed_content(der(0x30, der(0x06, b"\x2a\x03") + der(0x04, b"x")))
+    with pytest.raises(RuntimeError):
+        cms_signed_content(b"\x30\x82\x10")
@@ -0,0 +1,98 @@
+import shutil
+import time
+
+from src.instrument import Instrumenter, ResultCache
+
+
+def test_splice_output_is_deterministic(tmp_path, path_to_ipa, sdk):
+    copy = tmp_path / "copy" / path_to_ipa.name
+    copy.parent.mkdir()
+    shutil.copy2(path_to_ipa, copy)
+    assert Instrumenter(path_to_ipa, sdk, False).instrumentify()
+    time.sleep(2)  # zip timestamps have 2s resolution
+    assert Instrumenter(copy, sdk, False).instrumentify()
+    assert copy.read_bytes() == path_to_ipa.read_bytes()
+
+
+def test_result_cache_returns_stored_artifact(tmp_path, path_to_ipa, sdk):
+    cache = ResultCache(tmp_path / "results")
+    original = tmp_path / "original.ipa"
+    shutil.copy2(path_to_ipa, original)
+
+    first = Instrumenter(path_to_ipa, sdk, False, result_cache=cache)
+    assert first.instrumentify() and not first.cached
+    instrumented = path_to_ipa.read_bytes()
+
+    again = tmp_path / "again.ipa"
+    shutil.copy2(original, again)
+    second = Instrumenter(again, sdk, False, result_cache=cache)
+    assert second.instrumentify() and second.cached
+    assert again.read_bytes() == instrumented
+
+    # other options give other output
+    other = tmp_path / "other.ipa"
+    shutil.copy2(original, other)
+    third = Instrumenter(other, sdk, False, compression_level=0, result_cache=cache)
+    assert third.instrumentify() and not third.cached
+    assert len(list(cache.root.iterdir())) == 2
+
+
+def test_result_cache_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(tmp_path / "results", max_entries=2)
+
+    def put(key):
+        source = tmp_path / "{}.ipa".format(key)
+        source.write_bytes(key.encode())
+        cache.put(key, source)
+        time.sleep(0.05)
+
+    put("a")
+    put("b")
+    assert cache.get("a", tmp_path / "out.ipa")  # used later than `b`
+    time.sleep(0.05)
+    put("c")
+    assert sorted(p.name for p in cache.root.iterdir()) == ["a.ipa", "c.ipa"]
+    assert not cache.get("b", tmp_path / "out.ipa")
+
+
+def test_result_cache_skips_up_to_date_and_large_artifacts(tmp_path, path_to_ipa, sdk):
+    assert Instrumenter(path_to_ipa, sdk, False).instrumentify()
+    cache = ResultCache(tmp_path / "results")
+    instrumenter = Instrumenter(path_to_ipa, sdk, False, result_cache=cache)
+    assert instrumenter.instrumentify() and instrumenter.up_to_date
+    assert not cache.root.exists()
+
+    source = tmp_path / "large.ipa"
+    source.write_bytes(b"0" * 1024)
+    assert not ResultCache(tmp_path / "results", max_size=1023).put("large", source)
+    assert not cache.root.exists()
+
+
+def test_result_cache_hit_does_not_extract_app(tmp_path, path_to_ipa, sdk):
+    cache = ResultCache(tmp_path / "results")
+    original = tmp_path / "original.ipa"
+    shutil.copy2(path_to_ipa, original)
+    assert Instrumenter(path_to_ipa, sdk, False, splice=False, result_cache=cache).instrumentify()
+
+    scratch_dir = tmp_path / "scratch"
+    instrumenter = Instrumenter(
+        original, sdk, False, splice=False, result_cache=cache, scratch_dir=scratch_dir
+    )
+    assert instrumenter.instrumentify() and instrumenter.cached
+    assert instrumenter._strategy_instance is None
+    assert not scratch_dir.exists()
+
+
+def test_result_cache_key_depends_on_provisioning_profile_content(
+    tmp_path, path_to_ipa, sdk, monkeypatch
+):
+    cache = ResultCache(tmp_path / "results")
+    keys = []
+    monkeypatch.setattr(cache, "get", lambda key, target: keys.append(key) or True)
+    profile = tmp_path / "app.mobileprovision"
+    for content in (b"first", b"second"):
+        profile.write_bytes(content)
+        assert Instrumenter(
+            path_to_ipa, sdk, False, "certificate", str(profile), result_cache=cache
+        ).instrumentify()
+    assert len(set(keys)) == 2
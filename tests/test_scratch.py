@@ -0,0 +1,140 @@
+import os
+import shutil
+import tempfile
+import zipfile
+from collections import namedtuple
+
+import pytest
+
+from src import instrument
+from src.instrument import Instrumenter, ScratchSpace
+
+DiskUsage = namedtuple("DiskUsage", "total used free")
+
+
+@pytest.fixture()
+def disk_free(monkeypatch):
+    """Free space reported for dirs, real one for dirs not listed."""
+    free = {}
+    disk_usage = shutil.disk_usage
+
+    def fake_disk_usage(path):
+        if str(path) in free:
+            return DiskUsage(free[str(path)], 0, free[str(path)])
+        return disk_usage(path)
+
+    monkeypatch.setattr(shutil, "disk_usage", fake_disk_usage)
+    return free
+
+
+def test_scratch_prefers_given_dir_when_it_fits(tmp_path, disk_free):
+    scratch_dir = tmp_path / "ram"
+    disk_free[str(scratch_dir)] = 1024 ** 3
+    with ScratchSpace(1024, scratch_dir) as scratch:
+        assert scratch.path.parent == scratch_dir
+        scratch.path.joinpath("file").write_bytes(b"data")
+    assert os.listdir(scratch_dir) == []
+
+    disk_free[str(scratch_dir)] = 1024
+    with ScratchSpace(1024, scratch_dir) as scratch:
+        assert scratch.path.parent != scratch_dir
+
+
+def test_scratch_fails_fast_without_space(tmp_path, disk_free, monkeypatch):
+    monkeypatch.setattr(instrument, "SCRATCH_RAM_DIRS", [str(tmp_path)])
+    disk_free[str(tmp_path)] = 0
+    disk_free[tempfile.gettempdir()] = 1024
+    with pytest.raises(RuntimeError, match="Not enough space for 1.0 GB"):
+        ScratchSpace(1024 ** 3)
+    assert os.listdir(tmp_path) == []
+
+
+def test_interrupted_scratch_is_removed_at_exit(tmp_path):
+    scratch = ScratchSpace(0, tmp_path)
+    ScratchSpace.remove_all()
+    assert not scratch.path.exists()
+
+
+def test_ipa_scratch_is_removed_after_interrupt_and_run(tmp_path, path_to_ipa, sdk):
+    scratch_dir = tmp_path / "scratch"
+
+    def interrupt():
+        raise KeyboardInterrupt
+
+    instrumenter = Instrumenter(path_to_ipa, sdk, False, splice=False, scratch_dir=scratch_dir)
+    instrumenter._instrumenter._repackage = interrupt
+    assert len(os.listdir(scratch_dir)) == 1
+    with pytest.raises(KeyboardInterrupt):
+        instrumenter.instrumentify()
+    assert os.listdir(scratch_dir) == []
+
+    instrumenter = Instrumenter(path_to_ipa, sdk, False, splice=False, scratch_dir=scratch_dir)
+    assert instrumenter.instrumentify()
+    assert os.listdir(scratch_dir) == []
+
+
+def test_scratch_counts_space_reserved_by_other_scratch_dirs(tmp_path, disk_free):
+    scratch_dir = tmp_path / "ram"
+    disk_free[str(scratch_dir)] = 2 * instrument.SCRATCH_RESERVE + 1024
+    with ScratchSpace(instrument.SCRATCH_RESERVE, scratch_dir) as first:
+        assert first.path.parent == scratch_dir
+        with ScratchSpace(instrument.SCRATCH_RESERVE, scratch_dir) as second:
+            assert second.path.parent != scratch_dir
+    with ScratchSpace(instrument.SCRATCH_RESERVE, scratch_dir) as third:
+        assert third.path.parent == scratch_dir
+
+
+def test_splice_without_thinned_files_uses_no_scratch(tmp_path, path_to_ipa, sdk):
+    scratch_dir = tmp_path / "scratch"
+    instrumenter = Instrumenter(path_to_ipa, sdk, False, scratch_dir=scratch_dir)
+    assert instrumenter.instrumentify()
+    assert not instrumenter._instrumenter.thinned_files
+    assert not scratch_dir.exists()
+
+
+def test_scratch_reservation_does_not_walk_other_dirs(tmp_path, disk_free, monkeypatch):
+    def dir_size(path):
+        raise AssertionError("scratch dirs walked")
+
+    monkeypatch.setattr(instrument, "dir_size", dir_size)
+    scratch_dir = tmp_path / "ram"
+    disk_free[str(scratch_dir)] = 2 * instrument.SCRATCH_RESERVE + 1024
+    with ScratchSpace(instrument.SCRATCH_RESERVE, scratch_dir) as first:
+        first.path.joinpath("file").write_bytes(b"data")
+        assert ScratchSpace.reserved(str(scratch_dir)) == instrument.SCRATCH_RESERVE
+    assert ScratchSpace.reserved(str(scratch_dir)) == 0
+
+
+def test_ipa_scratch_counts_installed_sdk_slices_only(tmp_path, path_to_ipa, sdk):
+    instrumenter = Instrumenter(path_to_ipa, sdk, False, splice=False, scratch_dir=tmp_path)
+    strategy = instrumenter._instrumenter
+    assert strategy.excluded_slices
+    files = sdk.manifest()["files"]
+    with zipfile.ZipFile(path_to_ipa) as zfile:
+        app_size = sum(
+            info.file_size
+            for info in zfile.infolist()
+            if info.filename.startswith(strategy._app_prefix)
+        )
+    assert strategy._scratch.required == app_size + sum(
+        entry["size"]
+        for name, entry in files.items()
+        if name.split("/", 1)[0] not in strategy.excluded_slices
+    )
+    instrumenter.instrumentify()
+
+
+def test_ipa_fails_before_extraction_without_space_next_to_it(
+    tmp_path, path_to_ipa, sdk, disk_free
+):
+    original = path_to_ipa.read_bytes()
+    disk_free[str(path_to_ipa.parent)] = path_to_ipa.stat().st_size
+    scratch_dir = tmp_path / "scratch"
+    for splice in (False, True):
+        instrumenter = Instrumenter(
+            path_to_ipa, sdk, False, splice=splice, scratch_dir=scratch_dir
+        )
+        with pytest.raises(RuntimeError, match="Not enough space for .* of `"):
+            instrumenter.instrumentify()
+        assert path_to_ipa.read_bytes() == original
+        assert os.listdir(scratch_dir) == []
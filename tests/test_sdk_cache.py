@@ -0,0 +1,82 @@
+import os
+import threading
+
+from src.instrument import SdkCache, SdkDownloadManager
+from tests.utils import make_sdk_zip
+
+
+def test_sdk_cache_reuses_extracted_sdk(tmp_path, sdk_data):
+    cache = SdkCache(tmp_path / "cache")
+    with SdkDownloadManager(sdk_data, local=False, cache=cache) as sdk:
+        first_location = sdk.sdk_location
+        assert sdk.version == "1.2.3.45"
+        assert first_location.joinpath("ios-arm64").is_dir()
+    # cached copy outlives the run
+    assert first_location.is_dir()
+    marker = first_location.joinpath("marker")
+    marker.touch()
+
+    with SdkDownloadManager(sdk_data, local=False, cache=cache) as sdk:
+        assert sdk.sdk_location == first_location
+        assert marker.exists()  # not extracted again
+
+
+def test_sdk_cache_revalidates_changed_source(tmp_path, sdk_zip, sdk_data):
+    cache = SdkCache(tmp_path / "cache")
+    first = cache.fetch(sdk_data, sdk_data.download_url)
+
+    make_sdk_zip(sdk_zip, version="1.3.0")
+    os.utime(sdk_zip, (0, 0))  # `file://` Last-Modified has 1s resolution
+    second = cache.fetch(sdk_data, sdk_data.download_url)
+
+    assert second["key"] != first["key"]
+    assert second["version"] == "1.3.0.45"
+    assert cache.entry_dir(second["key"]).joinpath(sdk_data.name).is_dir()
+
+
+def test_sdk_cache_evicts_lru_entries_not_in_use(tmp_path, sdk_zip, sdk_data):
+    cache = SdkCache(tmp_path / "cache", max_entries=1, evict_grace=0)
+    first = cache.fetch(sdk_data, sdk_data.download_url)
+    lease = cache.lease(first["key"])
+
+    make_sdk_zip(sdk_zip, version="2.0.0")
+    os.utime(sdk_zip, (0, 0))
+    second = cache.fetch(sdk_data, sdk_data.download_url)
+    if os.name != "nt":
+        # leased entry is kept while in use
+        assert cache.entry_dir(first["key"]).is_dir()
+
+    lease.release()
+    assert cache.evict() == [first["key"]]
+    assert not cache.entry_dir(first["key"]).exists()
+    assert cache.entry_dir(second["key"]).is_dir()
+
+
+def test_sdk_cache_concurrent_fetch_shares_one_entry(tmp_path, sdk_data):
+    cache_dir = tmp_path / "cache"
+    keys = []
+
+    def fetch():
+        keys.append(SdkCache(cache_dir).fetch(sdk_data, sdk_data.download_url)["key"])
+
+    threads = [threading.Thread(target=fetch) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(set(keys)) == 1 and len(keys) == 4
+    assert os.listdir(cache_dir / "entries") == [keys[0]]
+
+
+def test_download_without_cache_leaves_cwd_clean(tmp_path, sdk_data, monkeypatch):
+    cwd = tmp_path / "cwd"
+    cwd.mkdir()
+    monkeypatch.chdir(cwd)
+    with SdkDownloadManager(sdk_data, local=False) as sdk:
+        assert sdk.version == "1.2.3.45"
+        assert sdk.sdk_location.joinpath("ios-arm64").is_dir()
+        assert sdk.archive.is_file()
+        sdk_dir = sdk.sdk_location.parent
+    assert os.listdir(cwd) == []
+    assert not sdk_dir.exists()
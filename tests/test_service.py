@@ -0,0 +1,170 @@
+import asyncio
+import io
+import json
+import threading
+import zipfile
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+from src.instrument import BatchResult, InstrumentationService
+
+FRAMEWORK = "Applitools_iOS.xcframework"
+
+
+def has_sdk(zfile):
+    return any("/Frameworks/{}/".format(FRAMEWORK) in n for n in zfile.namelist())
+
+
+def request(url, data=None, headers=None):
+    method = "POST" if data is not None else "GET"
+    try:
+        with urlopen(Request(url, data=data, headers=headers or {}, method=method)) as r:
+            return r.getcode(), r.read()
+    except HTTPError as e:
+        return e.code, e.read()
+
+
+def authorization(service):
+    return {"Authorization": "Bearer {}".format(service.token)}
+
+
+def run_with_service(service, *calls, authorized=True):
+    """Start `service` and make `(url_path, data)` requests in parallel."""
+    headers = authorization(service) if authorized else None
+
+    async def main():
+        await service.start()
+        try:
+            loop = asyncio.get_running_loop()
+            return await asyncio.gather(
+                *[
+                    loop.run_in_executor(None, request, service.url + path, data, headers)
+                    for path, data in calls
+                ]
+            )
+        finally:
+            await service.close()
+
+    return asyncio.run(main())
+
+
+def test_service_instruments_path_and_reports_metrics(path_to_ipa, sdk):
+    service = InstrumentationService(sdk, False, port=0, concurrency=2)
+    [(status, body)] = run_with_service(
+        service, ("/instrument?path={}".format(quote(str(path_to_ipa))), b"")
+    )
+    assert status == 200, body
+    assert json.loads(body)["ok"]
+    with zipfile.ZipFile(path_to_ipa) as zfile:
+        assert has_sdk(zfile)
+
+    metrics = service.metrics.snapshot()
+    assert metrics["completed"] == 1 and metrics["failed"] == 0
+    assert metrics["latency_seconds"]["max"] > 0
+    assert metrics["in_flight"] == metrics["queued"] == 0
+
+
+def test_service_returns_instrumented_upload(path_to_ipa, sdk):
+    service = InstrumentationService(sdk, False, port=0)
+    [(status, body), (_, metrics)] = run_with_service(
+        service,
+        ("/instrument?name=Upload.ipa", path_to_ipa.read_bytes()),
+        ("/metrics", None),
+    )
+    assert status == 200, body
+    with zipfile.ZipFile(io.BytesIO(body)) as zfile:
+        assert has_sdk(zfile)
+    assert "completed" in json.loads(metrics)
+    with zipfile.ZipFile(path_to_ipa) as zfile:
+        assert not has_sdk(zfile)  # upload works on a copy
+
+
+def test_service_rejects_jobs_over_queue_limit(tmp_path, sdk):
+    service = InstrumentationService(sdk, False, port=0, concurrency=1, max_queue=1)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_instrument(path):
+        started.set()
+        release.wait(10)
+        return BatchResult(path, True, 0.0)
+
+    service._run_job = slow_instrument
+    headers = authorization(service)
+
+    async def main():
+        await service.start()
+        loop = asyncio.get_running_loop()
+        try:
+            running = loop.run_in_executor(
+                None, request, service.url + "/instrument?path=/first.ipa", b"", headers
+            )
+            await loop.run_in_executor(None, started.wait, 10)
+            queued = loop.run_in_executor(
+                None, request, service.url + "/instrument?path=/second.ipa", b"", headers
+            )
+            while service.metrics.queued < 1:
+                await asyncio.sleep(0.01)
+            rejected = await loop.run_in_executor(
+                None, request, service.url + "/instrument?path=/third.ipa", b"", headers
+            )
+            release.set()
+            return rejected, await running, await queued
+        finally:
+            release.set()
+            await service.close()
+
+    rejected, running, queued = asyncio.run(main())
+    assert rejected[0] == 503
+    assert running[0] == queued[0] == 200
+    metrics = service.metrics.snapshot()
+    assert metrics["completed"] == 2 and metrics["rejected"] == 1
+
+
+def test_service_answers_bad_requests(sdk):
+    service = InstrumentationService(sdk, False, port=0)
+    not_found, relative, not_ipa, health = run_with_service(
+        service,
+        ("/unknown", None),
+        ("/instrument?path=relative.ipa", b""),
+        ("/instrument?name=app.zip", b"data"),
+        ("/health", None),
+    )
+    assert not_found[0] == 404
+    assert relative[0] == not_ipa[0] == 400
+    assert json.loads(health[1]) == {"sdk": FRAMEWORK, "version": sdk.version}
+
+
+def test_service_refuses_paths_on_non_loopback_host(path_to_ipa, sdk):
+    service = InstrumentationService(sdk, False, host="0.0.0.0", port=0)
+    [(status, body)] = run_with_service(
+        service, ("/instrument?path={}".format(quote(str(path_to_ipa))), b"")
+    )
+    assert status == 403, body
+    with zipfile.ZipFile(path_to_ipa) as zfile:
+        assert not has_sdk(zfile)
+
+
+def test_service_requires_token_for_paths(tmp_path, path_to_ipa, sdk):
+    token_file = tmp_path / "cache" / "service.token"
+    service = InstrumentationService(sdk, False, port=0, token_file=token_file)
+    path = "/instrument?path={}".format(quote(str(path_to_ipa)))
+
+    async def main():
+        await service.start()
+        try:
+            assert token_file.read_text() == service.token
+            assert token_file.stat().st_mode & 0o777 == 0o600
+            loop = asyncio.get_running_loop()
+            return [
+                await loop.run_in_executor(None, request, service.url + path, b"", headers)
+                for headers in (None, {"Authorization": "Bearer wrong"})
+            ]
+        finally:
+            await service.close()
+
+    for status, body in asyncio.run(main()):
+        assert status == 401, body
+    assert not token_file.exists()
+    with zipfile.ZipFile(path_to_ipa) as zfile:
+        assert not has_sdk(zfile)
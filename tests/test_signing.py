@@ -0,0 +1,93 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from src.instrument import SigningPlan
+
+pytestmark = pytest.mark.skipif(
+    sys.platform == "win32", reason="codesign stub is a shell script"
+)
+
+STUB = """#!{python}
+import os, sys, time
+log, target = sys.argv[1], sys.argv[-1]
+with open(log, "a") as f:
+    f.write("start {{}} {{}}\\n".format(time.time(), target))
+time.sleep(0.2)
+if target.endswith("Broken.framework"):
+    sys.exit(1)
+with open(log, "a") as f:
+    f.write("end {{}} {{}}\\n".format(time.time(), target))
+"""
+
+
+@pytest.fixture()
+def codesign_stub(tmp_path):
+    stub = tmp_path / "codesign"
+    stub.write_text(STUB.format(python=sys.executable))
+    stub.chmod(0o755)
+    return stub
+
+
+@pytest.fixture()
+def app_dir(tmp_path):
+    app = tmp_path / "Payload" / "My.app"
+    for pth in [
+        "Frameworks/A.framework",
+        "Frameworks/B.framework/Frameworks/Inner.framework",
+        "PlugIns/Ext.appex/Frameworks/C.framework",
+    ]:
+        app.joinpath(pth).mkdir(parents=True)
+    app.joinpath("Frameworks", "libswift.dylib").touch()
+    app.joinpath("Info.plist").touch()
+    return tmp_path
+
+
+def test_signing_plan_orders_nested_targets_first(app_dir):
+    plan = SigningPlan.from_dir(app_dir)
+    app = str(app_dir / "Payload" / "My.app")
+    levels = [
+        [os.path.relpath(t, app) for t in level] for level in plan.levels
+    ]
+    assert levels == [
+        [
+            os.path.join("Frameworks", "A.framework"),
+            os.path.join("Frameworks", "B.framework", "Frameworks", "Inner.framework"),
+            os.path.join("Frameworks", "libswift.dylib"),
+            os.path.join("PlugIns", "Ext.appex", "Frameworks", "C.framework"),
+        ],
+        [
+            os.path.join("Frameworks", "B.framework"),
+            os.path.join("PlugIns", "Ext.appex"),
+        ],
+        ["."],
+    ]
+    assert len(plan) == 7
+
+
+def test_signing_plan_signs_levels_in_parallel(app_dir, codesign_stub, tmp_path):
+    log = tmp_path / "log.txt"
+    plan = SigningPlan.from_dir(app_dir)
+    plan.run([str(codesign_stub), str(log)], workers=4)
+
+    events = [line.split(" ", 2) for line in log.read_text().splitlines()]
+    times = {(kind, target): float(ts) for kind, ts, target in events}
+    for lower, upper in zip(plan.levels, plan.levels[1:]):
+        assert max(times["end", t] for t in lower) <= min(times["start", t] for t in upper)
+    first_level = plan.levels[0]
+    # all targets of the level were running at the same time
+    assert max(times["start", t] for t in first_level) < min(
+        times["end", t] for t in first_level
+    )
+
+
+def test_signing_plan_stops_after_failed_level(app_dir, codesign_stub, tmp_path):
+    log = tmp_path / "log.txt"
+    app_dir.joinpath("Payload", "My.app", "Frameworks", "Broken.framework").mkdir()
+    plan = SigningPlan.from_dir(app_dir)
+    with pytest.raises(subprocess.CalledProcessError):
+        plan.run([str(codesign_stub), str(log)], workers=4)
+    signed = [line.split(" ", 2)[2] for line in log.read_text().splitlines()]
+    assert plan.levels[1][0] not in signed and plan.levels[-1][0] not in signed
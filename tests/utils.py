@@ -1,6 +1,15 @@
 import os
+import plistlib
+import re
+import struct
 import subprocess
 import sys
+import threading
+import zipfile
+from contextlib import contextmanager
+from email.utils import formatdate
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from pprint import pprint
 
@@ -29,6 +38,195 @@ def applitoolsify_cmd(path_to_app, sdk):
     return path_to_app
 
 
+def add_zip_dir(zfile, dirname):
+    # type: (zipfile.ZipFile, str) -> None
+    info = zipfile.ZipInfo(dirname)
+    info.external_attr = (0o40755 << 16) | 0x10
+    zfile.writestr(info, b"")
+
+
+def make_sdk_zip(
+    zippath,
+    name="Applitools_iOS.xcframework",
+    version="1.2.3",
+    build="45",
+    binary_size=4096,
+):
+    # type: (Path | str, str, str, str, int) -> Path
+    """Build a tiny fake xcframework archive laid out like the released one."""
+    framework = name.replace(".xcframework", ".framework")
+    binary = framework.replace(".framework", "")
+    info = plistlib.dumps(
+        {"CFBundleShortVersionString": version, "CFBundleVersion": build}
+    )
+    libraries = [
+        {
+            "LibraryIdentifier": "ios-arm64",
+            "LibraryPath": framework,
+            "SupportedArchitectures": ["arm64"],
+            "SupportedPlatform": "ios",
+        },
+        {
+            "LibraryIdentifier": "ios-arm64_x86_64-simulator",
+            "LibraryPath": framework,
+            "SupportedArchitectures": ["arm64", "x86_64"],
+            "SupportedPlatform": "ios",
+            "SupportedPlatformVariant": "simulator",
+        },
+    ]
+    with zipfile.ZipFile(zippath, "w", zipfile.ZIP_DEFLATED) as zfile:
+        add_zip_dir(zfile, name + "/")
+        zfile.writestr(
+            name + "/Info.plist",
+            plistlib.dumps({"AvailableLibraries": libraries, "CFBundlePackageType": "XFWK"}),
+        )
+        for slice_name in ["ios-arm64", "ios-arm64_x86_64-simulator"]:
+            prefix = "{}/{}/{}/".format(name, slice_name, framework)
+            add_zip_dir(zfile, "{}/{}/".format(name, slice_name))
+            add_zip_dir(zfile, prefix)
+            add_zip_dir(zfile, prefix + "Headers/")
+            zfile.writestr(prefix + "Info.plist", info)
+            zfile.writestr(prefix + binary, os.urandom(binary_size) + version.encode())
+            zfile.writestr(prefix + "Headers/" + binary + ".h", b"// header\n" * 50)
+    return Path(zippath)
+
+
+def make_macho(cputype, cpusubtype, size=256):
+    # type: (int, int, int) -> bytes
+    """Thin 64-bit little-endian Mach-O of `size` bytes, padded with its cputype."""
+    header = struct.pack("<IIIIIIII", 0xFEEDFACF, cputype, cpusubtype, 6, 0, 0, 0, 0)
+    return header + bytes([cputype & 0xFF]) * (size - len(header))
+
+
+def make_fat_macho(slices, align=12):
+    # type: (list[bytes], int) -> bytes
+    """Fat Mach-O of thin `slices`, each aligned to `2 ** align` like `lipo` does."""
+    data = b""
+    entries = []
+    offset = 8 + 20 * len(slices)
+    for thin in slices:
+        offset = (offset + (1 << align) - 1) >> align << align
+        cputype, cpusubtype = struct.unpack_from("<II", thin, 4)
+        entries.append(struct.pack(">IIIII", cputype, cpusubtype, offset, len(thin), align))
+        data += b"\0" * (offset - 8 - 20 * len(slices) - len(data)) + thin
+        offset += len(thin)
+    return struct.pack(">II", 0xCAFEBABE, len(slices)) + b"".join(entries) + data
+
+
+def make_android_sdk_zip(zippath, name="Applitools_Android", binary_size=4096):
+    # type: (Path | str, str, int) -> Path
+    """Build a fake Android SDK archive with files merged into the `apk` root."""
+    with zipfile.ZipFile(zippath, "w", zipfile.ZIP_DEFLATED) as zfile:
+        add_zip_dir(zfile, name + "/")
+        for abi in ["arm64-v8a", "x86_64"]:
+            zfile.writestr(
+                "{}/lib/{}/libapplitools.so".format(name, abi),
+                os.urandom(binary_size),
+                zipfile.ZIP_STORED,
+            )
+        zfile.writestr(name + "/assets/applitools/config.json", b'{"enabled": true}')
+    return Path(zippath)
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Local stand-in for Artifactory serving files with `ETag` and `Range` support.
+
+    Server attributes tune the behaviour: `ranges` toggles `Range` support,
+    `drop_after` closes the next response after that many bytes and every
+    request is logged to `requests` as `(command, range header)`. Connections
+    are kept alive, client addresses of them are collected in `connections`.
+    `checksum` is published in `X-Checksum-Sha256` header when set.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._send(head=True)
+
+    def do_GET(self):
+        self._send()
+
+    def _send(self, head=False):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        self.server.requests.append((self.command, self.headers.get("Range")))
+        self.server.connections.add(self.client_address)
+        stat = os.stat(path)
+        etag = '"{:x}-{:x}"'.format(stat.st_size, stat.st_mtime_ns)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            if self.server.checksum:
+                self.send_header("X-Checksum-Sha256", self.server.checksum)
+            self.end_headers()
+            return
+
+        status, start, end = 200, 0, stat.st_size - 1
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if range_header and self.server.ranges and if_range in (None, etag):
+            first, last = re.match(r"bytes=(\d+)-(\d*)$", range_header).groups()
+            status, start = 206, int(first)
+            if last:
+                end = min(int(last), end)
+        length = end + 1 - start
+
+        self.send_response(status)
+        self.send_header("Content-Length", str(length))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+        if self.server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if self.server.checksum:
+            self.send_header("X-Checksum-Sha256", self.server.checksum)
+        if status == 206:
+            self.send_header(
+                "Content-Range", "bytes {}-{}/{}".format(start, end, stat.st_size)
+            )
+        self.end_headers()
+        if head:
+            return
+        if self.server.drop_after is not None:
+            length = min(length, self.server.drop_after)
+            self.server.drop_after = None
+            self.close_connection = True
+        with open(path, "rb") as f:
+            f.seek(start)
+            while length:
+                chunk = f.read(min(length, 64 * 1024))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                length -= len(chunk)
+
+
+@contextmanager
+def serve_directory(directory, ranges=True):
+    # type: (Path | str, bool) -> ThreadingHTTPServer
+    """Serve `directory` on a free localhost port, `server.url` is its base url."""
+    handler = partial(RangeRequestHandler, directory=str(directory))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.ranges = ranges
+    server.drop_after = None
+    server.checksum = None
+    server.requests = []
+    server.connections = set()
+    server.url = "http://127.0.0.1:{}".format(server.server_port)
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+    )
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
 def upload_app_to_sauce(path_to_app_archive: str, app_name_on_sauce: str) -> int:
     import requests
 